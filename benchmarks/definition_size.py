@@ -0,0 +1,70 @@
+"""
+Benchmark loading definition files with many commands.
+
+For each size the time to parse the file and validate every command is shown along with the time to load the
+cached definition, the first is paid whenever the file changes, the second on every run.
+
+    python benchmarks/definition_size.py [--sizes 10,100,1000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def definition(commands):
+    lines = ['.config:\n  parallel: false\n']
+    for i in range(commands):
+        lines.append(
+            'command_{i}:\n'
+            '  requires: [{req}]\n'
+            '  sources: ["src/{i}/*.c"]\n'
+            '  targets: ["build/{i}.o"]\n'
+            '  run:\n'
+            '  - echo building {i}\n'
+            '  - cc -c src/{i}/main.c -o build/{i}.o\n'.format(i=i, req='command_{}'.format(i - 1) if i else '')
+        )
+    return ''.join(lines)
+
+
+def run(commands, repeat):
+    from donkey.definition import load_definition
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def_path = Path(tmp, 'makefile.yml')
+        def_path.write_text(definition(commands))
+        # recently modified definition files aren't cached
+        os.utime(str(def_path), (1e9, 1e9))
+        uncached, cached = [], []
+        for i in range(repeat):
+            os.environ['DONKEY_CACHE_DIR'] = os.path.join(tmp, 'cache_{}'.format(i))
+            start = time.perf_counter()
+            load_definition(str(def_path)).check()
+            uncached.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            load_definition(str(def_path)).check()
+            cached.append(time.perf_counter() - start)
+    return {
+        'parse and validate': min(uncached),
+        'cached': min(cached),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', default='10,100,1000', help='numbers of commands, comma separated')
+    parser.add_argument('--repeat', type=int, default=5)
+    ns = parser.parse_args()
+    for commands in map(int, ns.sizes.split(',')):
+        print('definition with {} commands, best of {}:'.format(commands, ns.repeat))
+        for name, t in run(commands, ns.repeat).items():
+            print('  {:20} {:8.2f}ms'.format(name, t * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Benchmark running many short processes at once, a "parallel" command with one line per job.
+
+    python benchmarks/fan_out.py [--jobs 1,10,100]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def run(jobs, repeat):
+    from donkey.main import execute
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DONKEY_CACHE_DIR'] = os.path.join(tmp, 'cache')
+        def_path = Path(tmp, 'makefile.yml')
+        def_path.write_text('fan_out:\n  parallel: true\n  run:\n{}'.format(
+            ''.join('  - "true {}"\n'.format(i) for i in range(jobs))
+        ))
+        stdout = sys.stdout
+        times = []
+        with open(os.devnull, 'w') as devnull:
+            sys.stdout = devnull
+            try:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    execute('fan_out', definition_file=str(def_path), jobs=jobs)
+                    times.append(time.perf_counter() - start)
+            finally:
+                sys.stdout = stdout
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--jobs', default='1,10,100', help='numbers of jobs, comma separated')
+    parser.add_argument('--repeat', type=int, default=5)
+    ns = parser.parse_args()
+    print('parallel fan out, best of {}:'.format(ns.repeat))
+    for jobs in map(int, ns.jobs.split(',')):
+        t = run(jobs, ns.repeat)
+        print('  {:4} jobs {:8.1f}ms {:8.2f}ms/job'.format(jobs, t * 1000, t * 1000 / jobs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark definition file discovery from the bottom of a deep tree where every directory has many entries.
+
+Compares the previous approach of listing every directory against the current stat based search, with and without
+the location cache.
+
+    python benchmarks/find_def_file.py [--depth 30] [--entries 2000]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+OLD_STD_FILE_NAMES = [
+    re.compile(r'donkey\.ya?ml'),
+    re.compile(r'makefile\.ya?ml'),
+]
+
+
+def old_find_def_file(p):
+    # implementation prior to the stat based search
+    files = [x for x in p.iterdir() if x.is_file()]
+    for std_file_name in OLD_STD_FILE_NAMES:
+        try:
+            return next(f for f in files if std_file_name.fullmatch(f.name))
+        except StopIteration:
+            pass
+    return old_find_def_file(p.parent)
+
+
+def build_tree(root: Path, depth: int, entries: int) -> Path:
+    root.mkdir()
+    root.joinpath('makefile.yml').write_text('foo:\n- echo foo\n')
+    p = root
+    for i in range(depth):
+        for j in range(entries):
+            p.joinpath('file_{}.txt'.format(j)).touch()
+        p = p / 'level_{}'.format(i)
+        p.mkdir()
+    # old mtimes so the location cache may be used
+    d = p
+    while d != root.parent:
+        os.utime(str(d), (1e9, 1e9))
+        d = d.parent
+    return p
+
+
+def run(depth, entries, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DONKEY_CACHE_DIR'] = os.path.join(tmp, 'cache')
+        from donkey.definition import _search_def_file, find_def_file
+
+        start = build_tree(Path(tmp, 'tree'), depth, entries)
+        assert old_find_def_file(start) == find_def_file(start)
+
+        results = {
+            'old (iterdir + regex)': timeit.timeit(lambda: old_find_def_file(start), number=repeat),
+            'stat search, uncached': timeit.timeit(lambda: _search_def_file(start), number=repeat),
+            'stat search, cached': timeit.timeit(lambda: find_def_file(start), number=repeat),
+        }
+    return {k: v / repeat for k, v in results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--depth', type=int, default=30)
+    parser.add_argument('--entries', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    ns = parser.parse_args()
+    print('find_def_file, depth {}, {} entries per directory:'.format(ns.depth, ns.entries))
+    for name, t in run(ns.depth, ns.entries, ns.repeat).items():
+        print('  {:25} {:10.3f}ms'.format(name, t * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Benchmark throughput of command output, a command writes lots of output which donkey writes to /dev/null.
+
+Compares output written directly to stdout (the default) with output sent through logging (--log-output).
+
+    python benchmarks/output_throughput.py [--size 100]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def run(size_mb, log_output):
+    from donkey.logs import setup_logging
+    from donkey.main import execute
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DONKEY_CACHE_DIR'] = os.path.join(tmp, 'cache')
+        def_path = Path(tmp, 'makefile.yml')
+        # 100 byte lines
+        def_path.write_text('output:\n- "yes {} | head -c {}"\n'.format('x' * 99, size_mb * 2 ** 20))
+        stdout = sys.stdout
+        with open(os.devnull, 'w') as devnull:
+            sys.stdout = devnull
+            try:
+                setup_logging(verbose=False)
+                start = time.perf_counter()
+                execute('output', definition_file=str(def_path), log_output=log_output)
+                return time.perf_counter() - start
+            finally:
+                sys.stdout = stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--size', type=int, default=100, help='MB of output')
+    ns = parser.parse_args()
+    print('output throughput, {}MB:'.format(ns.size))
+    for name, log_output in (('direct', False), ('logging', True)):
+        t = run(ns.size, log_output)
+        print('  {:10} {:8.2f}s {:8.1f}MB/s'.format(name, t, ns.size / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Benchmark running a command with many short lines, one process per line vs. a single shell session.
+
+    python benchmarks/session.py [--lines 100]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def run(lines, session, repeat):
+    from donkey.main import execute
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DONKEY_CACHE_DIR'] = os.path.join(tmp, 'cache')
+        def_path = Path(tmp, 'makefile.yml')
+        def_path.write_text('lines:\n  session: {}\n  run:\n{}'.format(
+            'true' if session else 'false',
+            ''.join('  - echo line {}\n'.format(i) for i in range(lines))
+        ))
+        stdout = sys.stdout
+        times = []
+        with open(os.devnull, 'w') as devnull:
+            sys.stdout = devnull
+            try:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    execute('lines', definition_file=str(def_path))
+                    times.append(time.perf_counter() - start)
+            finally:
+                sys.stdout = stdout
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--lines', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    ns = parser.parse_args()
+    print('command with {} lines, best of {}:'.format(ns.lines, ns.repeat))
+    for name, session in (('process per line', False), ('session', True)):
+        t = run(ns.lines, session, ns.repeat)
+        print('  {:20} {:8.1f}ms {:8.2f}ms/line'.format(name, t * 1000, t * 1000 / ns.lines))
+
+
+if __name__ == '__main__':
+    main()
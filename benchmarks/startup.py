@@ -0,0 +1,59 @@
+"""
+Benchmark startup time of the donkey command running a trivial command.
+
+Cold runs start with an empty cache directory so the definition file is parsed and validated, warm runs reuse the
+cached definition. Time for the interpreter alone is shown for comparison.
+
+    python benchmarks/startup.py [--repeat 10]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+CLI_CODE = 'from donkey.cli import cli; cli()'
+
+
+def time_process(args, env):
+    start = time.perf_counter()
+    subprocess.run(args, env=env, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def run(repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        def_path = Path(tmp, 'makefile.yml')
+        def_path.write_text('foo:\n- "true"\n')
+        # recently modified definition files aren't cached
+        os.utime(str(def_path), (1e9, 1e9))
+        env = dict(os.environ, PYTHONPATH=str(ROOT.resolve()), LC_ALL=os.getenv('LC_ALL', 'C.UTF-8'))
+        args = [sys.executable, '-c', CLI_CODE, '-d', str(def_path), 'foo']
+
+        cold = []
+        for i in range(repeat):
+            env['DONKEY_CACHE_DIR'] = os.path.join(tmp, 'cache_{}'.format(i))
+            cold.append(time_process(args, env))
+        warm = [time_process(args, env) for _ in range(repeat)]
+        interpreter = [time_process([sys.executable, '-c', 'pass'], env) for _ in range(repeat)]
+    return {
+        'cold': min(cold),
+        'warm': min(warm),
+        'interpreter': min(interpreter),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    ns = parser.parse_args()
+    print('startup, best of {}:'.format(ns.repeat))
+    for name, t in run(ns.repeat).items():
+        print('  {:12} {:8.1f}ms'.format(name, t * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Run all benchmarks of donkey's own overhead and save the results as JSON so versions can be compared.
+
+    python benchmarks/suite.py [--output results.json] [--compare previous.json] [--quick]
+
+With --compare each result is shown with its change from the previous results, changes for the worse of more than
+--threshold percent are reported as regressions and the exit code is 1.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# units where a larger value is better, for everything else smaller is better
+HIGHER_IS_BETTER = {'MB/s'}
+
+
+def run_benchmarks(quick):
+    """
+    Yield (name, value, unit) for each measurement.
+    """
+    # the other benchmarks are in this directory
+    sys.path.insert(0, str(Path(__file__).parent))
+    import definition_size
+    import fan_out
+    import find_def_file
+    import output_throughput
+    import session
+    import startup
+
+    repeat = 3 if quick else 10
+
+    for name, t in startup.run(repeat).items():
+        yield 'startup.{}'.format(name), t * 1000, 'ms'
+
+    depth, entries = (10, 200) if quick else (30, 2000)
+    for name, t in find_def_file.run(depth, entries, repeat).items():
+        yield 'find_def_file.{}'.format(name), t * 1000, 'ms'
+
+    for commands in (10, 100, 1000):
+        for name, t in definition_size.run(commands, repeat).items():
+            yield 'definition.{}.{}'.format(commands, name), t * 1000, 'ms'
+
+    lines = 20 if quick else 100
+    for name, session_mode in (('process per line', False), ('session', True)):
+        t = session.run(lines, session_mode, repeat)
+        yield 'spawn.{}'.format(name), t * 1000 / lines, 'ms/line'
+
+    size = 10 if quick else 100
+    t = output_throughput.run(size, False)
+    yield 'output_throughput', size / t, 'MB/s'
+
+    for jobs in (1, 10, 100):
+        t = fan_out.run(jobs, repeat)
+        yield 'fan_out.{}'.format(jobs), t * 1000, 'ms'
+
+
+def environment():
+    from donkey.version import VERSION
+    return {
+        'donkey': str(VERSION),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': datetime.datetime.now().isoformat(),
+    }
+
+
+def compare(results, previous, threshold):
+    """
+    Print the change of each result from previous, returns the names of results which got worse by more than
+    threshold percent.
+    """
+    regressions = []
+    print('\n{:45} {:>12} {:>12} {:>8}'.format('benchmark', 'previous', 'current', 'change'))
+    for name, r in results.items():
+        p = previous.get(name)
+        if not p or not p['value']:
+            continue
+        change = (r['value'] / p['value'] - 1) * 100
+        worse = -change if r['unit'] in HIGHER_IS_BETTER else change
+        flag = ''
+        if worse > threshold:
+            flag = ' regression'
+            regressions.append(name)
+        print('{:45} {:12.3f} {:12.3f} {:+7.1f}%{}'.format(name, p['value'], r['value'], change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--output', default='benchmark_results.json', help='file to save results to')
+    parser.add_argument('--compare', help='results from a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=10, help='percentage change counted as a regression')
+    parser.add_argument('--quick', action='store_true', help='fewer repeats and smaller inputs, eg. for CI')
+    ns = parser.parse_args()
+
+    results = {}
+    for name, value, unit in run_benchmarks(ns.quick):
+        results[name] = {'value': value, 'unit': unit}
+        print('{:45} {:12.3f} {}'.format(name, value, unit), flush=True)
+
+    with open(ns.output, 'w') as f:
+        json.dump({'environment': environment(), 'quick': ns.quick, 'results': results}, f, indent=2)
+    print('results saved to "{}"'.format(ns.output))
+
+    if ns.compare:
+        with open(ns.compare) as f:
+            previous = json.load(f)
+        if previous.get('quick') != ns.quick:
+            print('warning: comparing quick with full results')
+        if compare(results, previous['results'], ns.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import stat
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List
+
+from .files import expand_globs
+
+STATE_VERSION = 1
+HASH_CHUNK = 2 ** 20
+JSON_SEPARATORS = ',', ':'
+
+
+def hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class BuildState:
+    """
+    Persistent record of source file hashes and successful command runs, used to skip commands whose inputs haven't
+    changed regardless of modification times.
+
+    Both "files" and "runs" are kept in least recently used order. If the saved state would exceed max_size bytes the
+    least recently used entries are dropped, "runs" may take up to half of max_size and "files" the rest.
+    """
+    def __init__(self, path: Path, *, max_size: int=4 * 2 ** 20):
+        self.path = path
+        self.max_size = max_size
+        # absolute path > [size, mtime_ns, sha256 hex digest]
+        self.files = OrderedDict()
+        # command key > time of last successful run (or time it was last found to be up to date)
+        self.runs = OrderedDict()
+        self._changed = False
+        self._executor = None
+        self._load()
+
+    def _load(self):
+        try:
+            with self.path.open() as f:
+                data = json.load(f, object_pairs_hook=OrderedDict)
+            if data['version'] == STATE_VERSION:
+                self.files, self.runs = data['files'], data['runs']
+        except (OSError, ValueError, KeyError, TypeError):
+            # missing or corrupt state, just start again
+            pass
+
+    async def command_key(self, command: Dict[str, Any], sources: List[str], *, loop) -> str:
+        """
+        Build a key uniquely identifying a command's definition and the content of its sources.
+        """
+        paths = expand_globs(sources)
+        digests = await self._hash_files(paths, loop=loop)
+        h = hashlib.sha256(json.dumps(command, sort_keys=True).encode())
+        for path, digest in zip(paths, digests):
+            h.update('{}\0{}\n'.format(path, digest).encode())
+        return h.hexdigest()
+
+    async def _hash_files(self, paths: List[str], *, loop) -> List[str]:
+        digests = [None] * len(paths)
+        to_hash = []
+        for i, path in enumerate(paths):
+            key = os.path.abspath(path)
+            file_stat = os.stat(path)
+            cached = self.files.get(key)
+            # files with unchanged size and mtime are assumed unchanged, this avoids reading most files on most runs
+            if cached and cached[0] == file_stat.st_size and cached[1] == file_stat.st_mtime_ns:
+                digests[i] = cached[2]
+                self.files.move_to_end(key)
+            else:
+                to_hash.append((i, key, file_stat))
+
+        if to_hash:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 2)
+            results = await asyncio.gather(
+                *[loop.run_in_executor(self._executor, hash_file, key) for _, key, _ in to_hash],
+                loop=loop
+            )
+            for (i, key, file_stat), digest in zip(to_hash, results):
+                digests[i] = digest
+                self.files[key] = [file_stat.st_size, file_stat.st_mtime_ns, digest]
+                self.files.move_to_end(key)
+            self._changed = True
+        return digests
+
+    def is_fresh(self, key: str) -> bool:
+        if key not in self.runs:
+            return False
+        self.record_success(key)
+        return True
+
+    def record_success(self, key: str):
+        self.runs[key] = time.time()
+        self.runs.move_to_end(key)
+        self._changed = True
+
+    def save(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if not self._changed:
+            return
+        data = self._dumps()
+        if len(data) > self.max_size:
+            # sizes of entries are only worked out when required, generally state is well under max_size
+            overhead = len(data) - sum(_entry_size(k, v) for d in (self.files, self.runs) for k, v in d.items())
+            runs_size = _trim(self.runs, self.max_size // 2)
+            _trim(self.files, self.max_size - overhead - runs_size)
+            data = self._dumps()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with tmp_path.open('w') as f:
+            f.write(data)
+        # replace atomically so an interrupted write can't leave corrupt state
+        os.replace(str(tmp_path), str(self.path))
+        self._changed = False
+
+    def _dumps(self) -> str:
+        data = {'version': STATE_VERSION, 'files': self.files, 'runs': self.runs}
+        return json.dumps(data, separators=JSON_SEPARATORS)
+
+
+def _entry_size(key: str, value) -> int:
+    # as saved: "key":value,
+    return len(json.dumps(key)) + len(json.dumps(value, separators=JSON_SEPARATORS)) + 2
+
+
+def _trim(entries: OrderedDict, max_size: int) -> int:
+    """
+    Drop the least recently used entries until their saved size is at most max_size, returns their saved size.
+    """
+    size = sum(_entry_size(k, v) for k, v in entries.items())
+    while entries and size > max_size:
+        size -= _entry_size(*entries.popitem(last=False))
+    return size
+
+
+class ArtifactStore:
+    """
+    Content addressed store of command targets, generally shared between checkouts so identical builds only happen
+    once.
+
+    "objects/ab/<sha256>" holds file contents, "manifests/<command key>.json" lists the targets of a command and their
+    object digests. A manifest's modification time is updated whenever it's used, when objects exceed max_size
+    the least recently used manifests and any objects no longer referenced are deleted. "size" holds the running total
+    size of objects so the store only needs to be scanned when it's full.
+    """
+    def __init__(self, path: Path, *, max_size: int, link: bool=False):
+        self.path = path
+        self.max_size = max_size
+        # restore by hard link rather than copy, faster but targets modified in place would corrupt the store
+        self.link = link
+
+    def _object_path(self, digest: str) -> Path:
+        return self.path / 'objects' / digest[:2] / digest
+
+    def _manifest_path(self, key: str) -> Path:
+        return self.path / 'manifests' / (key + '.json')
+
+    def restore(self, key: str) -> bool:
+        """
+        Restore the targets stored for this key, returns False if there is nothing to restore.
+        """
+        manifest_path = self._manifest_path(key)
+        try:
+            with manifest_path.open() as f:
+                files = json.load(f)['files']
+        except (OSError, ValueError, KeyError):
+            return False
+        if not files:
+            # stored before empty manifests were refused
+            return False
+        # check every object exists before we restore anything to avoid a partial restore
+        if not all(self._object_path(info['digest']).exists() for info in files.values()):
+            return False
+
+        try:
+            for path, info in files.items():
+                self._restore_file(self._object_path(info['digest']), Path(path), info['mode'])
+            os.utime(str(manifest_path))
+        except FileNotFoundError:
+            # evicted by another process sharing the store, the command is just run
+            return False
+        return True
+
+    def _restore_file(self, obj: Path, dest: Path, mode: int):
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = dest.with_name('.{}.{}.tmp'.format(dest.name, os.getpid()))
+        if self.link:
+            try:
+                os.link(str(obj), str(tmp_path))
+            except OSError:
+                # eg. store is on a different file system, fall back to copying
+                pass
+            else:
+                os.replace(str(tmp_path), str(dest))
+                return
+        shutil.copyfile(str(obj), str(tmp_path))
+        os.chmod(str(tmp_path), mode)
+        os.replace(str(tmp_path), str(dest))
+
+    def store(self, key: str, targets: List[str]):
+        """
+        Store the files matching targets, nothing is stored if none match since restoring nothing would skip the
+        command without creating its targets.
+        """
+        files = {}
+        added = 0
+        for path in expand_globs(targets):
+            digest = hash_file(path)
+            obj = self._object_path(digest)
+            if not obj.exists():
+                obj.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = obj.with_name('{}.{}.tmp'.format(digest, os.getpid()))
+                shutil.copy2(path, str(tmp_path))
+                os.replace(str(tmp_path), str(obj))
+                added += obj.stat().st_size
+            files[path] = {'digest': digest, 'mode': stat.S_IMODE(os.stat(path).st_mode)}
+        if not files:
+            return
+
+        manifest_path = self._manifest_path(key)
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = manifest_path.with_name('{}.{}.tmp'.format(key, os.getpid()))
+        with tmp_path.open('w') as f:
+            json.dump({'files': files}, f)
+        os.replace(str(tmp_path), str(manifest_path))
+        if added and self._add_size(added) > self.max_size:
+            self.evict()
+
+    def _add_size(self, added: int) -> int:
+        """
+        Add to the running total size of objects kept in "size" so the store needn't be scanned after every store(),
+        returns the new total. The total is only approximate if several processes share the store, evict() corrects
+        it.
+        """
+        try:
+            total = int((self.path / 'size').read_text()) + added
+        except (OSError, ValueError):
+            total = sum(self._objects().values())
+        self._write_size(total)
+        return total
+
+    def _write_size(self, total: int):
+        size_path = self.path / 'size'
+        tmp_path = size_path.with_name('size.{}.tmp'.format(os.getpid()))
+        tmp_path.write_text(str(total))
+        os.replace(str(tmp_path), str(size_path))
+
+    def _objects(self) -> Dict[str, int]:
+        objects = {}
+        for p in self.path.glob('objects/*/*'):
+            if not p.name.endswith('.tmp'):
+                try:
+                    objects[p.name] = p.stat().st_size
+                except FileNotFoundError:
+                    # deleted by another process sharing the store
+                    pass
+        return objects
+
+    def evict(self):
+        # other processes sharing the store may be evicting at the same time, so files can disappear at any point
+        objects = self._objects()
+        if sum(objects.values()) > self.max_size:
+            self._evict(objects)
+            objects = self._objects()
+        self._write_size(sum(objects.values()))
+
+    def _evict(self, objects: Dict[str, int]):
+        manifests = []
+        for p in self.path.glob('manifests/*.json'):
+            try:
+                mtime = p.stat().st_mtime
+                with p.open() as f:
+                    digests = {info['digest'] for info in json.load(f)['files'].values()}
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, KeyError):
+                _unlink(p)
+                continue
+            manifests.append((mtime, p, digests))
+        manifests.sort(key=lambda m: m[0])
+
+        def referenced():
+            return set().union(*(digests for _, _, digests in manifests))
+
+        while manifests and sum(objects.get(d, 0) for d in referenced()) > self.max_size:
+            _, p, _ = manifests.pop(0)
+            _unlink(p)
+
+        keep = referenced()
+        for digest in objects:
+            if digest not in keep:
+                _unlink(self._object_path(digest))
+
+
+def _unlink(path: Path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,98 @@
+import hashlib
+import mmap
+import re
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional
+
+# longer lines are truncated in the tail so memory use doesn't depend on the output
+MAX_LINE = 4096
+# longer names are truncated so file names stay within file system limits
+MAX_NAME = 80
+
+
+def capture_path(directory: Path, name: str) -> Path:
+    """
+    Path to save the output of the job called name in. If the name had to be changed to be a safe file name, a hash
+    of it is added so different names, eg. "echo a;b" and "echo a b", don't share a file.
+    """
+    slug = re.sub(r'[^\w.-]+', '_', name).strip('_')[:MAX_NAME]
+    if slug != name:
+        slug += '-' + hashlib.sha1(name.encode()).hexdigest()[:10]
+    return directory / '{}.log'.format(slug)
+
+
+class OutputCapture:
+    """
+    Captures the output of a job with memory use independent of the size of the output: if path is set the full
+    output is appended to that file and the tail read back from it, otherwise the last "tail_lines" lines are kept
+    in memory.
+    """
+    def __init__(self, path: Optional[Path], *, tail_lines: int):
+        self.path = path
+        self.lines = deque(maxlen=tail_lines)
+        # fd > incomplete last line
+        self._partial = {}
+        self._file = None
+        if path:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = path.open('wb')
+
+    def feed(self, fd: int, data: bytes):
+        if self._file:
+            self._file.write(data)
+            # the tail is read from the file, see tail()
+            return
+        if self.lines.maxlen == 0:
+            return
+        *lines, last = data.split(b'\n')
+        if lines:
+            lines[0] = self._partial.pop(fd, b'') + lines[0]
+            self.lines.extend(line[:MAX_LINE] for line in lines[-self.lines.maxlen:])
+        if last:
+            self._partial[fd] = (self._partial.get(fd, b'') + last)[:MAX_LINE]
+
+    def tail(self) -> List[str]:
+        """
+        The last lines of output including any incomplete last lines, decoded.
+        """
+        if self.path:
+            lines = self._file_tail()
+        else:
+            lines = (list(self.lines) + list(self._partial.values()))[-self.lines.maxlen:]
+        return [line.decode(errors='replace') for line in lines]
+
+    def _file_tail(self) -> List[bytes]:
+        lines = []
+        with self.view() as m:
+            end = len(m)
+            if m[end - 1:end] == b'\n':
+                end -= 1
+            while end > 0 and len(lines) < self.lines.maxlen:
+                start = m.rfind(b'\n', 0, end) + 1
+                lines.append(m[start:min(end, start + MAX_LINE)])
+                end = start - 1
+        return lines[::-1]
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    @contextmanager
+    def view(self):
+        """
+        Memory map the full output, eg. to search it after a failure without reading it into memory.
+        """
+        if not self.path:
+            raise RuntimeError('output is only kept in full if a path is set')
+        if self._file:
+            self._file.flush()
+        with self.path.open('rb') as f:
+            if not self.path.stat().st_size:
+                # empty files can't be mapped
+                yield b''
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                yield m
@@ -1,10 +1,12 @@
 import logging
+import os
 import sys
 
 import click
 
+from .exceptions import DonkeyError, DonkeyFailure
 from .logs import setup_logging
-from .main import DonkeyError, DonkeyFailure, execute
+from .trace import span, start_trace, stop_trace
 from .version import VERSION
 
 main_logger = logging.getLogger('donkey.main')
@@ -17,9 +19,76 @@ ARGS_HELP = (
     'extra args to pass to the command, '
     'only valid if one single line command is being executed'
 )
+JOBS_HELP = (
+    '(default: number of CPUs) Maximum number of processes to run at once, '
+    'applies across all commands and within "parallel" commands.'
+)
+KEEP_GOING_HELP = (
+    '(default: fail fast) Whether to let other jobs finish when a job fails, by default running jobs are stopped '
+    'and pending jobs cancelled.'
+)
+TIMEOUT_HELP = (
+    'Seconds each process may run for before it\'s stopped, overrides "timeout" in the definition file. '
+    'Commands which time out fail with return code 124.'
+)
+LOG_OUTPUT_HELP = (
+    'send command output through python logging rather than writing it directly to stdout, this is slower.'
+)
+WATCH_HELP = (
+    'path or glob to watch, commands are run again whenever files matching it change, may be given more than once. '
+    'Commands may also set "watch" in the definition file.'
+)
+OUTPUT_HELP = (
+    'how to show the output of commands: "stream" writes output as soon as it\'s received, "grouped" writes the '
+    'output of each command in one block once it finishes.'
+)
+INTERVAL_HELP = (
+    'run commands repeatedly with this many seconds between the start of each run. '
+    'Commands may also set "interval" in the definition file.'
+)
+LOG_FILE_HELP = (
+    'also write command output and logs to this file, overrides "logging.file" in the definition file\'s ".config".'
+)
+USAGE_HELP = (
+    'show the CPU time, peak memory, block I/O and context switches of each command once commands have finished, '
+    'from python 3.12 only the total is known.'
+)
+FORMAT_HELP = (
+    '"json" writes events as JSON lines for other programs to read: run_started, command_started, '
+    'command_finished, command_skipped and run_finished. Other output is written to stderr if events go to stdout.'
+)
+EVENTS_FD_HELP = (
+    '(default: 1, stdout) file descriptor to write JSON events to, eg. "--events-fd 3" with "3>events.jsonl".'
+)
+OUTPUT_EVENTS_HELP = (
+    'with "--format json" send each line of command output as an "output" event rather than writing it as text.'
+)
+TRACE_HELP = (
+    'write a trace of the run to this file, it can be viewed in chrome://tracing or https://ui.perfetto.dev.'
+)
+SERVER_HELP = (
+    'run a donkey server which "donk" sends commands to, so definition files and imports are already loaded '
+    'when commands are run.'
+)
 DF_HELP = (
     'definition file to use, if absent the closest defintion file is found and used'
 )
+
+
+def positive(ctx, param, value):
+    if value is not None and value <= 0:
+        raise click.BadParameter('must be greater than 0')
+    return value
+
+
+def check_open_fd(fd: int):
+    try:
+        os.fstat(fd)
+    except OSError:
+        raise click.BadParameter('{} is not an open file descriptor'.format(fd), ctx=click.get_current_context(),
+                                 param_hint='"--events-fd"')
+
+
 # extra options to add in future
 # watch/interval
 # recover
@@ -30,10 +99,24 @@ DF_HELP = (
 @click.version_option(VERSION, '-V', '--version', prog_name='donkey')
 @click.argument('commands', nargs=-1)
 @click.option('--parallel/--serial', 'parallel', default=None, help=PARALLEL_HELP)
+@click.option('-j', '--jobs', type=click.IntRange(min=1), help=JOBS_HELP)
+@click.option('--keep-going/--fail-fast', 'keep_going', default=None, help=KEEP_GOING_HELP)
+@click.option('-t', '--timeout', type=float, callback=positive, help=TIMEOUT_HELP)
 @click.option('-a', '--args', help=ARGS_HELP)
 @click.option('-d', '--definition-file', type=click.Path(exists=True, dir_okay=False, file_okay=True), help=DF_HELP)
+@click.option('-w', '--watch', multiple=True, metavar='PATH', help=WATCH_HELP)
+@click.option('-i', '--interval', type=float, callback=positive, help=INTERVAL_HELP)
+@click.option('--output', type=click.Choice(['stream', 'grouped']), help=OUTPUT_HELP)
+@click.option('--log-file', type=click.Path(dir_okay=False), help=LOG_FILE_HELP)
+@click.option('--log-output', is_flag=True, help=LOG_OUTPUT_HELP)
+@click.option('--usage', is_flag=True, help=USAGE_HELP)
+@click.option('--format', 'format_', type=click.Choice(['text', 'json']), default='text', help=FORMAT_HELP)
+@click.option('--events-fd', type=click.IntRange(min=1), default=1, help=EVENTS_FD_HELP)
+@click.option('--output-events', is_flag=True, help=OUTPUT_EVENTS_HELP)
+@click.option('--trace', type=click.Path(dir_okay=False), help=TRACE_HELP)
+@click.option('--server', is_flag=True, help=SERVER_HELP)
 @click.option('-v', '--verbose', is_flag=True)
-def cli(*, commands, verbose, **kwargs):
+def cli(*, commands, verbose, server, trace, format_, events_fd, output_events, **kwargs):
     """
     Like make but for the 21st century.
 
@@ -41,16 +124,34 @@ def cli(*, commands, verbose, **kwargs):
     If no commands are passed the default (or first if no default is set) command is executed.
     The special command "check" looks for a definition file and checks it is valid but does nothing more,
     if the command "check" is included all other commands are skipped.
+    The special command "stats" shows how long commands took in previous runs.
 
     "closest" means current directory or nearest direct parent directory, standard definition file names
     which are looked for are "donkey.yml/yaml" or "makefile.yml/yaml".
     """
-    setup_logging(verbose)
+    events = None
+    if format_ == 'json':
+        # only checked when events are written so "--format text" works without stdout, eg. "donkey foo >&-"
+        check_open_fd(events_fd)
+        from .events import EventWriter
+        events = EventWriter(events_fd, output_lines=output_events)
+    setup_logging(verbose, err=bool(events) and events_fd == 1)
+    if trace:
+        start_trace(trace)
     try:
-        execute(*commands, **kwargs)
+        if server:
+            from .server import serve
+            serve()
+            return
+        # imported here so asyncio etc. aren't imported for "--help" and "--version"
+        with span('import'):
+            from .main import execute
+        execute(*commands, events=events, **kwargs)
     except DonkeyError as e:
         main_logger.error('Error: %s', e)
         sys.exit(2)
     except DonkeyFailure as e:
         main_logger.warning('Error: %s', e.args[0])
         sys.exit(e.args[1])
+    finally:
+        stop_trace()
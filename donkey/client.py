@@ -0,0 +1,87 @@
+import array
+import json
+import os
+import signal
+import socket
+import sys
+
+from .version import VERSION
+
+# imports here are kept to a minimum, this module is imported by every "donk" invocation
+
+
+def get_socket_path() -> str:
+    """
+    Path of the server's unix socket, "DONKEY_SOCKET" if set otherwise "server.sock" in the cache directory,
+    see files.get_cache_dir.
+    """
+    socket_path = os.getenv('DONKEY_SOCKET')
+    if not socket_path:
+        cache_dir = os.getenv('DONKEY_CACHE_DIR')
+        if not cache_dir:
+            cache_dir = os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'donkey')
+        socket_path = os.path.join(cache_dir, 'server.sock')
+    return socket_path
+
+
+def send_request(sock: socket.socket, request: dict):
+    """
+    Send a request along with stdin, stdout and stderr so the server can use them directly.
+    """
+    fds = array.array('i', [sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()])
+    sock.sendmsg([json.dumps(request).encode() + b'\n'], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+
+
+def read_line(sock: socket.socket) -> bytes:
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def run_remote(argv) -> int:
+    """
+    Ask the server to run donkey with these arguments, returns the exit code or None if no server is running.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(get_socket_path())
+    except OSError:
+        sock.close()
+        return None
+
+    with sock:
+        send_request(sock, {
+            'version': VERSION,
+            'argv': argv,
+            'cwd': os.getcwd(),
+            'env': dict(os.environ),
+        })
+
+        def interrupt(signum, frame):
+            # the server's process isn't in our process group so doesn't get SIGINT from the terminal
+            sock.sendall(b'interrupt\n')
+
+        signal.signal(signal.SIGINT, interrupt)
+        response = read_line(sock)
+    try:
+        response = json.loads(response.decode())
+    except ValueError:
+        print('donkey server closed the connection unexpectedly', file=sys.stderr)
+        return 1
+    # if the server refuses the request, eg. since it's running a different version of donkey, we run locally
+    return response.get('exit')
+
+
+def main():
+    argv = sys.argv[1:]
+    if '--server' not in argv and sys.platform != 'win32':
+        exit_code = run_remote(argv)
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    from .cli import cli
+    cli()
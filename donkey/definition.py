@@ -0,0 +1,256 @@
+import hashlib
+import json
+import os
+import pickle
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List
+
+from .exceptions import DonkeyError
+from .files import get_cache_dir
+from .trace import span
+from .version import VERSION
+
+STD_FILE_NAMES = 'donkey.yml', 'donkey.yaml', 'makefile.yml', 'makefile.yaml'
+MAX_CACHED_LOCATIONS = 200
+# directories and files modified this recently aren't cached since further changes might not alter their mtime
+RACY_MTIME_NS = 2 * 10 ** 9
+# bump when the validated data changes, eg. when new keys get defaults, so definitions cached before are ignored
+CACHE_FORMAT = 2
+
+
+def find_def_file(p: Path=None) -> Path:
+    """
+    Find the closest definition file in this directory or its parents.
+
+    Results are cached along with the mtimes of the directories searched, since adding or removing a file modifies
+    its directory, the result is valid as long as none of those directories has changed.
+    """
+    p = p or Path(os.getcwd())
+    cache_path = get_cache_dir() / 'locations.json'
+    locations = _read_locations(cache_path)
+    cached = locations.get(str(p))
+    if cached and all(_mtime_ns(d) == mtime for d, mtime in cached['dirs']):
+        return Path(cached['path'])
+
+    def_path, dirs = _search_def_file(p)
+    if all(time.time() * 1e9 - mtime > RACY_MTIME_NS for _, mtime in dirs):
+        locations.pop(str(p), None)
+        locations[str(p)] = {'path': str(def_path), 'dirs': dirs}
+        while len(locations) > MAX_CACHED_LOCATIONS:
+            locations.popitem(last=False)
+        _write_locations(cache_path, locations)
+    return def_path
+
+
+def _search_def_file(p: Path):
+    dirs = []
+    while True:
+        # mtime must be taken before looking for files to avoid missing changes
+        dirs.append([str(p), _mtime_ns(str(p))])
+        for name in STD_FILE_NAMES:
+            def_path = p / name
+            if os.path.isfile(str(def_path)):
+                return def_path, dirs
+        if p == p.parent:
+            # got to /
+            raise DonkeyError('Unable to find definition file with standard name "donkey.yml" or "makefile.yml" in '
+                              'the current working directory or any parent directory')
+        p = p.parent
+
+
+def _mtime_ns(path: str):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _read_locations(cache_path: Path) -> OrderedDict:
+    try:
+        with cache_path.open() as f:
+            return json.load(f, object_pairs_hook=OrderedDict)
+    except (OSError, ValueError):
+        return OrderedDict()
+
+
+def _write_locations(cache_path: Path, locations: OrderedDict):
+    tmp_path = cache_path.with_name('{}.{}.tmp'.format(cache_path.name, os.getpid()))
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with tmp_path.open('w') as f:
+            json.dump(locations, f)
+        os.replace(str(tmp_path), str(cache_path))
+    except OSError:
+        pass
+
+
+SPECIAL_KEYS = '.default', '.settings', '.config'
+
+
+def check_requirements(def_data):
+    """
+    Check every "requires" entry refers to a command which exists and that requirements are not circular.
+    """
+    for name, c in def_data.items():
+        for req in c['requires']:
+            if req not in def_data:
+                raise DonkeyError('Command "{}" requires "{}" which is not defined'.format(name, req))
+
+    checked = set()
+
+    def check(name, path):
+        if name in checked:
+            return
+        if name in path:
+            cycle = path[path.index(name):] + [name]
+            raise DonkeyError('Circular requirement: {}'.format(' > '.join(cycle)))
+        for req in def_data[name]['requires']:
+            check(req, path + [name])
+        checked.add(name)
+
+    for name in def_data:
+        check(name, [])
+
+
+def resolve_commands(commands, def_data) -> List[str]:
+    """
+    Find all commands which need to run, every command is included once and after all the commands it requires.
+    """
+    order = []
+
+    def add(name):
+        if name not in order:
+            for req in def_data[name]['requires']:
+                add(req)
+            order.append(name)
+
+    for c in commands:
+        add(c)
+    return order
+
+
+class Definition:
+    """
+    A definition file, loaded in two phases so startup time doesn't grow with the number of commands:
+    top level options are validated when the file is loaded, commands only when they're used.
+
+    Validated data is pickled to the cache directory so neither parsing nor validation need be repeated until the
+    file changes or donkey is upgraded.
+    """
+    def __init__(self, path: Path, raw: dict, top_level: dict, commands: dict, *, cache_path: Path, cache_key):
+        self.path = path
+        self._raw = raw
+        self.default = top_level.get('.default')
+        self.settings = top_level['.settings']
+        self.config = top_level['.config']
+        self.command_names = [k for k in raw if k not in SPECIAL_KEYS]
+        self._top_level = top_level
+        # lookup of validated commands
+        self._commands = commands
+        self._cache_path = cache_path
+        self._cache_key = cache_key
+
+    def get_commands(self, names: List[str]) -> Dict[str, dict]:
+        """
+        Validate these commands and all the commands they require, directly or indirectly.
+
+        :return: lookup of validated commands
+        """
+        for name in names:
+            if name not in self._raw or name in SPECIAL_KEYS:
+                raise DonkeyError('Command "{}" not found in "{}", '
+                                  'options: {}'.format(name, self.path, ', '.join(self.command_names)))
+        found = {}
+        to_check = list(names)
+        new_commands = False
+        while to_check:
+            name = to_check.pop()
+            if name in found:
+                continue
+            c = self._commands.get(name)
+            if c is None:
+                from .schema import validate_command
+                with span('validate command', command=name):
+                    c = validate_command(self.path, name, self._raw[name])
+                self._commands[name] = c
+                new_commands = True
+            found[name] = c
+            for req in c['requires']:
+                if req not in self._raw or req in SPECIAL_KEYS:
+                    raise DonkeyError('Command "{}" requires "{}" which is not defined'.format(name, req))
+                to_check.append(req)
+
+        # definition file order so the reported circular requirement is consistent
+        check_requirements({n: found[n] for n in self.command_names if n in found})
+        if new_commands:
+            self.save_cache()
+        return found
+
+    def check(self):
+        """
+        Validate every command in the definition file.
+        """
+        self.get_commands(self.command_names)
+
+    def save_cache(self):
+        if self._cache_path:
+            _write_cached(self._cache_path, self._cache_key, (self._raw, self._top_level, self._commands))
+
+
+def load_definition(definition_file: str=None) -> Definition:
+    # DONKEY_DEFINITION_FILE skips searching for the definition file
+    definition_file = definition_file or os.getenv('DONKEY_DEFINITION_FILE')
+    if definition_file:
+        def_path = Path(definition_file).resolve()
+    else:
+        with span('find_def_file'):
+            def_path = find_def_file()
+    stat = def_path.stat()
+    cache_key = str(def_path), stat.st_mtime_ns, stat.st_size, str(VERSION), CACHE_FORMAT
+    cache_path = get_cache_dir() / 'definitions' / (hashlib.sha1(str(def_path).encode()).hexdigest() + '.pickle')
+    if time.time() * 1e9 - stat.st_mtime_ns <= RACY_MTIME_NS:
+        # the file might be modified again without its mtime or size changing
+        cache_path = None
+
+    cached = None
+    if cache_path:
+        with span('read cached definition'):
+            cached = _read_cached(cache_path, cache_key)
+    if cached:
+        raw, top_level, commands = cached
+        return Definition(def_path, raw, top_level, commands, cache_path=cache_path, cache_key=cache_key)
+
+    # yaml and trafaret are slow to import, so only imported when the definition isn't cached
+    with span('import schema'):
+        from .schema import parse, validate_top_level
+    with span('load yaml'):
+        raw = parse(def_path)
+    with span('validate'):
+        top_level = validate_top_level(def_path, {k: raw[k] for k in SPECIAL_KEYS if k in raw})
+    definition = Definition(def_path, raw, top_level, {}, cache_path=cache_path, cache_key=cache_key)
+    definition.save_cache()
+    return definition
+
+
+def _read_cached(cache_path: Path, cache_key):
+    try:
+        with cache_path.open('rb') as f:
+            key, def_data = pickle.load(f)
+    except Exception:
+        # missing, corrupt or otherwise unreadable, the definition file is just parsed again
+        return None
+    return def_data if key == cache_key else None
+
+
+def _write_cached(cache_path: Path, cache_key, def_data):
+    tmp_path = cache_path.with_name('{}.{}.tmp'.format(cache_path.name, os.getpid()))
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with tmp_path.open('wb') as f:
+            pickle.dump((cache_key, def_data), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(str(tmp_path), str(cache_path))
+    except OSError:
+        # caching is an optimisation, failing to write the cache shouldn't stop commands running
+        pass
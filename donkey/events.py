@@ -0,0 +1,34 @@
+import json
+import os
+import time
+from typing import List
+
+
+class EventWriter:
+    """
+    Writes events as JSON lines for other programs to read, eg. CI tools.
+
+    Events are written directly to a file descriptor rather than through logging so each costs one json.dumps and
+    one write. If output_lines is set the output of commands is sent as "output" events, one per line.
+    """
+    def __init__(self, fd: int, *, output_lines: bool=False):
+        self.fd = fd
+        self.output_lines = output_lines
+
+    def emit(self, event: str, **data):
+        self._write(self._dumps(event, time.time(), data))
+
+    def output(self, command: str, fd: int, lines: List[str]):
+        t = time.time()
+        self._write(''.join(self._dumps('output', t, {'command': command, 'fd': fd, 'line': line}) for line in lines))
+
+    @staticmethod
+    def _dumps(event: str, t: float, data: dict) -> str:
+        d = {'event': event, 'time': round(t, 6)}
+        d.update(data)
+        return json.dumps(d) + '\n'
+
+    def _write(self, s: str):
+        data = s.encode()
+        while data:
+            data = data[os.write(self.fd, data):]
@@ -0,0 +1,6 @@
+class DonkeyError(Exception):
+    pass
+
+
+class DonkeyFailure(RuntimeError):
+    pass
@@ -0,0 +1,53 @@
+import glob
+import os
+from pathlib import Path
+from typing import Iterable, List
+
+
+def get_cache_dir() -> Path:
+    """
+    Directory for donkey's per user caches, "DONKEY_CACHE_DIR" if set otherwise "donkey" in the XDG cache directory.
+    """
+    cache_dir = os.getenv('DONKEY_CACHE_DIR')
+    if not cache_dir:
+        cache_dir = os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'donkey')
+    return Path(cache_dir)
+
+
+def expand_globs(patterns: Iterable[str]) -> List[str]:
+    """
+    Find all files matching any of the glob patterns, "**" matches any number of directories.
+    """
+    paths = set()
+    for pattern in patterns:
+        paths.update(p for p in glob.iglob(pattern, recursive=True) if os.path.isfile(p))
+    return sorted(paths)
+
+
+def up_to_date(sources: List[str], targets: List[str]) -> bool:
+    """
+    Check whether a command's targets are newer than its sources, much like make.
+
+    Every target pattern must match at least one file and the oldest target must be no older than the newest source.
+    Targets are checked first since they're generally fewer, sources are then checked lazily so we stop as soon as
+    one source is found to be newer.
+    """
+    if not targets:
+        return False
+    oldest_target = None
+    for pattern in targets:
+        paths = expand_globs([pattern])
+        if not paths:
+            return False
+        mtime = min(os.stat(p).st_mtime_ns for p in paths)
+        oldest_target = mtime if oldest_target is None else min(oldest_target, mtime)
+
+    for pattern in sources:
+        for path in glob.iglob(pattern, recursive=True):
+            try:
+                if os.stat(path).st_mtime_ns > oldest_target:
+                    return False
+            except FileNotFoundError:
+                # file deleted since it was found, can't be newer than targets
+                pass
+    return True
@@ -0,0 +1,164 @@
+import math
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, List
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+  id INTEGER PRIMARY KEY,
+  time REAL NOT NULL,
+  name TEXT NOT NULL,
+  duration REAL NOT NULL,
+  return_code INTEGER NOT NULL,
+  user REAL,
+  system REAL,
+  max_rss INTEGER,
+  read_blocks INTEGER,
+  write_blocks INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_name ON jobs (name, id);
+"""
+# number of recent runs used to estimate how long a job will take
+RECENT_RUNS = 10
+# raised if the history can't be read or written, eg. on a read-only file system
+HISTORY_ERRORS = OSError, sqlite3.Error
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Nearest rank percentile of values, which must be sorted.
+    """
+    return values[max(math.ceil(len(values) * p / 100) - 1, 0)]
+
+
+def median(values: List[float]) -> float:
+    return percentile(sorted(values), 50)
+
+
+class History:
+    """
+    Duration, return code and resource usage of every job run, stored with sqlite in the cache directory.
+
+    Once the database exceeds max_size the oldest half of the history is deleted and the database compacted.
+    """
+    def __init__(self, path: Path, *, max_size: int):
+        self.path = path
+        self.max_size = max_size
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path))
+        try:
+            self.db.executescript(SCHEMA)
+        except sqlite3.DatabaseError:
+            # corrupt, just start again
+            self.db.close()
+            path.unlink()
+            self.db = sqlite3.connect(str(path))
+            self.db.executescript(SCHEMA)
+        # history isn't worth waiting for the disk, at worst the last runs are lost
+        self.db.execute('PRAGMA synchronous = OFF')
+
+    def record(self, results):
+        """
+        Record the JobResults of a run.
+        """
+        now = time.time()
+        rows = []
+        for r in results:
+            u = r.usage
+            rows.append((
+                now, r.name, r.time_taken, r.return_codes[-1],
+                u and u.user, u and u.system, u and u.max_rss, u and u.read_blocks, u and u.write_blocks,
+            ))
+        if not rows:
+            return
+        with self.db:
+            self.db.executemany(
+                'INSERT INTO jobs (time, name, duration, return_code, user, system, max_rss, read_blocks, '
+                'write_blocks) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows,
+            )
+        if self.path.stat().st_size > self.max_size:
+            self.compact()
+
+    def compact(self):
+        with self.db:
+            self.db.execute('DELETE FROM jobs WHERE id <= (SELECT (MIN(id) + MAX(id)) / 2 FROM jobs)')
+        self.db.execute('VACUUM')
+
+    def expected_durations(self, names: List[str]) -> Dict[str, float]:
+        """
+        Median duration of the recent successful runs of each job, jobs which haven't run successfully are omitted.
+        """
+        durations = {}
+        for name in names:
+            rows = self.db.execute(
+                'SELECT duration FROM jobs WHERE name = ? AND return_code = 0 ORDER BY id DESC LIMIT ?',
+                (name, RECENT_RUNS),
+            ).fetchall()
+            if rows:
+                durations[name] = median([d for d, in rows])
+        return durations
+
+    def stats(self) -> List[dict]:
+        """
+        Summary of each job's history: number of runs and failures, percentiles of successful runs' durations and
+        the change in duration of the most recent runs compared to those before them.
+        """
+        jobs = {}
+        for name, duration, return_code in self.db.execute('SELECT name, duration, return_code FROM jobs ORDER BY id'):
+            job = jobs.setdefault(name, {'name': name, 'runs': 0, 'failures': 0, 'durations': []})
+            job['runs'] += 1
+            if return_code:
+                job['failures'] += 1
+            else:
+                job['durations'].append(duration)
+
+        stats = []
+        for job in jobs.values():
+            durations = job.pop('durations')
+            if durations:
+                ordered = sorted(durations)
+                job.update(p50=percentile(ordered, 50), p95=percentile(ordered, 95), last=durations[-1])
+                recent, previous = durations[-RECENT_RUNS:], durations[:-RECENT_RUNS][-RECENT_RUNS * 5:]
+                if previous:
+                    job['trend'] = median(recent) / median(previous) - 1 if median(previous) else None
+            stats.append(job)
+        return stats
+
+    def close(self):
+        self.db.close()
+
+
+def critical_path_order(executors, durations: Dict[str, float]):
+    """
+    Order executors so the jobs at the start of the longest chains of requirements come first, jobs without history
+    are assumed to take the median duration of those with history.
+
+    :param executors: executors where every command comes after its requirements, see resolve_commands
+    """
+    default = median(list(durations.values())) if durations else 0
+    dependents = {}
+    for ex in executors:
+        for req in ex.requires:
+            dependents.setdefault(req, []).append(ex.name)
+    # time from the start of each job until all the jobs which require it have finished
+    remaining = {}
+    for ex in reversed(executors):
+        after = max((remaining[d] for d in dependents.get(ex.name, [])), default=0)
+        remaining[ex.name] = durations.get(ex.name, default) + after
+    # sorted is stable so equal jobs keep their order
+    return sorted(executors, key=lambda ex: -remaining[ex.name])
+
+
+def format_stats(stats: List[dict]) -> List[str]:
+    lines = ['{:30} {:>6} {:>8} {:>8} {:>8} {:>8} {:>7}'.format(
+        'command', 'runs', 'failures', 'p50', 'p95', 'last', 'trend'
+    )]
+    for job in sorted(stats, key=lambda j: j['name']):
+        durations = ['{:0.2f}s'.format(job[k]) if k in job else '-' for k in ('p50', 'p95', 'last')]
+        trend = job.get('trend')
+        lines.append('{:30} {:>6} {:>8} {:>8} {:>8} {:>8} {:>7}'.format(
+            job['name'], job['runs'], job['failures'], *durations, '-' if trend is None else '{:+0.0%}'.format(trend)
+        ))
+    return lines
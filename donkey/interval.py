@@ -0,0 +1,55 @@
+import asyncio
+import logging
+import math
+import random
+
+main_logger = logging.getLogger('donkey.main')
+
+INTERVAL_DEFAULTS = {
+    'mode': 'rate',
+    'jitter': 0,
+    'if_running': 'skip',
+}
+
+
+async def run_interval(start_run, *, every: float, mode: str, jitter: float, if_running: str, loop):
+    """
+    Run commands repeatedly.
+
+    In "rate" mode runs start every "every" seconds counted from the first run, so delays don't accumulate. In "delay"
+    mode each run starts "every" seconds after the previous run finished.
+
+    In "rate" mode a run may still be going when the next should start, "if_running" decides whether to "skip" runs
+    which are due or to "wait" and start one run as soon as the previous has finished.
+
+    Each run is delayed by a random time of up to "jitter" seconds, without affecting when later runs are due.
+    """
+    start = loop.time()
+    tick = 0
+    while True:
+        task, _ = start_run()
+        await asyncio.wait([task], loop=loop)
+        # raise any unexpected error from the run, return codes don't matter here
+        task.result()
+
+        now = loop.time()
+        if mode == 'delay':
+            due = now + every
+        else:
+            tick += 1
+            due = start + tick * every
+            if due < now:
+                # the latest tick which has already passed
+                latest = math.floor((now - start) / every)
+                if if_running == 'skip':
+                    skipped = latest - tick + 1
+                    main_logger.warning('still running when next run was due, skipped %d run%s',
+                                        skipped, '' if skipped == 1 else 's')
+                    tick = latest + 1
+                    due = start + tick * every
+                else:
+                    tick = latest
+                    due = now
+        delay = max(due - loop.time(), 0) + random.uniform(0, jitter)
+        main_logger.debug('next run in %0.2fs', delay)
+        await asyncio.sleep(delay, loop=loop)
@@ -0,0 +1,196 @@
+import gzip
+import logging
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from pathlib import Path
+
+ANSI_RE = re.compile('\x1b\\[[0-9;]*m')
+# start of an escape sequence at the end of a batch, the rest might be in the next batch
+ANSI_PARTIAL_RE = re.compile('\x1b(\\[[0-9;]*)?\\Z')
+# when the writer thread has more than this many characters waiting they're written in one go
+BATCH_SIZE = 2 ** 20
+# maximum number of chunks waiting to be written, if the disk can't keep up writers wait rather than memory growing
+MAX_QUEUED = 1000
+LOGGERS = 'donkey.main', 'donkey.commands'
+
+main_logger = logging.getLogger('donkey.main')
+
+
+class LogFile:
+    """
+    Appends command output and donkey's logs to a file, writes happen in a background thread so slow disks don't
+    hold up the event loop. While started, records from donkey's loggers are also written to the file.
+
+    The file is rotated once it exceeds max_size or when the time passes into a new period of rotate_every seconds,
+    eg. each day with rotate_every=86400. Old files are named "<name>.1", "<name>.2" etc. and gzipped if compress
+    is set, at most "backups" old files are kept.
+
+    If writing fails, eg. as the disk is full, a warning is logged and nothing more is written to the file.
+    """
+    def __init__(self, path: Path, *, max_size: int=None, rotate_every: float=None, backups: int=5,
+                 compress: bool=True):
+        self.path = path
+        self.max_size = max_size
+        self.rotate_every = rotate_every
+        self.backups = backups
+        self.compress = compress
+        self.queue = queue.Queue(maxsize=MAX_QUEUED)
+        # exception raised by the writer thread
+        self.error = None
+        self._error_reported = False
+        self._thread = None
+        self._handler = None
+        self._file = None
+        self._size = 0
+        self._period = None
+
+    def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._open()
+        self._thread = threading.Thread(target=self._run, name='donkey-log-file', daemon=True)
+        self._thread.start()
+        self._handler = LogFileHandler(self)
+        for name in LOGGERS:
+            logging.getLogger(name).addHandler(self._handler)
+
+    def write(self, s: str):
+        self._put(s)
+
+    def _put(self, item):
+        while not self.error:
+            try:
+                self.queue.put(item, timeout=0.1)
+            except queue.Full:
+                # check the writer hasn't stopped
+                continue
+            return
+        self._report_error()
+
+    def _report_error(self):
+        if not self._error_reported:
+            # set first, the warning is also sent to this log file
+            self._error_reported = True
+            main_logger.warning('unable to write to log file "%s", no longer writing to it: %s', self.path, self.error)
+
+    def close(self):
+        """
+        Wait for everything queued to be written then close the file.
+        """
+        if self._handler:
+            for name in LOGGERS:
+                logging.getLogger(name).removeHandler(self._handler)
+            self._handler = None
+        if self._thread:
+            self._put(None)
+            self._thread.join()
+            self._thread = None
+        if self.error:
+            self._report_error()
+
+    def _run(self):
+        carry = ''
+        try:
+            while True:
+                batch = [self.queue.get()]
+                size = len(batch[0] or '')
+                # drain whatever else is waiting so busy output is written in large chunks
+                while batch[-1] is not None and size < BATCH_SIZE:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                    size += len(batch[-1] or '')
+                finished = batch[-1] is None
+                s = carry + ''.join(filter(None, batch))
+                carry = ''
+                if '\x1b' in s:
+                    m = ANSI_PARTIAL_RE.search(s)
+                    if m and not finished:
+                        s, carry = s[:m.start()], s[m.start():]
+                    s = ANSI_RE.sub('', s)
+                self._write(s)
+                if finished:
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            self._file.close()
+
+    def _write(self, s: str):
+        if not s:
+            return
+        if self._should_rotate(len(s)):
+            self._file.close()
+            self._rotate()
+            self._open()
+        data = s.encode(errors='replace')
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+
+    def _open(self):
+        self._file = self.path.open('ab')
+        stat = self.path.stat()
+        self._size = stat.st_size
+        self._period = self._current_period(stat.st_mtime if stat.st_size else time.time())
+
+    def _current_period(self, t: float):
+        return int(t // self.rotate_every) if self.rotate_every else None
+
+    def _should_rotate(self, size: int) -> bool:
+        if not self._size:
+            return False
+        if self.max_size and self._size + size > self.max_size:
+            return True
+        return self._period != self._current_period(time.time())
+
+    def _backup_path(self, n: int) -> Path:
+        return self.path.with_name('{}.{}{}'.format(self.path.name, n, '.gz' if self.compress else ''))
+
+    def _rotate(self):
+        if not self.backups:
+            self.path.unlink()
+            return
+        oldest = self._backup_path(self.backups)
+        if oldest.exists():
+            oldest.unlink()
+        for n in range(self.backups - 1, 0, -1):
+            if self._backup_path(n).exists():
+                self._backup_path(n).rename(self._backup_path(n + 1))
+        if self.compress:
+            with self.path.open('rb') as src, gzip.open(str(self._backup_path(1)), 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            self.path.unlink()
+        else:
+            os.rename(str(self.path), str(self._backup_path(1)))
+
+
+class LogFileHandler(logging.Handler):
+    """
+    Sends log records to a LogFile.
+    """
+    def __init__(self, log_file: LogFile):
+        super().__init__()
+        self.log_file = log_file
+        self.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+
+    def emit(self, record):
+        try:
+            if record.getMessage() == '<nl>':
+                # see logs.CommandLogHandler
+                self.log_file.write('\n')
+                return
+            if not getattr(record, 'prev_nl', True):
+                # continuation of a line of command output
+                self.log_file.write(record.getMessage() + ('\n' if record.nl else ''))
+                return
+            msg = self.format(record)
+            if getattr(record, 'nl', True):
+                msg += '\n'
+            self.log_file.write(msg)
+        except Exception:  # pragma: no cover
+            self.handleError(record)
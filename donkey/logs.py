@@ -1,5 +1,4 @@
 import logging
-import logging.config
 import re
 
 import click
@@ -12,25 +11,34 @@ MAIN_LOG_FORMAT = {
 
 
 class MainHandler(logging.Handler):
+    def __init__(self, level=logging.NOTSET, *, err=False):
+        super().__init__(level)
+        # write to stderr, eg. when stdout is used for JSON events
+        self.err = err
+
     def emit(self, record):
         log_entry = self.format(record)
         symbol = getattr(record, 'symbol', '')
         if symbol:
             symbol = ' ' + click.style(symbol, fg=record.colour)
         msg = click.style(log_entry, **MAIN_LOG_FORMAT.get(record.levelno, {'fg': 'red'}))
-        click.secho(msg + symbol)
+        click.secho(msg + symbol, err=self.err)
 
 
 class CommandLogHandler(logging.Handler):
+    def __init__(self, level=logging.NOTSET, *, err=False):
+        super().__init__(level)
+        self.err = err
+
     def emit(self, record):
         if record.getMessage() == '<nl>':
             # '<nl>' is a special value used to print new line after a command with ended without one
-            click.echo('')
+            click.echo('', err=self.err)
             return
         if not record.prev_nl:
             # if the previous line ended without a newline we print the raw message with symbol or time etc.
             # eg. for test output "........"
-            click.secho(record.getMessage(), fg=record.colour, nl=record.nl)
+            click.secho(record.getMessage(), fg=record.colour, nl=record.nl, err=self.err)
             return
         log_entry = self.format(record)
         m = re.match('^.*?:\d\d ', log_entry)
@@ -41,7 +49,7 @@ class CommandLogHandler(logging.Handler):
             msg = log_entry[m.end():]
         msg = click.style(msg, fg=record.colour)
         prefix = click.style(m.group(), fg='magenta')
-        click.echo(prefix + msg, nl=record.nl)
+        click.echo(prefix + msg, nl=record.nl, err=self.err)
 
 
 SYMBOLS = ['●', '◆', '▼', '◼', '◖', '◗', '◯', '◇', '▽', '□']
@@ -65,11 +73,14 @@ def get_log_format():
     return dict(FORMATS[format_index % len(FORMATS)])
 
 
-def setup_logging(verbose):
+def setup_logging(verbose, *, err=False):
     """
     Setup main logging
     :param verbose: level: DEBUG if True, INFO if False
+    :param err: write logs to stderr rather than stdout
     """
+    # logging.config is relatively slow to import
+    import logging.config
     log_level = 'DEBUG' if verbose else 'INFO'
     log_config = {
         'version': 1,
@@ -87,12 +98,14 @@ def setup_logging(verbose):
             'main': {
                 'level': log_level,
                 'class': 'donkey.logs.MainHandler',
-                'formatter': 'main'
+                'formatter': 'main',
+                'err': err,
             },
             'commands': {
                 'level': 'INFO',
                 'class': 'donkey.logs.CommandLogHandler',
-                'formatter': 'commands'
+                'formatter': 'commands',
+                'err': err,
             },
         },
         'loggers': {
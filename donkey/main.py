@@ -1,82 +1,35 @@
 import asyncio
+import hashlib
 import itertools
-import locale
 import logging
-import re
+import os
+import signal
 import sys
+import time
+from collections import namedtuple
 from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 from subprocess import PIPE
 from typing import Any, Dict, List, Tuple
 
-import trafaret as t
-from trafaret_config import ConfigError, read_and_validate
-
+from .capture import OutputCapture, capture_path
+from .definition import load_definition, resolve_commands
+from .exceptions import DonkeyError, DonkeyFailure
+from .files import expand_globs, get_cache_dir, up_to_date
 from .logs import get_log_format, reset_log_format
+from .output import PIPE_GRACE, OutputPipeline, ProcessOutput
+from .session import PythonWorkerPool, ShellSession
+from .trace import job_span, record_process, span
+from .usage import CAN_WAIT4, children_usage, combine, format_usage, install_watcher, pop_usage, usage_between
 
-command_logger = logging.getLogger('donkey.commands')
 main_logger = logging.getLogger('donkey.main')
-
-STD_FILE_NAMES = [
-    re.compile('donkey\.ya?ml'),
-    re.compile('makefile\.ya?ml'),
-]
-
-
-class DonkeyError(Exception):
-    pass
-
-
-class DonkeyFailure(RuntimeError):
-    pass
-
-
-def find_def_file(p=None):
-    p = p or Path('.').resolve()
-    files = [x for x in p.iterdir() if x.is_file()]
-    for std_file_name in STD_FILE_NAMES:
-        try:
-            def_path = next(f for f in files if std_file_name.fullmatch(f.name))
-        except StopIteration:
-            pass
-        else:
-            return def_path
-    if p == p.parent:
-        # got to /
-        raise DonkeyError('Unable to find definition file with standard name "donkey.yml" or "makefile.yml" in the '
-                          'current working directory or any parent directory')
-    return find_def_file(p.parent)
-
-
-# TODO in trafaret
-# better errors for Or
-
-CONFIG_OPTIONS = t.Dict({
-    t.Key('interpreter', optional=True): t.String,
-    t.Key('parallel', optional=True): t.Bool,
-    t.Key('script', optional=True, to_name='script_mode'): t.Bool,
-})
-
-STRING_DICT = t.Dict()
-STRING_DICT.allow_extra('*', trafaret=t.String)
-
-STRUCTURE = t.Dict({
-    t.Key('.default', optional=True): t.String,
-    t.Key('.settings', default={}): STRING_DICT,
-    t.Key('.config', default={}): CONFIG_OPTIONS,
-})
-
-STRUCTURE.allow_extra(
-    '*',
-    trafaret=t.Or(
-        CONFIG_OPTIONS + t.Dict({
-            t.Key(name='settings', default={}): STRING_DICT,
-            t.Key(name='run'): t.List(t.String),
-        }),
-        t.List(t.String) >> (lambda s: {'settings': {}, 'run': s}),
-    )
-)
+# seconds between SIGTERM and SIGKILL when stopping processes
+KILL_GRACE_PERIOD = 5
+# same as coreutils' timeout
+TIMEOUT_RETURN_CODE = 124
+# whether processes can be started in their own process group and stopped along with any processes they start
+CAN_ISOLATE = hasattr(os, 'killpg')
 
 
 class SetException:
@@ -87,53 +40,218 @@ class SetException:
         pass
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_val:
+        if exc_val and not self._future.done():
             self._future.set_exception(exc_val)
 
 
 class DonkeySubprocessProtocol(asyncio.SubprocessProtocol):
-    def __init__(self, exit_future, log_format):
+    """
+    Sets exit_future once the process has exited and its pipes have closed, or PIPE_GRACE seconds after it exited
+    if the pipes are held open by processes it left running in the background.
+    """
+    def __init__(self, exit_future, output: ProcessOutput, *, loop):
         self.exit_future = exit_future
-        self.log_format = log_format
-        self.has_trailing_nl = True
+        self.output = output
+        self.loop = loop
+        self.first_output = None
+        self.finished = False
+        self._grace_timer = None
 
     def pipe_data_received(self, fd, data):
+        if self.finished:
+            # from a background process after the command finished
+            return
+        if self.first_output is None:
+            self.first_output = time.perf_counter()
         with SetException(self.exit_future):
-            s = data.decode(locale.getpreferredencoding(False))
-            l = command_logger.info if fd == 1 else command_logger.warning
-            extra = {
-                'fd': fd,
-                'symbol': self.log_format['symbol'],
-                'colour': self.log_format['colour'],
-                'nl': True,
-                'prev_nl': self.has_trailing_nl,
-            }
-            *lines, last = s.split('\n')
-            for line in lines:
-                self.has_trailing_nl = True
-                l('%s', line, extra=extra)
-            if last:
-                extra['nl'] = False
-                l('%s', last, extra=extra)
-                self.has_trailing_nl = False
+            self.output.feed(fd, data)
 
     def process_exited(self):
+        # output can still be received after the process exits, so give the pipes a moment to drain
+        self._grace_timer = self.loop.call_later(PIPE_GRACE, self._finish)
+
+    def connection_lost(self, exc):
+        # called once the process has exited and all pipes are closed
+        self._finish()
+
+    def _finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        if self._grace_timer:
+            self._grace_timer.cancel()
         with SetException(self.exit_future):
-            if not self.has_trailing_nl:
-                command_logger.info('<nl>')
-            self.exit_future.set_result(True)
+            self.output.close()
+            if not self.exit_future.done():
+                self.exit_future.set_result(True)
 
 
 def now():
     return datetime.now()
 
 
+# outcome of running one job, usage is the combined resource usage of the job's processes if known
+JobResult = namedtuple('JobResult', 'name return_codes time_taken usage')
+
+
+class Cancelled(int):
+    """
+    Return code of a job cancelled since another job failed, either the return code of the stopped process or -1 if
+    the process was never started.
+
+    Always counts as a failure, even if the stopped process exited with 0 since its work may not be complete.
+    """
+    def __bool__(self):
+        return True
+
+    def __str__(self):
+        return 'cancelled'
+
+    __repr__ = __str__
+
+
+class JobControl:
+    """
+    Tracks running processes so that when a job fails in fail_fast mode all other jobs can be cancelled.
+
+    If isolate is True processes are started in their own process group so signals reach any processes they've
+    started too, eg. "sleep" in "sleep 10; echo done".
+    """
+    def __init__(self, *, loop, fail_fast: bool, isolate: bool):
+        self.loop = loop
+        self.fail_fast = fail_fast
+        self.isolate = isolate and CAN_ISOLATE
+        # transport > whether it's in its own process group
+        self.running = {}
+        self.cancelled_transports = set()
+        self.timed_out_transports = set()
+        self.cancel_reason = None
+        # process group > loop time it's due to be killed, for groups which have been sent SIGTERM
+        self.stopping = {}
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_reason is not None
+
+    def add(self, transport, isolated: bool):
+        self.running[transport] = isolated
+
+    def remove(self, transport):
+        self.running.pop(transport, None)
+
+    def job_failed(self, display_name: str):
+        if self.fail_fast:
+            self.cancel('"{}" failed'.format(display_name))
+
+    def cancel(self, reason: str):
+        """
+        Stop all running processes and prevent any more from starting.
+        """
+        if not self.cancelled:
+            self.cancel_reason = reason
+            self.stop_all()
+
+    def stop_all(self):
+        for transport in list(self.running):
+            self.cancelled_transports.add(transport)
+            self.stop(transport)
+
+    def time_out(self, transport):
+        self.timed_out_transports.add(transport)
+        self.stop(transport)
+
+    def stop(self, transport):
+        pgid = transport.get_pid() if self.running.get(transport) else None
+        self.send_signal(transport, signal.SIGTERM)
+        if pgid:
+            self.stopping[pgid] = self.loop.time() + KILL_GRACE_PERIOD
+        self.loop.call_later(KILL_GRACE_PERIOD, self._kill, transport, pgid)
+
+    def _kill(self, transport, pgid):
+        if pgid:
+            # processes in the group may still be running after the one started has exited and been removed
+            self.stopping.pop(pgid, None)
+            try:
+                os.killpg(pgid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        elif transport in self.running:
+            self.send_signal(transport, signal.SIGKILL)
+
+    async def close(self):
+        """
+        Kill process groups which are still running once their grace period is over, the loop might be closed before
+        the timers set by stop fire.
+        """
+        for pgid, kill_at in list(self.stopping.items()):
+            while self.loop.time() < kill_at and _group_running(pgid):
+                await asyncio.sleep(0.05, loop=self.loop)
+            self._kill(None, pgid)
+
+    def send_signal(self, transport, sig):
+        try:
+            if self.running.get(transport):
+                os.killpg(transport.get_pid(), sig)
+            else:
+                transport.send_signal(sig)
+        except (ProcessLookupError, PermissionError):
+            # process has already finished
+            pass
+
+
+def _group_running(pgid: int) -> bool:
+    """
+    Whether any process in the group is still running, where /proc is available zombies aren't counted since they may
+    be waiting for an init process which is slow to reap them.
+    """
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # pragma: no cover
+        pass
+    if not os.path.isdir('/proc/self'):  # pragma: no cover
+        return True
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(pid)) as f:
+                # fields after the command name, which might contain spaces, start with state, ppid and pgrp
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[2]) == pgid and fields[0] != 'Z':
+            return True
+    return False
+
+
 class CommandExecutor:
     def __init__(self, name, run_commands, *,
-                 loop, settings=None, args=None, parallel=False, interpreter=None, script_mode=False):
+                 loop, job_tokens, job_control, output, settings=None, args=None, parallel=False, interpreter=None,
+                 script_mode=False, requires=None, sources=None, targets=None, hash_mode=False, build_state=None,
+                 artifacts=None, timeout=None, session=False, python_pool=None, failure_tail=0, capture_dir=None,
+                 results=None, events=None):
         self.loop = loop
+        # shared between all executors to limit the number of processes running at once
+        self.job_tokens = job_tokens
+        self.job_control = job_control
+        self.output = output
         self.name = name
-        if script_mode:
+        self.requires = requires or []
+        self.sources = sources or []
+        self.targets = targets or []
+        # whether sources should be compared by content hash rather than modification time
+        self.hash_mode = hash_mode
+        # required when hash_mode is set or artifacts are used, to build keys identifying the command and its sources
+        self.build_state = build_state
+        self.artifacts = artifacts
+        # seconds each process may run for before it's stopped
+        self.timeout = timeout
+        if not run_commands:
+            # command only exists to group its requirements
+            commands = []
+        elif script_mode:
             if args is not None:
                 raise DonkeyError('"args" are invalid for a command in "script" mode')
             commands = ['\n'.join(run_commands)]
@@ -146,12 +264,74 @@ class CommandExecutor:
         self.subprocess_args_list = [(interpreter, '-c', c) for c in commands]
         self.settings = settings
         self.parallel = parallel
+        # run all lines in one shell, only possible with bash and only useful when lines are run one after another
+        self.session = session and not parallel and Path(interpreter).name == 'bash'
+        # python snippets are run by warm workers if a pool is configured
+        self.python_pool = python_pool if Path(interpreter).name.startswith('python') else None
+        # number of lines of output to show if the command fails
+        self.failure_tail = failure_tail
+        # directory to save the full output of each job in
+        self.capture_dir = capture_dir
+        # JobResults of each job are appended to this list if set
+        self.results = results
+        # EventWriter for "--format json"
+        self.events = events
 
     @property
     def command_count(self):
-        return len(self.subprocess_args_list) if self.parallel else 1
+        return len(self.subprocess_args_list) if self.parallel else min(len(self.subprocess_args_list), 1)
 
     async def execute(self, track_multiple) -> list:
+        if self.command_count == 0:
+            return []
+        key = None
+        if self.build_state:
+            key = await self.build_state.command_key(
+                {'run': self.subprocess_args_list, 'settings': self.settings},
+                self.sources,
+                loop=self.loop,
+            )
+        # freshness is checked here rather than up front since requirements might have just modified sources
+        if self._up_to_date(key):
+            main_logger.info('"%s" up to date', self.name)
+            self.emit_skipped('up to date')
+            return []
+
+        use_artifacts = bool(self.artifacts and self.targets)
+        if use_artifacts and not self.sources:
+            # the key would only depend on the command, so every checkout would get the first one's targets
+            main_logger.warning('"%s" has no sources so its targets can\'t be cached', self.name)
+            use_artifacts = False
+        if use_artifacts and await self.loop.run_in_executor(None, self.artifacts.restore, key):
+            main_logger.info('"%s" targets restored from artifact cache', self.name)
+            self.emit_skipped('restored from artifact cache')
+            self._record_success(key)
+            return []
+
+        return_codes = await self._execute(track_multiple)
+        if not any(return_codes):
+            self._record_success(key)
+            if use_artifacts:
+                await self.loop.run_in_executor(None, self.artifacts.store, key, self.targets)
+        return return_codes
+
+    def _up_to_date(self, key) -> bool:
+        if self.hash_mode:
+            return bool(
+                self.sources and self.build_state.is_fresh(key) and all(expand_globs([p]) for p in self.targets)
+            )
+        else:
+            return bool(self.targets) and up_to_date(self.sources, self.targets)
+
+    def emit_skipped(self, reason: str):
+        if self.events:
+            self.events.emit('command_skipped', command=self.name, reason=reason)
+
+    def _record_success(self, key):
+        if self.hash_mode:
+            self.build_state.record_success(key)
+
+    async def _execute(self, track_multiple) -> list:
         if self.command_count == 1:
             return await self._run_multiple(self.subprocess_args_list, self.name, track_multiple)
 
@@ -169,43 +349,197 @@ class CommandExecutor:
         else:
             log_format = {'symbol': '', 'colour': None}
         main_logger.debug('Running "%s"...', display_name, extra=log_format)
+        if self.events:
+            self.events.emit('command_started', command=display_name, lines=[args[-1] for args in args_list])
 
         start = now()
-        return_codes = []
-        for args in args_list:
-            rt = await self._run(args, log_format)
-            return_codes.append(rt)
-            if rt:
-                break
+        capture = None
+        if self.failure_tail or self.capture_dir:
+            path = self.capture_dir and capture_path(self.capture_dir, display_name)
+            capture = OutputCapture(path, tail_lines=self.failure_tail)
+        output = self.output.job(display_name, capture=capture)
+        usages = []
+        try:
+            with job_span(display_name, loop=self.loop):
+                return_codes = await self._run_lines(args_list, log_format, output, usages)
+        finally:
+            output.finish()
+        if return_codes[-1] and not isinstance(return_codes[-1], Cancelled):
+            self.job_control.job_failed(display_name)
         time_taken = (now() - start).total_seconds()
+        result = JobResult(display_name, return_codes, time_taken, combine(usages))
+        if self.results is not None:
+            self.results.append(result)
+        if self.events:
+            self._emit_finished(result)
         # tiny gap generally improves the order of log output without being long enough for the user to noticing
         await asyncio.sleep(0.02)
 
-        main_logger.info('"%s" finished in %0.2fs, return codes: %s', display_name, time_taken,
-                         ', '.join(map(str, return_codes)), extra=log_format)
+        if any(isinstance(rt, Cancelled) for rt in return_codes):
+            main_logger.warning('"%s" cancelled after %0.2fs, return codes: %s', display_name, time_taken,
+                                ', '.join(map(str, return_codes)), extra=log_format)
+        else:
+            main_logger.info('"%s" finished in %0.2fs, return codes: %s', display_name, time_taken,
+                             ', '.join(map(str, return_codes)), extra=log_format)
+        if capture and return_codes[-1] and not isinstance(return_codes[-1], Cancelled):
+            self._log_failure(display_name, capture, log_format)
         return return_codes
 
-    async def _run(self, args: Tuple[str, ...], log_format: Dict[str, Any]):
+    def _emit_finished(self, result: JobResult):
+        self.events.emit(
+            'command_finished',
+            command=result.name,
+            duration=round(result.time_taken, 6),
+            return_code=int(result.return_codes[-1]),
+            return_codes=[int(rt) for rt in result.return_codes],
+            cancelled=any(isinstance(rt, Cancelled) for rt in result.return_codes),
+            usage=result.usage and result.usage._asdict(),
+        )
+
+    async def _run_lines(self, args_list: List[Tuple[str, ...]], log_format: Dict[str, Any], output,
+                         usages: list) -> List[int]:
+        # one token is held for the whole job, if it were released between lines another job could take it and
+        # run to completion after this job fails
+        async with self.job_tokens:
+            if self.session and len(args_list) > 1:
+                return await self._run_session(args_list, log_format, output, usages)
+            return_codes = []
+            for args in args_list:
+                if self.python_pool:
+                    # workers are shared so resource usage can't be attributed to jobs
+                    rt = await self._run_worker(args, log_format, output)
+                else:
+                    rt = await self._run(args, log_format, output, usages)
+                return_codes.append(rt)
+                if rt:
+                    break
+            return return_codes
+
+    def _log_failure(self, display_name: str, capture: OutputCapture, log_format: Dict[str, Any]):
+        tail = capture.tail()
+        if tail:
+            main_logger.warning('last %d line%s of output from "%s":\n%s', len(tail), '' if len(tail) == 1 else 's',
+                                display_name, '\n'.join(tail), extra=log_format)
+        if capture.path:
+            main_logger.warning('full output of "%s" saved to "%s"', display_name, capture.path, extra=log_format)
+
+    async def _run(self, args: Tuple[str, ...], log_format: Dict[str, Any], output, usages: list):
         exit_future = asyncio.Future(loop=self.loop)
 
         def protocol_factory():
-            return DonkeySubprocessProtocol(exit_future, log_format)
+            return DonkeySubprocessProtocol(exit_future, output.process(log_format), loop=self.loop)
+
+        isolate = self._isolate()
+        if self.job_control.cancelled:
+            return Cancelled(-1)
+        started = time.perf_counter()
+        transport, protocol = await self.loop.subprocess_exec(
+            protocol_factory, *args, stdin=self._stdin(), start_new_session=isolate
+        )
+        self.job_control.add(transport, isolate)
+        timer = self._start_timer(transport, args)
+        try:
+            await exit_future
+        finally:
+            self.job_control.remove(transport)
+            if timer:
+                timer.cancel()
+        return_code = self._final_return_code(transport, transport.get_returncode())
+        transport.close()
+        self._add_usage(usages, transport)
+        record_process(args[-1], started, protocol.first_output, return_code=return_code, loop=self.loop)
+        return return_code
+
+    async def _run_session(self, args_list: List[Tuple[str, ...]], log_format: Dict[str, Any], output,
+                           usages: list) -> List[int]:
+        session = ShellSession(args_list[0][0], loop=self.loop, output=output)
+        isolate = self._isolate()
+        return_codes = []
+        if self.job_control.cancelled:
+            return [Cancelled(-1)]
+        transport = await session.start(stdin=self._stdin(), start_new_session=isolate)
+        self.job_control.add(transport, isolate)
+        try:
+            for args in args_list:
+                timer = self._start_timer(transport, args)
+                started = time.perf_counter()
+                try:
+                    rt = await session.run(args[-1], log_format)
+                finally:
+                    if timer:
+                        timer.cancel()
+                record_process(args[-1], started, return_code=rt, loop=self.loop, cat='line')
+                if rt is None:
+                    # shell exited before finishing the line, eg. it was stopped
+                    return_codes.append(self._final_return_code(transport, await session.close()))
+                    break
+                return_codes.append(rt)
+                if rt:
+                    break
+        finally:
+            await session.close()
+            self.job_control.remove(transport)
+        self._add_usage(usages, transport)
+        return return_codes
 
+    @staticmethod
+    def _add_usage(usages: list, transport):
+        usage = pop_usage(transport.get_pid())
+        if usage:
+            usages.append(usage)
+
+    async def _run_worker(self, args: Tuple[str, ...], log_format: Dict[str, Any], output) -> int:
+        # workers may be reused by other commands so are always isolated where possible
+        if self.job_control.cancelled:
+            return Cancelled(-1)
+        worker = await self.python_pool.acquire(args[0], stdin=self._stdin(), start_new_session=CAN_ISOLATE)
+        transport = worker.transport
+        self.job_control.add(transport, CAN_ISOLATE)
+        timer = self._start_timer(transport, args)
+        started = time.perf_counter()
+        try:
+            rt = await worker.run(args[-1], log_format, output=output)
+        finally:
+            self.job_control.remove(transport)
+            if timer:
+                timer.cancel()
+        record_process(args[-1], started, return_code=rt, loop=self.loop, cat='line')
+        if rt is None:
+            # worker exited before finishing the snippet, eg. it was stopped or the snippet called os._exit
+            return self._final_return_code(transport, await worker.close())
+        await self.python_pool.release(worker)
+        return rt
+
+    @staticmethod
+    def _stdin():
         # pytest breaks stdin intentionally, thus we check it's working because calling subprocess_exec
         try:
             sys.stdin.fileno()
         except ValueError:
-            stdin = PIPE
+            return PIPE
         else:  # pragma: no cover
             # sadly no sane way to test this case
-            stdin = sys.stdin
-        transport, _ = await self.loop.subprocess_exec(protocol_factory, *args, stdin=stdin)
+            return sys.stdin
 
-        await exit_future
-        return_code = transport.get_returncode()
-        transport.close()
+    def _isolate(self) -> bool:
+        # processes which might be stopped on time out are isolated to make sure any processes they start stop too
+        return self.job_control.isolate or bool(self.timeout and CAN_ISOLATE)
+
+    def _start_timer(self, transport, args):
+        if self.timeout:
+            return self.loop.call_later(self.timeout, self._time_out, transport, args)
+
+    def _final_return_code(self, transport, return_code: int) -> int:
+        if transport in self.job_control.timed_out_transports:
+            return TIMEOUT_RETURN_CODE
+        elif transport in self.job_control.cancelled_transports:
+            return Cancelled(return_code)
         return return_code
 
+    def _time_out(self, transport, args):
+        main_logger.warning('"%s" timed out after %gs, stopping "%s"', self.name, self.timeout, args[-1])
+        self.job_control.time_out(transport)
+
     @staticmethod
     def _get_default_interpreter() -> str:
         return 'bash'  # TODO
@@ -213,78 +547,482 @@ class CommandExecutor:
 
 @contextmanager
 def loop_context():
-    if sys.platform == 'win32':  # pragma: no cover
-        loop = asyncio.ProactorEventLoop()
-    else:
-        loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    with span('loop setup'):
+        if sys.platform == 'win32':  # pragma: no cover
+            loop = asyncio.ProactorEventLoop()
+        else:
+            loop = asyncio.new_event_loop()
+            # must be installed before the loop is set so it's attached to the loop
+            install_watcher()
+        asyncio.set_event_loop(loop)
     yield loop
     loop.close()
 
 
-async def run_coros(executors, parallel, *, loop):
+async def run_graph(executors, parallel, job_control, *, loop):
+    """
+    Run executors, each only after the commands it requires have succeeded.
+
+    :param executors: executors in an order where every command comes after its requirements, see resolve_commands
+    :param parallel: whether commands may run concurrently, if so each command is started as soon as all its
+      requirements have succeeded
+    """
     track_multiple = sum(ex.command_count for ex in executors) > 1
-    coros = [ex.execute(track_multiple) for ex in executors]
     if parallel:
-        return_code_sets = await asyncio.gather(*coros, loop=loop)
+        tasks = {}
+
+        async def run_node(ex):
+            for req in ex.requires:
+                return_codes = await tasks[req]
+                if job_control.cancelled:
+                    break
+                if return_codes is None or any(return_codes):
+                    main_logger.warning('"%s" skipped since "%s" failed', ex.name, req)
+                    ex.emit_skipped('"{}" failed'.format(req))
+                    return None
+            if job_control.cancelled:
+                main_logger.warning('"%s" cancelled since %s', ex.name, job_control.cancel_reason)
+                ex.emit_skipped('cancelled since {}'.format(job_control.cancel_reason))
+                return [Cancelled(-1)] * ex.command_count
+            return await ex.execute(track_multiple)
+
+        for ex in executors:
+            tasks[ex.name] = asyncio.ensure_future(run_node(ex), loop=loop)
+        return_code_sets = await asyncio.gather(*tasks.values(), loop=loop)
     else:
         return_code_sets = []
-        for coro in coros:
-            return_codes = await coro
+        for ex in executors:
+            return_codes = await ex.execute(track_multiple)
             return_code_sets.append(return_codes)
             if any(return_codes):
                 break
-    return list(itertools.chain(*return_code_sets))
+    return list(itertools.chain(*filter(None, return_code_sets)))
 
 
-def execute(*commands: str, parallel: bool=None, args: str=None, definition_file: str=None):
-    reset_log_format()
-    if definition_file:
-        def_path = Path(definition_file).resolve()
-    else:
-        def_path = find_def_file()
+def get_artifact_store(config, def_path: Path):
+    if not config.get('artifacts'):
+        return None
+    from .cache import ArtifactStore
+    artifacts_config = config['artifacts']
+    return ArtifactStore(
+        # relative paths are relative to the definition file
+        def_path.parent / Path(artifacts_config['path']).expanduser(),
+        max_size=artifacts_config['max_size'],
+        link=artifacts_config['link'],
+    )
+
+
+def get_history(config, def_path: Path):
+    """
+    Open the history of runs of def_path, None if history is disabled or it can't be opened.
+    """
+    if not config['history']['enabled']:
+        return None
+    from .history import HISTORY_ERRORS, History
+    path = get_cache_dir() / 'history' / (hashlib.sha1(str(def_path).encode()).hexdigest() + '.sqlite3')
     try:
-        def_data = read_and_validate(str(def_path), STRUCTURE)
-    except ConfigError as e:
-        raise DonkeyError('Invalid definition file, {}'.format(e))
-    default_command = def_data.pop('.default', None)
+        return History(path, max_size=config['history']['max_size'])
+    except HISTORY_ERRORS as e:
+        main_logger.warning('unable to open history "%s", continuing without it: %s', path, e)
+        return None
+
+
+def run_special_commands(commands, definition) -> bool:
+    """
+    Run "check" or "stats" if included in commands, returns whether one was run.
+    """
+    if 'check' in commands:
+        definition.check()
+        main_logger.info('"%s" is valid', definition.path)
+        return True
+    # "stats" is only special if not defined, it's newer than most definition files
+    if 'stats' in commands and 'stats' not in definition.command_names:
+        show_stats(definition)
+        return True
+    return False
+
+
+def show_stats(definition):
+    if not definition.config['history']['enabled']:
+        raise DonkeyError('history is disabled in "{}"'.format(definition.path))
+    history = get_history(definition.config, definition.path)
+    if not history:
+        return
+    from .history import format_stats
+    try:
+        stats = history.stats()
+    finally:
+        history.close()
+    if not stats:
+        main_logger.info('no history yet for "%s"', definition.path)
+    for line in format_stats(stats):
+        main_logger.info('%s', line)
+
+
+def get_log_file(config, def_path: Path, log_file: str=None):
+    """
+    Start writing output and logs to the file given by log_file or ".config.logging" if either is set.
+    """
+    logging_config = config['logging']
+    if log_file:
+        path = Path(log_file)
+    elif logging_config.get('file'):
+        # relative paths are relative to the definition file
+        path = def_path.parent / Path(logging_config['file']).expanduser()
+    else:
+        return None
+    from .logfile import LogFile
+    log_file = LogFile(
+        path,
+        max_size=logging_config['max_size'],
+        rotate_every=logging_config.get('rotate_every'),
+        backups=logging_config['backups'],
+        compress=logging_config['compress'],
+    )
+    log_file.start()
+    return log_file
+
+
+class Runner:
+    """
+    Runs commands from a definition file along with their requirements, commands may be run more than once,
+    eg. in watch mode.
+    """
+    def __init__(self, definition, commands, def_data, *, loop, parallel, args, jobs, keep_going, timeout,
+                 log_output, output_mode, log_file, isolate, show_usage=False, events=None):
+        self.definition = definition
+        self.commands = commands
+        self.def_data = def_data
+        self.to_run = resolve_commands(commands, def_data)
+        self.loop = loop
+        self.parallel = parallel
+        self.args = args
+        self.keep_going = keep_going
+        self.timeout = timeout
+        config = definition.config
+        # processes are only moved into their own process group when they might need to be cancelled, otherwise
+        # they'd lose access to the terminal
+        self.isolate = isolate or (
+            not keep_going and (parallel or any(def_data[name].get('parallel') for name in self.to_run))
+        )
+
+        self.job_tokens = asyncio.Semaphore(jobs, loop=loop)
+        output_config = config['output']
+        grouped = (output_mode or output_config['mode']) == 'grouped'
+        if grouped and log_output:
+            raise DonkeyError('grouped output can\'t be used with "--log-output"')
+        self.log_file = get_log_file(config, definition.path, log_file)
+        self.events = events
+        self.output = OutputPipeline(
+            # keep stdout for events if they're written to it
+            sys.stderr if events and events.fd == 1 else sys.stdout,
+            log=log_output,
+            grouped=grouped,
+            max_buffer=output_config['max_buffer'],
+            tee=self.log_file,
+            events=events,
+        )
+        self.progress = output_config.get('progress') if self.output.grouped else None
+        self.capture_dir = definition.path.parent / '.donkey' / 'output' if output_config['save'] else None
+        self.artifacts = get_artifact_store(config, definition.path)
+        self.build_state = None
+        if self.artifacts or any(self._config(name, 'freshness') == 'hash' for name in self.to_run):
+            from .cache import BuildState
+            self.build_state = BuildState(definition.path.parent / '.donkey' / 'state')
+        self.python_pool = None
+        if config.get('python_workers'):
+            workers_config = config['python_workers']
+            self.python_pool = PythonWorkerPool(
+                loop=loop,
+                output=self.output,
+                preload=workers_config['preload'],
+                max_tasks=workers_config['max_tasks'],
+                max_memory=workers_config['max_memory'],
+            )
+        self.show_usage = show_usage
+        if (show_usage or events) and not CAN_WAIT4:
+            main_logger.warning('resource usage of each command isn\'t available with python %d.%d, '
+                                'only the total for each run is known', *sys.version_info[:2])
+        # history is opened when first used so sqlite isn't imported before commands start
+        self.history = None
+        self.use_history = config['history']['enabled']
+        # JobResults from the current run
+        self.results = []
+        self.job_control = None
+
+    def _config(self, name, key, default=None):
+        # option set on the command or otherwise in ".config"
+        return self.def_data[name].get(key, self.definition.config.get(key, default))
+
+    def start(self):
+        """
+        Start running commands, returns the task and the JobControl for this run.
+        """
+        reset_log_format()
+        self.results = []
+        self.job_control = JobControl(loop=self.loop, fail_fast=not self.keep_going, isolate=self.isolate)
+        executors = [self._executor(name) for name in self.to_run]
+        task = asyncio.ensure_future(self._run(executors, self.job_control), loop=self.loop)
+        return task, self.job_control
+
+    async def _run(self, executors, job_control):
+        progress = None
+        if self.progress:
+            progress = asyncio.ensure_future(self._report_progress(), loop=self.loop)
+        if self.parallel:
+            executors = self._order_executors(executors)
+        if self.events:
+            self.events.emit('run_started', commands=list(self.commands), jobs=[ex.name for ex in executors])
+        start = now()
+        # the usage of each process can't be known, so the total is the usage of all children which exit meanwhile
+        children_start = (self.show_usage or self.events) and not CAN_WAIT4 and children_usage()
+        return_codes = None
+        try:
+            return_codes = await run_graph(executors, self.parallel, job_control, loop=self.loop)
+            return return_codes
+        finally:
+            if progress:
+                progress.cancel()
+            time_taken = (now() - start).total_seconds()
+            usage = combine([r.usage for r in self.results if r.usage])
+            if children_start:
+                usage = usage_between(children_start, children_usage())
+            if self.events:
+                self._emit_summary(time_taken, return_codes, usage)
+            if self.build_state:
+                self.build_state.save()
+            if self.show_usage:
+                self._report_usage(time_taken, usage)
+            # the duration of a cancelled job says nothing about how long it takes
+            self._record_history([
+                r for r in self.results if not any(isinstance(rt, Cancelled) for rt in r.return_codes)
+            ])
+
+    def _open_history(self):
+        if self.use_history and not self.history:
+            self.history = get_history(self.definition.config, self.definition.path)
+            # get_history has already warned, don't try again
+            self.use_history = bool(self.history)
+        return self.history
+
+    def _order_executors(self, executors):
+        """
+        Order executors to start the jobs likely to take longest first.
+        """
+        history = self._open_history()
+        if not history:
+            return executors
+        from .history import HISTORY_ERRORS, critical_path_order
+        try:
+            durations = history.expected_durations(self.to_run)
+        except HISTORY_ERRORS as e:
+            self._history_failed(e)
+            return executors
+        return critical_path_order(executors, durations)
+
+    def _record_history(self, results):
+        history = results and self._open_history()
+        if not history:
+            return
+        from .history import HISTORY_ERRORS
+        try:
+            history.record(results)
+        except HISTORY_ERRORS as e:
+            self._history_failed(e)
+
+    def _history_failed(self, exc):
+        main_logger.warning('unable to use history, continuing without it: %s', exc)
+        self.history.close()
+        self.history = None
+        self.use_history = False
+
+    def _emit_summary(self, time_taken: float, return_codes, usage):
+        """
+        :param return_codes: return codes of all jobs, None if the run was interrupted
+        :param usage: total usage of all jobs, None if it's not known
+        """
+        failed = [r.name for r in self.results if r.return_codes[-1] and not isinstance(r.return_codes[-1], Cancelled)]
+        self.events.emit(
+            'run_finished',
+            duration=round(time_taken, 6),
+            success=return_codes is not None and not any(return_codes),
+            finished=[r.name for r in self.results],
+            failed=failed,
+            cancelled=[r.name for r in self.results if any(isinstance(rt, Cancelled) for rt in r.return_codes)],
+            usage=usage and usage._asdict(),
+        )
+
+    def _report_usage(self, time_taken: float, usage):
+        for result in self.results:
+            if result.usage:
+                main_logger.info('"%s" used %s', result.name, format_usage(result.usage, result.time_taken))
+        # the total is only worth showing if there's more than one command or their own usage isn't known
+        if usage and (len(self.results) > 1 or not CAN_WAIT4):
+            main_logger.info('total %s', format_usage(usage, time_taken))
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(self.progress, loop=self.loop)
+            self.output.report_progress()
+
+    def _executor(self, name):
+        c = self.def_data[name]
+        settings = self.definition.settings.copy()
+        settings.update(c.get('settings', {}))  # TODO this should be recursive
+        return CommandExecutor(
+            name,
+            c['run'],
+            loop=self.loop,
+            job_tokens=self.job_tokens,
+            job_control=self.job_control,
+            output=self.output,
+            settings=settings,
+            # args are only passed to commands called directly, not their requirements
+            args=self.args if name in self.commands else None,
+            parallel=c.get('parallel', False),  # TODO add config option
+            interpreter=c.get('interpreter') or self.definition.config.get('interpreter'),
+            script_mode=self._config(name, 'script_mode', False),
+            requires=c['requires'],
+            sources=c['sources'],
+            targets=c['targets'],
+            hash_mode=self._config(name, 'freshness') == 'hash',
+            build_state=self.build_state,
+            artifacts=self.artifacts,
+            timeout=self.timeout or self._config(name, 'timeout'),
+            session=self._config(name, 'session', False),
+            python_pool=self.python_pool,
+            results=self.results,
+            events=self.events,
+            failure_tail=self.definition.config['output']['failure_tail'],
+            capture_dir=self.capture_dir,
+        )
+
+    def stop(self):
+        if self.job_control:
+            # eg. on KeyboardInterrupt, processes in their own process group won't have received the signal
+            self.job_control.stop_all()
+
+    async def close(self):
+        if self.job_control:
+            await self.job_control.close()
+        if self.python_pool:
+            await self.python_pool.close()
+        if self.log_file:
+            self.log_file.close()
+        if self.history:
+            self.history.close()
+
+
+def execute(*commands: str, parallel: bool=None, args: str=None, definition_file: str=None, jobs: int=None,
+            keep_going: bool=None, timeout: float=None, log_output: bool=False, watch: Tuple[str, ...]=(),
+            interval: float=None, output: str=None, log_file: str=None, usage: bool=False, events=None):
+    reset_log_format()
+    definition = load_definition(definition_file)
+    if run_special_commands(commands, definition):
+        return 0
     if not commands:
-        if not default_command:
+        if not definition.default:
             raise DonkeyError('no commands supplied and default command not set')
-        commands = default_command,
-    settings = def_data.pop('.settings')
-    config = def_data.pop('.config')
+        commands = definition.default,
+    config = definition.config
     if parallel is None:
         parallel = config.get('parallel', False)
+    if keep_going is None:
+        keep_going = config.get('keep_going', False)
 
-    to_run = []
-    for c in commands:
-        if c not in def_data:
-            raise DonkeyError('Command "{}" not found in "{}", '
-                              'options: {}'.format(c, def_path, ', '.join(def_data.keys())))
-        to_run.append((c, def_data[c]))
-
+    def_data = definition.get_commands(commands)
+    watch_patterns = list(watch) + [p for name in commands for p in def_data[name].get('watch', [])]
+    watcher_config = config['watcher']
+    interval_config = get_interval_config(commands, def_data, interval)
+    if watch_patterns and interval_config:
+        raise DonkeyError('"watch" and "interval" can\'t be used together')
     with loop_context() as loop:
-        executors = []
-        for name, c in to_run:
-            _settings = settings.copy()
-            _settings.update(c.get('settings', {}))  # TODO this should be recursive
-            executors.append(CommandExecutor(
-                name,
-                c['run'],
+        with span('runner setup'):
+            runner = Runner(
+                definition,
+                commands,
+                def_data,
                 loop=loop,
-                settings=_settings,
+                parallel=parallel,
                 args=args,
-                parallel=c.get('parallel', False),  # TODO add config option
-                interpreter=c.get('interpreter') or config.get('interpreter'),
-                script_mode=c.get('script_mode', config.get('script_mode', False)),
-            ))
-        return_codes = loop.run_until_complete(run_coros(executors, parallel, loop=loop))
+                jobs=jobs or config.get('jobs') or os.cpu_count() or 1,
+                keep_going=keep_going,
+                timeout=timeout,
+                log_output=log_output,
+                output_mode=output,
+                log_file=log_file,
+                isolate=bool(watch_patterns) and watcher_config['on_change'] == 'cancel',
+                show_usage=usage,
+                events=events,
+            )
+        try:
+            if watch_patterns:
+                return watch_commands(runner, watch_patterns, watcher_config, loop=loop)
+            elif interval_config:
+                return interval_commands(runner, interval_config, loop=loop)
+            task, _ = runner.start()
+            return_codes = loop.run_until_complete(task)
+        except BaseException:
+            runner.stop()
+            raise
+        finally:
+            loop.run_until_complete(runner.close())
+
+    failed = [rt for rt in return_codes if rt]
+    if not failed:
+        return 0
+    # the return code of a job which failed takes precedence over those of jobs cancelled as a result
+    failed_return_code = next((rt for rt in failed if not isinstance(rt, Cancelled)), failed[0])
+    codes_str = ', '.join(map(str, sorted(return_codes, key=lambda rt: (isinstance(rt, Cancelled), rt))))
+    raise DonkeyFailure('commands failed, return codes: {}'.format(codes_str), int(failed_return_code) or 1)
+
 
+def watch_commands(runner: Runner, patterns: List[str], watcher_config, *, loop):
+    """
+    Run commands then run them again whenever the files they watch change, until interrupted.
+    """
+    # watchdog is relatively slow to import and starts threads so is only imported when it's used
+    from .watch import Watcher, watch
+    watcher = Watcher(
+        patterns,
+        loop=loop,
+        ignore=watcher_config['ignore'],
+        # changes to targets are ignored so commands don't trigger themselves
+        ignore_paths=[t for name in runner.to_run for t in runner.def_data[name]['targets']],
+        debounce=watcher_config['debounce'],
+    )
+    watcher.start()
+    main_logger.info('watching %s', ', '.join('"{}"'.format(p) for p in patterns))
     try:
-        failed_return_code = next(rt for rt in return_codes if rt != 0)
-    except StopIteration:
+        loop.run_until_complete(watch(runner.start, watcher, on_change=watcher_config['on_change'], loop=loop))
+    except KeyboardInterrupt:
+        runner.stop()
+        return 0
+    finally:
+        watcher.stop()
+
+
+def get_interval_config(commands, def_data, interval: float=None):
+    """
+    Interval options from the first command called directly which has them, "interval" overrides the time between
+    runs.
+    """
+    interval_config = next((def_data[name]['interval'] for name in commands if def_data[name].get('interval')), None)
+    if interval is not None:
+        if interval <= 0:
+            raise DonkeyError('interval must be greater than 0')
+        from .interval import INTERVAL_DEFAULTS
+        interval_config = dict(interval_config or INTERVAL_DEFAULTS, every=interval)
+    return interval_config
+
+
+def interval_commands(runner: Runner, interval_config, *, loop):
+    """
+    Run commands repeatedly until interrupted, see interval.run_interval.
+    """
+    from .interval import run_interval
+    try:
+        loop.run_until_complete(run_interval(runner.start, loop=loop, **interval_config))
+    except KeyboardInterrupt:
+        runner.stop()
         return 0
-    else:
-        codes_str = ', '.join(map(str, sorted(return_codes)))
-        raise DonkeyFailure('commands failed, return codes: {}'.format(codes_str), failed_return_code)
@@ -0,0 +1,242 @@
+import codecs
+import locale
+import logging
+import tempfile
+import time
+
+import click
+
+command_logger = logging.getLogger('donkey.commands')
+main_logger = logging.getLogger('donkey.main')
+
+RESET = '\x1b[0m'
+COPY_SIZE = 2 ** 16
+# seconds to wait for a process's pipes to close once it's exited, they stay open if the process started something
+# in the background which inherited them, eg. "./server &"
+PIPE_GRACE = 0.1
+
+
+class OutputPipeline:
+    """
+    Writes the output of commands to a stream, generally stdout.
+
+    Each chunk of output received from a process is decoded, split into lines and prefixed then written with
+    a single write(). If log is True output is instead sent line by line to the "donkey.commands" logger, this is
+    much slower but allows output to be processed with the standard logging machinery.
+
+    If grouped is True the output of each job is buffered and written in one block when the job finishes, see
+    JobOutput.
+
+    If events is an EventWriter with output_lines set, each line of output is sent as an event instead.
+    """
+    name = None
+    capture = None
+
+    def __init__(self, stream, *, log=False, grouped=False, max_buffer=2 ** 20, tee=None, events=None):
+        self.stream = stream
+        # eg. a LogFile which gets a copy of everything written
+        self.tee = tee
+        self.log = log
+        self.grouped = grouped
+        self.max_buffer = max_buffer
+        self.events = events if events and events.output_lines else None
+        self.colour = hasattr(stream, 'isatty') and stream.isatty()
+        self.decoder_factory = codecs.getincrementaldecoder(locale.getpreferredencoding(False))
+        # jobs with buffered output which haven't yet finished
+        self.jobs = []
+
+    def job(self, name: str, *, capture=None):
+        """
+        Get the output for one job, this is a new JobOutput in grouped mode, if the output should be captured or
+        sent as events, otherwise the pipeline itself.
+        """
+        if self.grouped or capture or self.events:
+            return JobOutput(self, name, capture=capture)
+        return self
+
+    def finish(self):
+        pass
+
+    def report_progress(self):
+        for job in self.jobs:
+            main_logger.info('"%s" running for %0.0fs, %d line%s of output', job.name, time.monotonic() - job.started,
+                             job.lines, '' if job.lines == 1 else 's')
+
+    def process(self, log_format) -> 'ProcessOutput':
+        """
+        Create an object to process the output of one subprocess.
+        """
+        return ProcessOutput(self, log_format)
+
+    def write(self, s: str):
+        self.stream.write(s)
+        self.stream.flush()
+        if self.tee:
+            self.tee.write(s)
+
+
+class JobOutput:
+    """
+    Output of one job, in grouped mode output is buffered until finish() is called, it's kept in memory until it
+    exceeds the pipeline's max_buffer then in a temporary file.
+
+    If set, capture is fed the raw output of the job's processes, see capture.OutputCapture.
+    """
+    def __init__(self, pipeline: OutputPipeline, name: str, *, capture=None):
+        self.pipeline = pipeline
+        self.name = name
+        self.capture = capture
+        self.log = pipeline.log
+        self.events = pipeline.events
+        self.buffered = pipeline.grouped
+        self.colour = pipeline.colour
+        self.decoder_factory = pipeline.decoder_factory
+        self.started = time.monotonic()
+        self.lines = 0
+        self.size = 0
+        self._parts = []
+        self._file = None
+        pipeline.jobs.append(self)
+
+    def process(self, log_format) -> 'ProcessOutput':
+        return ProcessOutput(self, log_format)
+
+    def write(self, s: str):
+        self.lines += s.count('\n')
+        if not self.buffered:
+            self.pipeline.write(s)
+            return
+        if self._file:
+            self._file.write(s)
+            return
+        self._parts.append(s)
+        self.size += len(s)
+        if self.size > self.pipeline.max_buffer:
+            self._file = tempfile.TemporaryFile('w+', encoding='utf8')
+            self._file.write(''.join(self._parts))
+            self._parts = []
+
+    def finish(self):
+        if self in self.pipeline.jobs:
+            self.pipeline.jobs.remove(self)
+        if self._file:
+            self._file.seek(0)
+            for chunk in iter(lambda: self._file.read(COPY_SIZE), ''):
+                self.pipeline.write(chunk)
+            self._file.close()
+            self._file = None
+        elif self._parts:
+            self.pipeline.write(''.join(self._parts))
+            self._parts = []
+        if self.capture:
+            self.capture.close()
+
+
+class ProcessOutput:
+    def __init__(self, pipeline, log_format):
+        self.pipeline = pipeline
+        self.capture = pipeline.capture
+        self.events = pipeline.events
+        self.name = pipeline.name
+        self.symbol = log_format['symbol']
+        self.colour = log_format['colour']
+        # one decoder per fd so multi-byte characters split between chunks are decoded correctly
+        self.decoders = {}
+        self.has_trailing_nl = True
+        if pipeline.colour:
+            self.start = click.style('', fg=self.colour, reset=False)
+            self.reset = RESET
+        else:
+            self.start = self.reset = ''
+        self._prefixes = {}
+        # fd > incomplete last line, only used for events
+        self._partial = {}
+
+    def feed(self, fd: int, data: bytes):
+        if self.capture:
+            self.capture.feed(fd, data)
+        decoder = self.decoders.get(fd)
+        if decoder is None:
+            decoder = self.decoders[fd] = self.pipeline.decoder_factory(errors='replace')
+        s = decoder.decode(data)
+        if s:
+            self._write(fd, s)
+
+    def close(self):
+        for fd, decoder in self.decoders.items():
+            s = decoder.decode(b'', final=True)
+            if s:
+                self._write(fd, s)
+        if self.events:
+            for fd, partial in self._partial.items():
+                if partial:
+                    self.events.output(self.name, fd, [partial])
+            self._partial = {}
+            return
+        if not self.has_trailing_nl:
+            # print new line after a command which ended without one
+            if self.pipeline.log:
+                command_logger.info('<nl>')
+            else:
+                self.pipeline.write('\n')
+
+    def _write(self, fd: int, s: str):
+        if self.events:
+            return self._emit(fd, s)
+        *lines, last = s.split('\n')
+        if self.pipeline.log:
+            return self._log(fd, lines, last)
+
+        parts = []
+        prefix = self._prefix(fd)
+        for line in lines:
+            # if the previous chunk ended without a newline this line is a continuation so has no prefix
+            # eg. for test output "........"
+            parts += (prefix if self.has_trailing_nl else self.start), line, self.reset, '\n'
+            self.has_trailing_nl = True
+        if last:
+            parts += (prefix if self.has_trailing_nl else self.start), last, self.reset
+            self.has_trailing_nl = False
+        self.pipeline.write(''.join(parts))
+
+    def _prefix(self, fd: int) -> str:
+        now = int(time.time())
+        cached = self._prefixes.get(fd)
+        if cached and cached[0] == now:
+            return cached[1]
+        prefix = time.strftime('%H:%M:%S ', time.localtime(now))
+        if self.pipeline.colour:
+            prefix = click.style(prefix, fg='magenta')
+        prefix += self.start
+        if self.symbol:
+            prefix += self.symbol + ' '
+        prefix += '{}: '.format(fd)
+        self._prefixes[fd] = now, prefix
+        return prefix
+
+    def _emit(self, fd: int, s: str):
+        *lines, last = s.split('\n')
+        if lines:
+            lines[0] = self._partial.pop(fd, '') + lines[0]
+            self.events.output(self.name, fd, lines)
+            self._partial[fd] = last
+        else:
+            self._partial[fd] = self._partial.get(fd, '') + last
+
+    def _log(self, fd: int, lines, last):
+        log = command_logger.info if fd == 1 else command_logger.warning
+        for line in lines:
+            log('%s', line, extra=self._log_extra(fd, nl=True))
+            self.has_trailing_nl = True
+        if last:
+            log('%s', last, extra=self._log_extra(fd, nl=False))
+            self.has_trailing_nl = False
+
+    def _log_extra(self, fd, *, nl):
+        return {
+            'fd': fd,
+            'symbol': self.symbol,
+            'colour': self.colour,
+            'nl': nl,
+            'prev_nl': self.has_trailing_nl,
+        }
@@ -0,0 +1,152 @@
+import re
+from pathlib import Path
+
+import trafaret as t
+import yaml
+
+from .exceptions import DonkeyError
+
+# the C loader is much faster where available
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# TODO in trafaret
+# better errors for Or
+
+STRING_DICT = t.Dict()
+STRING_DICT.allow_extra('*', trafaret=t.String)
+
+SIZE_UNITS = {'': 1, 'k': 2 ** 10, 'm': 2 ** 20, 'g': 2 ** 30}
+
+
+def parse_size(v):
+    m = re.fullmatch(r'(\d+) *([kmg]?)b?', v.strip().lower())
+    if not m:
+        raise t.DataError('invalid size "{}", should be a number of bytes or eg. "500MB"'.format(v))
+    return int(m.group(1)) * SIZE_UNITS[m.group(2)]
+
+
+SIZE = t.Int(gte=0) | t.String >> parse_size
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(v):
+    m = re.fullmatch(r'(\d+(?:\.\d+)?) *([smh]?)', v.strip().lower())
+    if not m or float(m.group(1)) == 0:
+        raise t.DataError('invalid duration "{}", should be a number of seconds or eg. "10m"'.format(v))
+    return float(m.group(1)) * DURATION_UNITS[m.group(2)]
+
+
+DURATION = t.Float(gt=0) | t.String >> parse_duration
+INTERVAL = t.Dict({
+    t.Key('every'): DURATION,
+    t.Key('mode', default='rate'): t.Enum('rate', 'delay'),
+    t.Key('jitter', default=0): t.Float(gte=0) | DURATION,
+    t.Key('if_running', default='skip'): t.Enum('skip', 'wait'),
+})
+
+# directories and files which never trigger watch mode
+WATCH_IGNORE = '.git', '.hg', '.svn', '.donkey', '.idea', 'node_modules', '__pycache__', '*.pyc', '.*.swp', '*~'
+
+CONFIG_OPTIONS = t.Dict({
+    t.Key('interpreter', optional=True): t.String,
+    t.Key('parallel', optional=True): t.Bool,
+    t.Key('script', optional=True, to_name='script_mode'): t.Bool,
+    t.Key('freshness', optional=True): t.Enum('mtime', 'hash'),
+    t.Key('timeout', optional=True): DURATION,
+    t.Key('session', optional=True): t.Bool,
+})
+
+TOP_LEVEL_KEYS = {
+    t.Key('.default', optional=True): t.String,
+    t.Key('.settings', default={}): STRING_DICT,
+    t.Key('.config', default={}): CONFIG_OPTIONS + t.Dict({
+        t.Key('jobs', optional=True): t.Int(gte=1),
+        t.Key('keep_going', optional=True): t.Bool,
+        t.Key('artifacts', optional=True): t.Dict({
+            t.Key('path'): t.String,
+            t.Key('max_size', default='5GB'): SIZE,
+            t.Key('link', default=False): t.Bool,
+        }),
+        t.Key('watcher', default={}): t.Dict({
+            t.Key('ignore', default=list(WATCH_IGNORE)): t.List(t.String),
+            t.Key('debounce', default=0.2): t.Float(gte=0),
+            t.Key('on_change', default='queue'): t.Enum('queue', 'cancel'),
+        }),
+        t.Key('output', default={}): t.Dict({
+            t.Key('mode', default='stream'): t.Enum('stream', 'grouped'),
+            # output of each job kept in memory in grouped mode before it's moved to a temporary file
+            t.Key('max_buffer', default='1MB'): SIZE,
+            t.Key('progress', optional=True): DURATION,
+            # number of lines of output to show again when a command fails
+            t.Key('failure_tail', default=0): t.Int(gte=0),
+            # save the full output of each command in ".donkey/output"
+            t.Key('save', default=False): t.Bool,
+        }),
+        t.Key('logging', default={}): t.Dict({
+            # relative to the definition file
+            t.Key('file', optional=True): t.String,
+            t.Key('max_size', default='50MB'): SIZE,
+            t.Key('rotate_every', optional=True): DURATION,
+            t.Key('backups', default=5): t.Int(gte=0),
+            t.Key('compress', default=True): t.Bool,
+        }),
+        t.Key('history', default={}): t.Dict({
+            # durations etc. of every run are kept with sqlite in the cache directory, see get_history
+            t.Key('enabled', default=True): t.Bool,
+            t.Key('max_size', default='2MB'): SIZE,
+        }),
+        t.Key('python_workers', optional=True): t.Dict({
+            t.Key('preload', default=[]): t.List(t.String),
+            t.Key('max_tasks', default=100): t.Int(gte=1),
+            t.Key('max_memory', default='1GB'): SIZE,
+        }),
+    }),
+}
+
+COMMAND = t.Or(
+    CONFIG_OPTIONS + t.Dict({
+        t.Key(name='settings', default={}): STRING_DICT,
+        t.Key(name='requires', default=[]): t.List(t.String),
+        t.Key(name='run', default=[]): t.List(t.String),
+        t.Key(name='sources', default=[]): t.List(t.String),
+        t.Key(name='targets', default=[]): t.List(t.String),
+        t.Key(name='watch', optional=True): t.List(t.String),
+        # either just the time between runs or a dict of options
+        t.Key(name='interval', optional=True): DURATION >> (lambda every: INTERVAL({'every': every})) | INTERVAL,
+    }),
+    t.List(t.String) >> (lambda s: {'settings': {}, 'requires': [], 'run': s, 'sources': [], 'targets': []}),
+)
+
+
+def parse(def_path: Path) -> dict:
+    with def_path.open() as f:
+        try:
+            raw = yaml.load(f, Loader=YamlLoader)
+        except yaml.YAMLError as e:
+            raise DonkeyError('Invalid definition file, {}'.format(e))
+    if not isinstance(raw, dict):
+        raise DonkeyError('Invalid definition file, should be a mapping of command names to commands')
+    return raw
+
+
+def validate_top_level(def_path: Path, data: dict) -> dict:
+    return _validate(def_path, data, TOP_LEVEL_KEYS)
+
+
+def validate_command(def_path: Path, name: str, data) -> dict:
+    return _validate(def_path, {name: data}, {t.Key(name): COMMAND})[name]
+
+
+def _validate(def_path: Path, data: dict, keys: dict):
+    try:
+        return t.Dict(keys).check(data)
+    except t.DataError as e:
+        # parse the file again with trafaret_config to get an error message which includes line numbers
+        from trafaret_config import ConfigError, read_and_validate
+        trafaret = t.Dict(keys)
+        trafaret.allow_extra('*')
+        try:
+            read_and_validate(str(def_path), trafaret)
+        except ConfigError as config_error:
+            raise DonkeyError('Invalid definition file, {}'.format(config_error))
+        raise DonkeyError('Invalid definition file, {}'.format(e))
@@ -0,0 +1,158 @@
+import array
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+
+from .client import get_socket_path, read_line
+from .exceptions import DonkeyError
+from .version import VERSION
+
+main_logger = logging.getLogger('donkey.main')
+
+
+def recv_request(sock: socket.socket):
+    """
+    Receive a request sent by client.send_request, returns the request and the file descriptors sent with it.
+    """
+    fds = array.array('i')
+    msg, ancdata, _, _ = sock.recvmsg(65536, socket.CMSG_LEN(3 * fds.itemsize))
+    for level, type_, data in ancdata:
+        if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    fds = list(fds)
+    try:
+        if not msg.endswith(b'\n'):
+            msg += read_line(sock)
+        request = json.loads(msg.decode())
+        if len(fds) != 3:
+            raise ValueError('expected 3 file descriptors, got {}'.format(len(fds)))
+    except Exception:
+        close_fds(fds)
+        raise
+    return request, fds
+
+
+def send_response(sock: socket.socket, response: dict):
+    sock.sendall(json.dumps(response).encode() + b'\n')
+
+
+def close_fds(fds):
+    for fd in fds:
+        os.close(fd)
+
+
+class DonkeyServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """
+    Runs donkey for clients, each connection is handled by a process forked from the server so modules are already
+    imported. Requests are read in the forked process so a client which is slow to send its request doesn't hold up
+    others.
+
+    Clients send their stdin, stdout and stderr so output goes directly to the client's terminal.
+    """
+    def __init__(self, socket_path: str):
+        super().__init__(socket_path, RequestHandler, bind_and_activate=False)
+        try:
+            # the socket is created by bind, with this umask only the current user can ever connect to it
+            old_umask = os.umask(0o177)
+            try:
+                self.server_bind()
+            finally:
+                os.umask(old_umask)
+            self.server_activate()
+        except BaseException:
+            self.server_close()
+            raise
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    finished = False
+
+    def handle(self):
+        self.request.settimeout(5)
+        try:
+            msg, fds = recv_request(self.request)
+        except (OSError, ValueError):
+            return
+        self.request.settimeout(None)
+        if msg.get('version') != VERSION:
+            close_fds(fds)
+            send_response(self.request, {'error': 'server is running donkey {}'.format(VERSION)})
+            return
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, target in zip(fds, (0, 1, 2)):
+            os.dup2(fd, target)
+        close_fds(fds)
+        os.chdir(msg['cwd'])
+        os.environ.clear()
+        os.environ.update(msg['env'])
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        threading.Thread(target=self.watch_client, daemon=True).start()
+
+        exit_code = run_cli(msg['argv'])
+        self.finished = True
+        send_response(self.request, {'exit': exit_code})
+
+    def watch_client(self):
+        # the client sends "interrupt" when it gets SIGINT, or closes the connection if it's killed
+        try:
+            read_line(self.request)
+        except OSError:
+            pass
+        if not self.finished:
+            os.kill(os.getpid(), signal.SIGINT)
+
+
+def run_cli(argv) -> int:
+    from .cli import cli
+    try:
+        cli.main(args=argv, prog_name='donkey')
+    except SystemExit as e:
+        exit_code = e.code
+    else:  # pragma: no cover
+        exit_code = 0
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    if exit_code is None or isinstance(exit_code, int):
+        return exit_code or 0
+    print(exit_code, file=sys.stderr)
+    return 1
+
+
+def serve(socket_path: str=None):
+    """
+    Run the donkey server until interrupted.
+    """
+    socket_path = socket_path or get_socket_path()
+    if os.path.exists(socket_path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(socket_path)
+            except OSError:
+                # left by a server which didn't shut down cleanly
+                os.unlink(socket_path)
+            else:
+                raise DonkeyError('donkey server already running at "{}"'.format(socket_path))
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+
+    # import everything required to run commands so requests don't have to, definitions aren't kept in memory but
+    # each forked process loads them quickly from the on-disk cache
+    from . import main, schema  # noqa: F401
+    server = DonkeyServer(socket_path)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    main_logger.info('donkey server listening on "%s"', socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
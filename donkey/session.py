@@ -0,0 +1,290 @@
+import asyncio
+import os
+from typing import Dict, List, Optional
+
+from .output import PIPE_GRACE, OutputPipeline
+
+# run by bash, reads NUL terminated lines from the control pipe and runs each in a subshell so lines can't affect
+# each other, eg. with "cd" or "exit", then writes a marker with the return code to stdout and stderr
+DRIVER = """\
+while IFS= read -r -d '' __donkey_line <&{fd}; do
+  ( exec {fd}<&-; eval "$__donkey_line" )
+  __donkey_rc=$?
+  printf '\\0donkey-{token}:%d\\n' $__donkey_rc
+  printf '\\0donkey-{token}:%d\\n' $__donkey_rc >&2
+done
+"""
+# run by python with arguments: control pipe fd, token, modules to import. Reads NUL terminated snippets and runs
+# each in a fresh namespace, the marker on stdout includes the process's peak memory usage in bytes
+PYTHON_DRIVER = """\
+import os, sys, traceback
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def run(code):
+    try:
+        exec(compile(code, '<string>', 'exec'), {'__name__': '__main__', '__builtins__': __builtins__})
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return int(e.code or 0)
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    return 0
+
+def main():
+    ctl, marker = int(sys.argv[1]), '\\0donkey-{}:'.format(sys.argv[2]).encode()
+    for module in sys.argv[3:]:
+        __import__(module)
+    cwd, environ, buffer = os.getcwd(), dict(os.environ), b''
+    while True:
+        while b'\\0' not in buffer:
+            data = os.read(ctl, 65536)
+            if not data:
+                return
+            buffer += data
+        code, buffer = buffer.split(b'\\0', 1)
+        sys.argv = ['-c']
+        rc = run(os.fsdecode(code))
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # undo changes which would affect the next snippet
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(environ)
+        memory = 0
+        if resource:
+            memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            memory *= 1 if sys.platform == 'darwin' else 1024
+        os.write(1, marker + '{}:{}\\n'.format(rc, memory).encode())
+        os.write(2, marker + '{}\\n'.format(rc).encode())
+
+main()
+"""
+
+
+class SessionProtocol(asyncio.SubprocessProtocol):
+    def __init__(self, session: 'ShellSession'):
+        self.session = session
+        self._grace_timer = None
+
+    def pipe_data_received(self, fd, data):
+        try:
+            self.session.data_received(fd, data)
+        except Exception as e:
+            self.session.set_exception(e)
+
+    def process_exited(self):
+        # pipes may be held open by background processes, see PIPE_GRACE
+        self._grace_timer = self.session.loop.call_later(PIPE_GRACE, self.connection_lost, None)
+
+    def connection_lost(self, exc):
+        if self._grace_timer:
+            self._grace_timer.cancel()
+        try:
+            self.session.connection_lost()
+        except Exception as e:
+            self.session.set_exception(e)
+
+
+class ShellSession:
+    """
+    A single bash process which runs the lines of a command one at a time, this avoids starting a new shell for
+    every line.
+
+    Lines are sent over a control pipe, after each line the shell writes a marker with the line's return code to
+    both stdout and stderr, everything before the markers is output of that line.
+    """
+    def __init__(self, interpreter: str, *, loop, output: OutputPipeline):
+        self.interpreter = interpreter
+        self.loop = loop
+        self.output = output
+        self.log_format = None
+        self.tasks = 0
+        # peak memory usage in bytes if reported by the driver
+        self.memory = 0
+        self.token = os.urandom(8).hex()
+        self.marker = '\0donkey-{}:'.format(self.token).encode()
+        self.buffers = {1: b'', 2: b''}
+        self.transport = None
+        self._ctl = None
+        self._current = None
+        # fd > return code from the marker of the line currently running
+        self._line_results = {}
+        self._line_done = None
+        self._exited = asyncio.Future(loop=loop)
+
+    async def start(self, *, stdin, start_new_session: bool):
+        ctl_read, self._ctl = os.pipe()
+        try:
+            self.transport, _ = await self.loop.subprocess_exec(
+                lambda: SessionProtocol(self),
+                *self._driver_args(ctl_read),
+                stdin=stdin,
+                pass_fds=(ctl_read,),
+                start_new_session=start_new_session,
+            )
+        except Exception:
+            os.close(self._ctl)
+            raise
+        finally:
+            os.close(ctl_read)
+        return self.transport
+
+    def _driver_args(self, ctl_read: int) -> List[str]:
+        return [self.interpreter, '-c', DRIVER.format(fd=ctl_read, token=self.token)]
+
+    @property
+    def running(self) -> bool:
+        return not self._exited.done()
+
+    async def run(self, line: str, log_format: Dict[str, str], *, output=None) -> Optional[int]:
+        """
+        Run one line, returns the line's return code or None if the shell exited before the line finished.
+
+        :param output: where output of this line and any later output should go if not the session's current output
+        """
+        if self._exited.done():
+            return None
+        self.tasks += 1
+        self.log_format = log_format
+        if output is not None:
+            self.output = output
+        self._current = self.output.process(log_format)
+        self._line_results = {}
+        self._line_done = asyncio.Future(loop=self.loop)
+        try:
+            os.write(self._ctl, os.fsencode(line) + b'\0')
+        except BrokenPipeError:
+            return None
+        return await self._line_done
+
+    async def close(self) -> int:
+        """
+        Close the control pipe so the shell exits once it's finished the current line, returns its return code.
+        """
+        if self._ctl is not None:
+            os.close(self._ctl)
+            self._ctl = None
+        await self._exited
+        return_code = self.transport.get_returncode()
+        self.transport.close()
+        return return_code
+
+    def data_received(self, fd: int, data: bytes):
+        if self._exited.done():
+            # from a background process after the shell exited
+            return
+        buffer = self.buffers[fd] + data
+        while True:
+            pos = buffer.find(self.marker)
+            if pos == -1:
+                break
+            end = buffer.find(b'\n', pos)
+            if end == -1:
+                # marker not yet complete, wait for more data
+                self._feed(fd, buffer[:pos])
+                self.buffers[fd] = buffer[pos:]
+                return
+            self._feed(fd, buffer[:pos])
+            self._marker_received(fd, buffer[pos + len(self.marker):end].split(b':'))
+            buffer = buffer[end + 1:]
+
+        # hold back anything which might be the start of a marker split between chunks
+        keep = 0
+        nul = buffer.rfind(b'\0', -len(self.marker))
+        if nul != -1 and self.marker.startswith(buffer[nul:]):
+            keep = len(buffer) - nul
+        self._feed(fd, buffer[:len(buffer) - keep])
+        self.buffers[fd] = buffer[len(buffer) - keep:]
+
+    def _feed(self, fd: int, data: bytes):
+        if data:
+            if self._current is None:
+                # output from a background process after its line finished
+                self._current = self.output.process(self.log_format)
+            self._current.feed(fd, data)
+
+    def _marker_received(self, fd: int, fields: List[bytes]):
+        self._line_results[fd] = int(fields[0])
+        if len(fields) > 1:
+            self.memory = int(fields[1])
+        if len(self._line_results) == 2:
+            if self._current is not None:
+                self._current.close()
+                self._current = None
+            if self._line_done and not self._line_done.done():
+                self._line_done.set_result(self._line_results[1])
+
+    def set_exception(self, exc: Exception):
+        for future in (self._line_done, self._exited):
+            if future and not future.done():
+                future.set_exception(exc)
+
+    def connection_lost(self):
+        if self._exited.done():
+            return
+        for fd, buffer in self.buffers.items():
+            self._feed(fd, buffer)
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+        if self._line_done and not self._line_done.done():
+            self._line_done.set_result(None)
+        if not self._exited.done():
+            self._exited.set_result(True)
+
+
+class PythonWorker(ShellSession):
+    """
+    A python process which runs snippets of code one at a time after importing "preload" modules, so the cost of
+    starting python and importing those modules is only paid once.
+    """
+    def __init__(self, interpreter: str, *, loop, output: OutputPipeline, preload: List[str]):
+        super().__init__(interpreter, loop=loop, output=output)
+        self.preload = preload
+
+    def _driver_args(self, ctl_read: int) -> List[str]:
+        return [self.interpreter, '-c', PYTHON_DRIVER, str(ctl_read), self.token] + self.preload
+
+
+class PythonWorkerPool:
+    """
+    Idle python workers for each python interpreter, workers are started when needed and replaced after max_tasks
+    snippets or once their memory usage exceeds max_memory.
+    """
+    def __init__(self, *, loop, output: OutputPipeline, preload: List[str], max_tasks: int, max_memory: int):
+        self.loop = loop
+        self.output = output
+        self.preload = preload
+        self.max_tasks = max_tasks
+        self.max_memory = max_memory
+        # interpreter > idle workers
+        self.idle = {}
+
+    async def acquire(self, interpreter: str, *, stdin, start_new_session: bool) -> PythonWorker:
+        idle = self.idle.get(interpreter, [])
+        while idle:
+            worker = idle.pop()
+            if worker.running:
+                return worker
+        worker = PythonWorker(interpreter, loop=self.loop, output=self.output, preload=self.preload)
+        await worker.start(stdin=stdin, start_new_session=start_new_session)
+        return worker
+
+    async def release(self, worker: PythonWorker):
+        # any later output from the worker doesn't belong to the job which just used it
+        worker.output = self.output
+        if worker.running and worker.tasks < self.max_tasks and worker.memory <= self.max_memory:
+            self.idle.setdefault(worker.interpreter, []).append(worker)
+        else:
+            await worker.close()
+
+    async def close(self):
+        workers = [w for idle in self.idle.values() for w in idle]
+        self.idle = {}
+        await asyncio.gather(*[w.close() for w in workers], loop=self.loop)
@@ -0,0 +1,143 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# the current tracer if tracing is enabled, see start_trace
+_tracer = None
+
+
+class Tracer:
+    """
+    Records what donkey is doing as trace events, the saved file can be viewed in chrome://tracing or Perfetto.
+
+    Donkey's own work is shown on the first row, each job is shown on its own row with rows reused once jobs finish,
+    so the number of rows is the largest number of jobs running at once.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.events = []
+        # task running a job > row
+        self._task_rows = {}
+        self._busy_rows = set()
+        self._row_count = 0
+
+    def complete(self, name: str, cat: str, start: float, end: float=None, *, row: int=0, args: dict=None):
+        end = time.perf_counter() if end is None else end
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': self._ts(start),
+            'dur': round((end - start) * 1e6, 1),
+            'pid': self.pid,
+            'tid': row,
+        }
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def _ts(self, t: float) -> float:
+        # microseconds since tracing started
+        return round((t - self.origin) * 1e6, 1)
+
+    def start_job(self, *, loop) -> int:
+        row = 1
+        while row in self._busy_rows:
+            row += 1
+        self._busy_rows.add(row)
+        self._row_count = max(self._row_count, row)
+        self._task_rows[current_task(loop=loop)] = row
+        return row
+
+    def finish_job(self, row: int, *, loop):
+        self._busy_rows.discard(row)
+        self._task_rows.pop(current_task(loop=loop), None)
+
+    def job_row(self, *, loop) -> int:
+        return self._task_rows.get(current_task(loop=loop), 0)
+
+    def save(self):
+        rows = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': 0, 'args': {'name': 'donkey'}}]
+        rows += [
+            {'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': row, 'args': {'name': 'job {}'.format(row)}}
+            for row in range(1, self._row_count + 1)
+        ]
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': rows + self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+def current_task(*, loop):
+    # asyncio isn't imported by everything which records traces
+    import asyncio
+    return (getattr(asyncio, 'current_task', None) or asyncio.Task.current_task)(loop=loop)
+
+
+def start_trace(path: str):
+    global _tracer
+    _tracer = Tracer(path)
+
+
+def stop_trace():
+    """
+    Save the trace if tracing was started.
+    """
+    global _tracer
+    if _tracer:
+        _tracer.save()
+        _tracer = None
+
+
+def get_tracer():
+    return _tracer
+
+
+@contextmanager
+def span(name: str, cat: str='donkey', **args):
+    """
+    Record the time taken by the code in this context, does nothing unless tracing is enabled.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.complete(name, cat, start, args=args)
+
+
+@contextmanager
+def job_span(name: str, *, loop):
+    """
+    Record a job on its own row, processes run by the job from the same task are recorded on that row too,
+    see record_process.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    start = time.perf_counter()
+    row = tracer.start_job(loop=loop)
+    try:
+        yield
+    finally:
+        tracer.finish_job(row, loop=loop)
+        tracer.complete(name, 'job', start, row=row)
+
+
+def record_process(line: str, start: float, first_output: float=None, *, return_code, loop, cat='process'):
+    """
+    Record a process or line of a session which started at "start" and has just finished, along with the time until
+    its first output if known.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return
+    row = tracer.job_row(loop=loop)
+    tracer.complete(line, cat, start, row=row, args={'return code': str(return_code)})
+    if first_output:
+        tracer.complete('waiting for output', 'startup', start, first_output, row=row)
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import sys
+from collections import OrderedDict, namedtuple
+from typing import List, Optional
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # not available on windows
+    resource = None
+
+logger = logging.getLogger('asyncio')
+
+# ru_maxrss is in kilobytes except on macOS
+MAX_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+# RusageChildWatcher extends SafeChildWatcher which is deprecated from 3.12 and removed in 3.14, on later versions
+# processes are reaped by asyncio's own watcher and usage isn't known
+CAN_WAIT4 = hasattr(os, 'wait4') and sys.version_info < (3, 12)
+# usage of processes which nobody pops is dropped once there are more than this many
+MAX_USAGE = 1000
+
+Usage = namedtuple('Usage', [
+    'user',  # CPU seconds in user mode
+    'system',  # CPU seconds in kernel mode
+    'max_rss',  # peak resident memory in bytes
+    'read_blocks',
+    'write_blocks',
+    'voluntary_switches',  # context switches while waiting, eg. for IO
+    'involuntary_switches',  # context switches when preempted, eg. as too many processes are competing for CPU
+])
+
+
+def from_rusage(ru) -> Usage:
+    return Usage(
+        ru.ru_utime,
+        ru.ru_stime,
+        ru.ru_maxrss * MAX_RSS_UNIT,
+        ru.ru_inblock,
+        ru.ru_oublock,
+        ru.ru_nvcsw,
+        ru.ru_nivcsw,
+    )
+
+
+def combine(usages: List[Usage]) -> Optional[Usage]:
+    """
+    Total usage of processes, except max_rss which is the largest since they may not have run at the same time.
+    """
+    if not usages:
+        return None
+    return Usage(*(
+        max(values) if field == 'max_rss' else sum(values) for field, values in zip(Usage._fields, zip(*usages))
+    ))
+
+
+def _returncode(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    elif os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    return status  # pragma: no cover
+
+
+if CAN_WAIT4:
+    class RusageChildWatcher(asyncio.SafeChildWatcher):
+        """
+        Child watcher which reaps processes with os.wait4 rather than os.waitpid, so the resources used by each
+        process and any descendants it waited for are known once it exits, see pop_usage.
+        """
+        def __init__(self):
+            super().__init__()
+            # pid > Usage, oldest first
+            self.usage = OrderedDict()
+
+        def remove_child_handler(self, pid):
+            self.usage.pop(pid, None)
+            return super().remove_child_handler(pid)
+
+        def close(self):
+            self.usage.clear()
+            super().close()
+
+        def _do_waitpid(self, expected_pid):
+            try:
+                pid, status, rusage = os.wait4(expected_pid, os.WNOHANG)
+            except ChildProcessError:
+                # already reaped, same as SafeChildWatcher
+                pid = expected_pid
+                returncode = 255
+                logger.warning('Unknown child process pid %d, will report returncode 255', pid)
+            else:
+                if pid == 0:
+                    # still running
+                    return
+                returncode = _returncode(status)
+                self.usage[pid] = from_rusage(rusage)
+                while len(self.usage) > MAX_USAGE:
+                    self.usage.popitem(last=False)
+
+            try:
+                callback, args = self._callbacks.pop(pid)
+            except KeyError:  # pragma: no cover
+                self.usage.pop(pid, None)
+            else:
+                callback(pid, returncode, *args)
+
+
+_watcher = None
+
+
+def install_watcher():
+    """
+    Use RusageChildWatcher for subprocesses of event loops set after this is called, the same watcher is attached to
+    each loop as it's set.
+    """
+    global _watcher
+    if CAN_WAIT4 and _watcher is None:
+        _watcher = RusageChildWatcher()
+        asyncio.get_event_loop_policy().set_child_watcher(_watcher)
+
+
+def pop_usage(pid: int) -> Optional[Usage]:
+    """
+    Get the usage of a process which has exited, None if it's not known.
+    """
+    if _watcher is not None:
+        return _watcher.usage.pop(pid, None)
+
+
+def children_usage() -> Optional[Usage]:
+    """
+    Total usage of this process's children which have exited and been waited for, used to get the usage of a whole
+    run when that of each process isn't known, see usage_between.
+    """
+    if resource:
+        return from_rusage(resource.getrusage(resource.RUSAGE_CHILDREN))
+
+
+def usage_between(before: Usage, after: Usage) -> Usage:
+    """
+    Usage of children which exited between two calls to children_usage, max_rss is that of the largest child so far
+    since it's not a total.
+    """
+    return Usage(*(
+        a if field == 'max_rss' else a - b for field, b, a in zip(Usage._fields, before, after)
+    ))
+
+
+def format_usage(usage: Usage, time_taken: float) -> str:
+    cpu = usage.user + usage.system
+    return (
+        'cpu {:0.2f}s ({:0.0f}%), user {:0.2f}s, system {:0.2f}s, max rss {:0.1f}MB, '
+        'blocks read {}, written {}, context switches {} voluntary, {} involuntary'
+    ).format(
+        cpu,
+        cpu / time_taken * 100 if time_taken else 0,
+        usage.user,
+        usage.system,
+        usage.max_rss / 2 ** 20,
+        usage.read_blocks,
+        usage.write_blocks,
+        usage.voluntary_switches,
+        usage.involuntary_switches,
+    )
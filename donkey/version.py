@@ -1,5 +1,4 @@
-from distutils.version import StrictVersion
-
 __all__ = ['VERSION']
 
-VERSION = StrictVersion('0.0.4')
+# plain string rather than distutils' StrictVersion which is slow to import
+VERSION = '0.0.4'
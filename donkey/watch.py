@@ -0,0 +1,154 @@
+import asyncio
+import glob
+import logging
+import os
+import threading
+import time
+from fnmatch import fnmatch
+from typing import List, Set
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+main_logger = logging.getLogger('donkey.main')
+
+
+def split_pattern(pattern: str):
+    """
+    Split a path or glob into the directory to watch, whether the directory must be watched recursively and an
+    absolute pattern to match changed paths against.
+
+    If the directory doesn't exist the closest parent which does is watched recursively, so paths are noticed if
+    they're created later.
+    """
+    pattern = os.path.abspath(pattern)
+    if not glob.has_magic(pattern):
+        if os.path.isdir(pattern):
+            return pattern, True, os.path.join(pattern, '*')
+        base, recursive = os.path.dirname(pattern), False
+    else:
+        parts = pattern.split(os.sep)
+        base_parts = []
+        for part in parts:
+            if glob.has_magic(part):
+                break
+            base_parts.append(part)
+        base = os.sep.join(base_parts) or os.sep
+        recursive = '**' in pattern or len(parts) - len(base_parts) > 1
+
+    while not os.path.isdir(base):
+        base, recursive = os.path.dirname(base), True
+    return base, recursive, pattern
+
+
+class ChangeHandler(FileSystemEventHandler):
+    def __init__(self, watcher: 'Watcher'):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.is_directory and event.event_type == 'modified':
+            # a directory is modified whenever a file in it changes
+            return
+        self.watcher.path_changed(event.src_path)
+        dest_path = getattr(event, 'dest_path', None)
+        if dest_path:
+            self.watcher.path_changed(dest_path)
+
+
+class Watcher:
+    """
+    Watch paths and globs for changes, changes are debounced so a burst of changes, eg. from "git checkout", results
+    in one set of changes.
+
+    Ignore patterns are matched against each part of a changed path and are applied in watchdog's thread so changes in
+    busy directories cost as little as possible.
+    """
+    def __init__(self, patterns: List[str], *, loop, ignore: List[str], ignore_paths: List[str], debounce: float):
+        self.loop = loop
+        self.ignore = ignore
+        self.ignore_paths = [os.path.abspath(p) for p in ignore_paths]
+        self.debounce = debounce
+        self.patterns = [split_pattern(p) for p in patterns]
+        self._lock = threading.Lock()
+        self._changes = set()
+        self._last_change = 0
+        self._changed = asyncio.Event(loop=loop)
+        self._observer = None
+
+    def start(self):
+        self._observer = Observer()
+        handler = ChangeHandler(self)
+        # avoid watching the same directory twice
+        watches = {}
+        for path, recursive, _ in self.patterns:
+            watches[path] = watches.get(path, False) or recursive
+        for path, recursive in watches.items():
+            self._observer.schedule(handler, path, recursive=recursive)
+        self._observer.start()
+
+    def stop(self):
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+    def is_relevant(self, path: str) -> bool:
+        if any(fnmatch(part, pattern) for part in path.split(os.sep) for pattern in self.ignore):
+            return False
+        if any(fnmatch(path, pattern) for pattern in self.ignore_paths):
+            return False
+        return any(fnmatch(path, pattern) for _, _, pattern in self.patterns)
+
+    def path_changed(self, path: str):
+        """
+        Called from watchdog's thread, the event loop is only woken by the first change of each set.
+        """
+        if not self.is_relevant(path):
+            return
+        with self._lock:
+            first = not self._changes
+            self._changes.add(path)
+            self._last_change = time.monotonic()
+        if first:
+            self.loop.call_soon_threadsafe(self._changed.set)
+
+    async def wait(self) -> Set[str]:
+        """
+        Wait for changes, returns once no further changes have happened for "debounce" seconds.
+        """
+        await self._changed.wait()
+        while True:
+            with self._lock:
+                remaining = self._last_change + self.debounce - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining, loop=self.loop)
+        with self._lock:
+            changes, self._changes = self._changes, set()
+            self._changed.clear()
+        return changes
+
+
+async def watch(start_run, watcher: Watcher, *, on_change: str, loop):
+    """
+    Run, then run again whenever files change.
+
+    :param start_run: function which starts a run and returns the task and JobControl for it
+    :param on_change: what to do if changes are detected while commands are running: "cancel" them or "queue"
+      another run for when they've finished
+    """
+    task, job_control = start_run()
+    while True:
+        changes_task = asyncio.ensure_future(watcher.wait(), loop=loop)
+        await asyncio.wait([task, changes_task], loop=loop, return_when=asyncio.FIRST_COMPLETED)
+        if not task.done():
+            if on_change == 'cancel':
+                job_control.cancel('files changed')
+            await asyncio.wait([task], loop=loop)
+        # raise any unexpected error from the run, return codes don't matter here
+        task.result()
+        if not changes_task.done():
+            main_logger.info('watching for changes...')
+        changes = await changes_task
+        main_logger.info('%d file%s changed, running again', len(changes), '' if len(changes) == 1 else 's')
+        task, job_control = start_run()
@@ -38,7 +38,7 @@ setup(
     entry_points="""
         [console_scripts]
         donkey=donkey.cli:cli
-        donk=donkey.cli:cli
+        donk=donkey.client:main
     """,
     install_requires=[
         'click>=6.6',
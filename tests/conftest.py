@@ -8,6 +8,16 @@ import pytest
 from py._path.local import LocalPath
 
 
+@pytest.fixture(autouse=True)
+def donkey_cache_dir(tmpdir_factory, monkeypatch):
+    """
+    Prevent tests using or populating the real per user cache directory.
+    """
+    cache_dir = tmpdir_factory.mktemp('donkey_cache')
+    monkeypatch.setenv('DONKEY_CACHE_DIR', cache_dir.strpath)
+    return cache_dir
+
+
 @pytest.yield_fixture
 def tmpworkdir(tmpdir):
     """
@@ -0,0 +1,303 @@
+import asyncio
+import os
+from pathlib import Path
+
+from donkey.cache import ArtifactStore, BuildState, hash_file
+from donkey.main import execute
+
+from .conftest import mktree
+
+
+def get_key(state, command, sources):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(state.command_key(command, sources, loop=loop))
+    finally:
+        loop.close()
+
+
+def test_hash_file(tmpworkdir):
+    mktree(tmpworkdir, {'a.txt': 'hello'})
+    assert hash_file('a.txt') == '2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824'
+
+
+def test_command_key(tmpworkdir):
+    mktree(tmpworkdir, {'a.txt': 'a', 'b.txt': 'b'})
+    state = BuildState(Path('state'))
+    key1 = get_key(state, {'run': ['echo a']}, ['*.txt'])
+    assert key1 == get_key(state, {'run': ['echo a']}, ['*.txt'])
+    assert key1 != get_key(state, {'run': ['echo b']}, ['*.txt'])
+    assert key1 != get_key(state, {'run': ['echo a']}, ['a.txt'])
+    tmpworkdir.join('b.txt').write('different')
+    assert key1 != get_key(state, {'run': ['echo a']}, ['*.txt'])
+
+
+def test_stat_prefilter(tmpworkdir, mocker):
+    mktree(tmpworkdir, {'a.txt': 'a'})
+    state = BuildState(Path('state'))
+    get_key(state, {}, ['a.txt'])
+    mock_hash_file = mocker.patch('donkey.cache.hash_file')
+    get_key(state, {}, ['a.txt'])
+    assert mock_hash_file.call_count == 0
+
+
+def test_save_load(tmpworkdir):
+    mktree(tmpworkdir, {'a.txt': 'a'})
+    state = BuildState(Path('.donkey/state'))
+    key = get_key(state, {}, ['a.txt'])
+    assert not state.is_fresh(key)
+    state.record_success(key)
+    state.save()
+
+    state2 = BuildState(Path('.donkey/state'))
+    assert state2.is_fresh(key)
+    assert list(state2.files) == [os.path.abspath('a.txt')]
+
+
+def test_corrupt_state(tmpworkdir):
+    mktree(tmpworkdir, {'state': '{"version": 1, "fil'})
+    state = BuildState(Path('state'))
+    assert state.runs == {}
+    state.record_success('foo')
+    state.save()
+    assert BuildState(Path('state')).is_fresh('foo')
+
+
+def test_lru_eviction(tmpworkdir, mocker):
+    mocker.patch('time.time', return_value=1.5)
+    # each run is saved as '"x":1.5,', 8 bytes, runs may take up to half of max_size
+    state = BuildState(Path('state'), max_size=70)
+    for key in 'abcd':
+        state.record_success(key)
+    assert state.is_fresh('a')
+    state.record_success('e')
+    state.save()
+    assert list(BuildState(Path('state')).runs) == ['c', 'd', 'a', 'e']
+    assert os.path.getsize('state') <= 70
+
+
+def test_size_eviction(tmpworkdir):
+    mktree(tmpworkdir, {'src': {'{}.txt'.format(i): str(i) for i in range(100)}})
+    state = BuildState(Path('state'), max_size=4000)
+    for i in range(100):
+        get_key(state, {'run': ['echo {}'.format(i)]}, ['src/{}.txt'.format(i)])
+        state.record_success(str(i) * 20)
+    state.save()
+    assert os.path.getsize('state') <= 4000
+    state = BuildState(Path('state'))
+    # the most recently used entries are kept
+    assert str(99) * 20 in state.runs
+    assert os.path.abspath('src/99.txt') in state.files
+    assert os.path.abspath('src/0.txt') not in state.files
+    assert 0 < len(state.files) < 100
+    assert 0 < len(state.runs) < 100
+
+
+def test_execute_hash(tmpworkdir, caplog):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+lint:
+  freshness: hash
+  sources:
+  - src/*.txt
+  run:
+  - echo linted >> log.txt
+""",
+        'src': {
+            'a.txt': 'a',
+        },
+    })
+    execute('lint')
+    assert tmpworkdir.join('log.txt').read_text('utf8') == 'linted\n'
+    assert tmpworkdir.join('.donkey/state').exists()
+
+    # modification time changes but content doesn't
+    os.utime(tmpworkdir.join('src/a.txt').strpath, (2e9, 2e9))
+    execute('lint')
+    assert tmpworkdir.join('log.txt').read_text('utf8') == 'linted\n'
+    assert 'donkey.main: "lint" up to date' in caplog
+
+    tmpworkdir.join('src/a.txt').write('changed')
+    execute('lint')
+    assert tmpworkdir.join('log.txt').read_text('utf8') == 'linted\nlinted\n'
+
+
+def test_execute_hash_missing_target(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+.config:
+  freshness: hash
+build:
+  sources:
+  - a.txt
+  targets:
+  - out.txt
+  run:
+  - cp a.txt out.txt
+  - echo built >> log.txt
+""",
+        'a.txt': 'a',
+    })
+    execute('build')
+    execute('build')
+    assert tmpworkdir.join('log.txt').read_text('utf8') == 'built\n'
+    tmpworkdir.join('out.txt').remove()
+    execute('build')
+    assert tmpworkdir.join('log.txt').read_text('utf8') == 'built\nbuilt\n'
+
+
+def test_artifacts_store_restore(tmpworkdir):
+    mktree(tmpworkdir, {
+        'checkout1': {
+            'out': {
+                'bundle.js': 'js',
+                'bundle.css': 'css',
+            },
+        },
+        'checkout2': {},
+    })
+    store = ArtifactStore(Path(tmpworkdir.join('store').strpath), max_size=1000)
+    os.chdir('checkout1')
+    store.store('abc', ['out/*'])
+    assert not store.restore('different')
+
+    os.chdir('../checkout2')
+    assert store.restore('abc')
+    assert tmpworkdir.join('checkout2/out/bundle.js').read_text('utf8') == 'js'
+    assert tmpworkdir.join('checkout2/out/bundle.css').read_text('utf8') == 'css'
+    assert os.stat('out/bundle.js').st_nlink == 1
+
+
+def test_artifacts_link(tmpworkdir):
+    mktree(tmpworkdir, {'out.txt': 'out'})
+    store = ArtifactStore(Path('store'), max_size=1000, link=True)
+    store.store('abc', ['out.txt'])
+    tmpworkdir.join('out.txt').remove()
+    assert store.restore('abc')
+    assert tmpworkdir.join('out.txt').read_text('utf8') == 'out'
+    assert os.stat('out.txt').st_nlink == 2
+
+
+def test_artifacts_missing_object(tmpworkdir):
+    mktree(tmpworkdir, {'a.txt': 'a', 'b.txt': 'b'})
+    store = ArtifactStore(Path('store'), max_size=1000)
+    store.store('abc', ['*.txt'])
+    tmpworkdir.join('a.txt').remove()
+    store._object_path(hash_file('b.txt')).unlink()
+    assert not store.restore('abc')
+    assert not tmpworkdir.join('a.txt').exists()
+
+
+def test_artifacts_evict(tmpworkdir):
+    mktree(tmpworkdir, {'a.txt': 'a' * 40, 'b.txt': 'b' * 40, 'c.txt': 'c' * 40})
+    store = ArtifactStore(Path('store'), max_size=100)
+    store.store('a', ['a.txt'])
+    store.store('b', ['b.txt'])
+    os.utime('store/manifests/a.json', (1, 1))
+    os.utime('store/manifests/b.json', (2, 2))
+    store.store('c', ['c.txt'])
+    assert sorted(p.name for p in Path('store/manifests').iterdir()) == ['b.json', 'c.json']
+    assert not store._object_path(hash_file('a.txt')).exists()
+    assert store._object_path(hash_file('b.txt')).exists()
+
+
+def test_artifacts_size_total(tmpworkdir, mocker):
+    mktree(tmpworkdir, {'a.txt': 'a' * 40, 'b.txt': 'b' * 40})
+    store = ArtifactStore(Path('store'), max_size=1000)
+    store.store('a', ['a.txt'])
+    assert tmpworkdir.join('store/size').read_text('utf8') == '40'
+    # under max_size the store isn't scanned
+    objects = mocker.spy(store, '_objects')
+    store.store('b', ['b.txt'])
+    store.store('b2', ['b.txt'])
+    assert objects.call_count == 0
+    assert tmpworkdir.join('store/size').read_text('utf8') == '80'
+
+
+def test_artifacts_evict_concurrent(tmpworkdir):
+    mktree(tmpworkdir, {'a.txt': 'a' * 40})
+    store = ArtifactStore(Path('store'), max_size=0)
+    store.store('a', ['a.txt'])
+    store.store('a', ['a.txt'])
+    tmpworkdir.join('store/manifests/gone.json').write('{"files": {"x": {"digest": "gone"}}}')
+    # files already deleted by another process
+    store._evict({'gone': 10, 'also_gone': 20})
+    assert not tmpworkdir.join('store/manifests/gone.json').exists()
+
+
+def test_artifacts_no_targets(tmpworkdir):
+    store = ArtifactStore(Path('store'), max_size=1000)
+    store.store('abc', ['missing/*'])
+    assert not tmpworkdir.join('store/manifests/abc.json').exists()
+    assert not store.restore('abc')
+    tmpworkdir.join('store/manifests/abc.json').write('{"files": {}}', ensure=True)
+    assert not store.restore('abc')
+
+
+def test_execute_artifacts(tmpworkdir, caplog):
+    definition = """
+.config:
+  artifacts:
+    path: ../store
+    max_size: 1MB
+build:
+  sources:
+  - src/*.txt
+  targets:
+  - out.txt
+  run:
+  - cat src/*.txt > out.txt
+  - echo built >> log.txt
+"""
+    mktree(tmpworkdir, {
+        'checkout1': {
+            'makefile.yml': definition,
+            'src': {'a.txt': 'a'},
+        },
+        'checkout2': {
+            'makefile.yml': definition,
+            'src': {'a.txt': 'a'},
+        },
+    })
+    os.chdir('checkout1')
+    execute('build')
+    assert tmpworkdir.join('checkout1/log.txt').read_text('utf8') == 'built\n'
+
+    os.chdir('../checkout2')
+    execute('build')
+    assert tmpworkdir.join('checkout2/out.txt').read_text('utf8') == 'a'
+    assert not tmpworkdir.join('checkout2/log.txt').exists()
+    assert 'donkey.main: "build" targets restored from artifact cache' in caplog
+
+    tmpworkdir.join('checkout2/src/a.txt').write('changed')
+    execute('build')
+    assert tmpworkdir.join('checkout2/out.txt').read_text('utf8') == 'changed'
+    assert tmpworkdir.join('checkout2/log.txt').read_text('utf8') == 'built\n'
+
+
+def test_execute_artifacts_no_sources(tmpworkdir, caplog):
+    definition = """
+.config:
+  artifacts:
+    path: ../store
+    max_size: 1MB
+build:
+  targets:
+  - out.txt
+  run:
+  - cat input.txt > out.txt
+"""
+    mktree(tmpworkdir, {
+        'checkout1': {'makefile.yml': definition, 'input.txt': 'v1'},
+        'checkout2': {'makefile.yml': definition, 'input.txt': 'v2'},
+    })
+    os.chdir('checkout1')
+    execute('build')
+    assert tmpworkdir.join('checkout1/out.txt').read_text('utf8') == 'v1'
+
+    os.chdir('../checkout2')
+    execute('build')
+    assert tmpworkdir.join('checkout2/out.txt').read_text('utf8') == 'v2'
+    assert 'restored from artifact cache' not in caplog
+    assert 'donkey.main: "build" has no sources so its targets can\'t be cached' in caplog
+    assert not tmpworkdir.join('store/manifests').exists()
@@ -0,0 +1,111 @@
+from pathlib import Path
+
+import pytest
+
+from donkey.capture import MAX_LINE, OutputCapture, capture_path
+from donkey.exceptions import DonkeyFailure
+from donkey.main import execute
+
+from .conftest import mktree
+
+
+def test_tail():
+    capture = OutputCapture(None, tail_lines=3)
+    capture.feed(1, b'1\n2\n3')
+    capture.feed(2, b'error\n')
+    capture.feed(1, b'3\n4\n5\n6')
+    assert capture.tail() == ['4', '5', '6']
+    capture.feed(1, b'\n')
+    assert capture.tail() == ['4', '5', '6']
+
+
+def test_tail_bounded():
+    capture = OutputCapture(None, tail_lines=10)
+    chunk = b'x' * 10000 + b'\n' + b'y' * 10000
+    for _ in range(1000):
+        capture.feed(1, chunk)
+    assert len(capture.lines) == 10
+    assert all(len(line) == MAX_LINE for line in capture.lines)
+    assert len(capture._partial[1]) == MAX_LINE
+
+
+def test_no_tail():
+    capture = OutputCapture(None, tail_lines=0)
+    capture.feed(1, b'1\n2\n')
+    assert capture.tail() == []
+    with pytest.raises(RuntimeError):
+        with capture.view():
+            pass
+
+
+def test_capture_path():
+    d = Path('output')
+    assert capture_path(d, 'foo') == Path('output/foo.log')
+    path = capture_path(d, 'foo: echo "bar"')
+    assert path.name.startswith('foo_echo_bar-')
+    # names which differ only in characters which aren't safe in file names get different files
+    assert capture_path(d, 'echo a;b') != capture_path(d, 'echo a b')
+    long = capture_path(d, 'foo: ' + 'x' * 1000)
+    assert len(long.name) < 100
+    assert long != capture_path(d, 'foo: ' + 'x' * 999)
+
+
+def test_save(tmpdir):
+    path = capture_path(Path(tmpdir.strpath), 'foo')
+    capture = OutputCapture(path, tail_lines=2)
+    with capture.view() as m:
+        assert m[:] == b''
+    assert capture.tail() == []
+    capture.feed(1, b'hello\n')
+    capture.feed(2, b'world\n')
+    with capture.view() as m:
+        assert m.find(b'world') == 6
+    capture.feed(1, b'\nlast ' + b'x' * 10000)
+    capture.close()
+    assert path.read_bytes().startswith(b'hello\nworld\n\nlast x')
+    # the tail is read from the saved output
+    assert capture.tail() == ['', 'last ' + 'x' * (MAX_LINE - 5)]
+    assert not capture.lines
+
+
+def test_failure_tail(tmpworkdir, caplog):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+.config:
+  output:
+    failure_tail: 2
+    save: true
+foo:
+- seq 1000
+- echo failed >&2; exit 3
+bar:
+- echo ok
+"""})
+    with pytest.raises(DonkeyFailure):
+        execute('foo')
+    assert 'last 2 lines of output from "foo":\n1000\nfailed\n' in caplog.log
+    assert 'full output of "foo" saved to' in caplog.log
+    assert tmpworkdir.join('.donkey/output/foo.log').read_text('utf8').endswith('999\n1000\nfailed\n')
+
+    caplog.stream.truncate(0)
+    execute('bar')
+    assert 'last' not in caplog.log
+    assert tmpworkdir.join('.donkey/output/bar.log').read_text('utf8') == 'ok\n'
+
+
+def test_save_parallel(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+.config:
+  output:
+    save: true
+foo:
+  parallel: true
+  run:
+  - echo a;echo b
+  - echo a b
+  - echo {}
+""".format('x' * 300)})
+    execute('foo', jobs=3)
+    outputs = sorted(p.read_text('utf8') for p in tmpworkdir.join('.donkey/output').listdir())
+    assert outputs == ['a\nb\n', 'a b\n', 'x' * 300 + '\n']
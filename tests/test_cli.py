@@ -115,3 +115,27 @@ print-dots:
     assert """\
 TI:XX:ME 1: .....
 "print-dots" finished in 0.XXs, return codes: 0\n""" == normalise_log(result.output, True)
+
+
+def test_timeout(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+slow:
+- echo start; sleep 2; echo finished
+"""})
+    runner = CliRunner()
+    result = runner.invoke(cli, ['slow', '--timeout', '0.1'])
+    assert result.exit_code == 124
+    assert """\
+TI:XX:ME 1: start
+"slow" timed out after 0.1s, stopping "echo start; sleep 2; echo finished"
+"slow" finished in 0.XXs, return codes: 124
+Error: commands failed, return codes: 124\n""" == normalise_log(result.output, True)
+
+
+def test_timeout_invalid(tmpworkdir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    for value in ('0', '-1'):
+        result = CliRunner().invoke(cli, ['foo', '--timeout', value])
+        assert result.exit_code == 2
+        assert 'Invalid value for "-t" / "--timeout": must be greater than 0' in result.output
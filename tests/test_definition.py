@@ -0,0 +1,177 @@
+import os
+from pathlib import Path
+
+import pytest
+
+import donkey.definition
+from donkey.definition import find_def_file, load_definition
+from donkey.exceptions import DonkeyError
+
+from .conftest import mktree
+
+
+def test_load(tmpworkdir):
+    mktree(tmpworkdir, {'makefile.yml': """
+foo:
+- echo foo
+bar:
+  requires:
+  - foo
+spam:
+  run: 42
+.default: foo
+.settings:
+  a: b
+"""})
+    definition = load_definition()
+    assert definition.path.name == 'makefile.yml'
+    assert definition.default == 'foo'
+    assert definition.settings == {'a': 'b'}
+    # only defaults
+    assert set(definition.config) == {'watcher', 'output', 'logging', 'history'}
+    assert definition.command_names == ['foo', 'bar', 'spam']
+    commands = definition.get_commands(['bar'])
+    assert sorted(commands) == ['bar', 'foo']
+    assert commands['foo']['run'] == ['echo foo']
+    with pytest.raises(DonkeyError):
+        definition.get_commands(['spam'])
+    with pytest.raises(DonkeyError):
+        definition.get_commands(['.settings'])
+
+
+def test_cached(tmpworkdir, mocker):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    os.utime('makefile.yml', (1e9, 1e9))
+    definition = load_definition()
+    assert definition.get_commands(['foo'])['foo']['run'] == ['echo foo']
+
+    mock_yaml_load = mocker.patch('donkey.schema.yaml.load')
+    mock_validate = mocker.patch('donkey.schema._validate')
+    definition2 = load_definition()
+    assert definition2.get_commands(['foo'])['foo']['run'] == ['echo foo']
+    assert mock_yaml_load.call_count == 0
+    assert mock_validate.call_count == 0
+    assert definition2.path == definition.path
+
+
+def test_cache_file_changed(tmpworkdir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    assert load_definition().get_commands(['foo'])['foo']['run'] == ['echo foo']
+    tmpworkdir.join('makefile.yml').write('foo:\n- echo changed\n')
+    os.utime('makefile.yml', (2e9, 2e9))
+    assert load_definition().get_commands(['foo'])['foo']['run'] == ['echo changed']
+
+
+def test_cache_version_changed(tmpworkdir, mocker):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    load_definition()
+    mocker.patch('donkey.definition.VERSION', '100.0.0')
+    mock_yaml_load = mocker.patch('donkey.schema.yaml.load', return_value={})
+    assert load_definition().command_names == []
+    assert mock_yaml_load.call_count == 1
+
+
+def test_cache_format_changed(tmpworkdir, mocker):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    os.utime('makefile.yml', (1e9, 1e9))
+    load_definition()
+    mocker.patch('donkey.definition.CACHE_FORMAT', donkey.definition.CACHE_FORMAT + 1)
+    mock_yaml_load = mocker.patch('donkey.schema.yaml.load', return_value={})
+    assert load_definition().command_names == []
+    assert mock_yaml_load.call_count == 1
+
+
+def test_cache_recently_modified(tmpworkdir, donkey_cache_dir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    assert load_definition().get_commands(['foo'])['foo']['run'] == ['echo foo']
+    assert not donkey_cache_dir.join('definitions').exists()
+    # same size and mtime, only noticed as the first load wasn't cached
+    mtime = os.stat('makefile.yml').st_mtime_ns
+    tmpworkdir.join('makefile.yml').write('foo:\n- echo bar\n')
+    os.utime('makefile.yml', ns=(mtime, mtime))
+    assert load_definition().get_commands(['foo'])['foo']['run'] == ['echo bar']
+
+
+def test_cache_corrupt(tmpworkdir, donkey_cache_dir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    os.utime('makefile.yml', (1e9, 1e9))
+    load_definition()
+    cache_files = donkey_cache_dir.join('definitions').listdir()
+    assert len(cache_files) == 1
+    cache_files[0].write('not a pickle')
+    assert load_definition().get_commands(['foo'])['foo']['run'] == ['echo foo']
+
+
+def test_cache_unwritable(tmpworkdir, donkey_cache_dir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    donkey_cache_dir.join('definitions').write('not a directory')
+    assert load_definition().get_commands(['foo'])['foo']['run'] == ['echo foo']
+
+
+def test_invalid_yaml(tmpworkdir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo: [\n'})
+    with pytest.raises(DonkeyError):
+        load_definition()
+
+
+def test_not_mapping(tmpworkdir):
+    mktree(tmpworkdir, {'makefile.yml': '- foo\n'})
+    with pytest.raises(DonkeyError):
+        load_definition()
+
+
+def set_old_mtimes(*paths):
+    for p in paths:
+        os.utime(str(p), (1e9, 1e9))
+
+
+def test_find_def_file(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': 'x',
+        'a': {
+            'makefile.yaml': 'x',
+            'donkey.yml': 'x',
+            'b': {
+                'c': {},
+            },
+        },
+    })
+    assert find_def_file(Path(tmpworkdir.strpath)).name == 'makefile.yml'
+    assert find_def_file(Path(tmpworkdir.join('a/b/c').strpath)) == Path(tmpworkdir.join('a/donkey.yml').strpath)
+
+
+def test_find_def_file_cached(tmpworkdir, mocker):
+    mktree(tmpworkdir, {
+        'makefile.yml': 'x',
+        'a': {
+            'b': {},
+        },
+    })
+    start = Path(tmpworkdir.join('a/b').strpath)
+    set_old_mtimes(start, start.parent, start.parent.parent)
+    assert find_def_file(start).name == 'makefile.yml'
+
+    mock_search = mocker.spy(donkey.definition, '_search_def_file')
+    assert find_def_file(start) == Path(tmpworkdir.join('makefile.yml').strpath)
+    assert mock_search.call_count == 0
+
+    # a closer definition file modifies "a"'s mtime so the cached result is ignored
+    tmpworkdir.join('a/donkey.yml').write('x')
+    assert find_def_file(start) == Path(tmpworkdir.join('a/donkey.yml').strpath)
+    assert mock_search.call_count == 1
+
+
+def test_find_def_file_recently_modified(tmpworkdir, mocker):
+    mktree(tmpworkdir, {'makefile.yml': 'x'})
+    find_def_file(Path(tmpworkdir.strpath))
+    mock_search = mocker.spy(donkey.definition, '_search_def_file')
+    find_def_file(Path(tmpworkdir.strpath))
+    assert mock_search.call_count == 1
+
+
+def test_definition_file_env(tmpworkdir, monkeypatch, mocker):
+    mktree(tmpworkdir, {'different.yml': 'foo:\n- echo foo\n'})
+    monkeypatch.setenv('DONKEY_DEFINITION_FILE', 'different.yml')
+    mock_find = mocker.patch('donkey.definition.find_def_file')
+    assert load_definition().path.name == 'different.yml'
+    assert mock_find.call_count == 0
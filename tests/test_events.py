@@ -0,0 +1,127 @@
+import json
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from donkey.cli import cli
+from donkey.events import EventWriter
+from donkey.exceptions import DonkeyFailure
+from donkey.main import execute
+
+from .conftest import mktree
+
+
+def read_events(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.fixture
+def events_fd(tmpworkdir):
+    fd = os.open('events.jsonl', os.O_WRONLY | os.O_CREAT)
+    yield fd
+    os.close(fd)
+
+
+def test_events(tmpworkdir, events_fd):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+- echo foo
+bar:
+  requires: [foo]
+  run:
+  - exit 3
+"""})
+    with pytest.raises(DonkeyFailure):
+        execute('bar', events=EventWriter(events_fd))
+    events = read_events('events.jsonl')
+    assert [e['event'] for e in events] == [
+        'run_started', 'command_started', 'command_finished', 'command_started', 'command_finished', 'run_finished'
+    ]
+    assert all(isinstance(e['time'], float) for e in events)
+    assert events[0]['commands'] == ['bar']
+    assert events[0]['jobs'] == ['foo', 'bar']
+    assert events[1] == {'event': 'command_started', 'time': events[1]['time'], 'command': 'foo',
+                         'lines': ['echo foo']}
+    assert events[2]['return_code'] == 0
+    assert events[2]['duration'] > 0
+    assert events[4]['command'] == 'bar'
+    assert events[4]['return_codes'] == [3]
+    assert events[4]['cancelled'] is False
+    summary = events[-1]
+    assert summary['success'] is False
+    assert summary['finished'] == ['foo', 'bar']
+    assert summary['failed'] == ['bar']
+    assert summary['cancelled'] == []
+
+
+def test_output_events(tmpworkdir, events_fd, capsys):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+- echo foo; echo bar >&2; printf "no new"; printf "line"
+"""})
+    execute('foo', events=EventWriter(events_fd, output_lines=True))
+    output = [(e['fd'], e['line']) for e in read_events('events.jsonl') if e['event'] == 'output']
+    assert sorted(output) == [(1, 'foo'), (1, 'no newline'), (2, 'bar')]
+    out, err = capsys.readouterr()
+    assert '1: foo' not in out + err
+
+
+def test_skipped_events(tmpworkdir, events_fd):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+  run:
+  - touch foo.txt
+  targets: [foo.txt]
+bar:
+  requires: [baz]
+  run:
+  - echo bar
+baz:
+- exit 1
+"""})
+    execute('foo', events=EventWriter(events_fd))
+    execute('foo', events=EventWriter(events_fd))
+    with pytest.raises(DonkeyFailure):
+        execute('bar', parallel=True, events=EventWriter(events_fd))
+    skipped = [e for e in read_events('events.jsonl') if e['event'] == 'command_skipped']
+    assert [(e['command'], e['reason']) for e in skipped] == [
+        ('foo', 'up to date'),
+        ('bar', 'cancelled since "baz" failed'),
+    ]
+
+
+def test_events_cli(tmpworkdir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    fd = os.open('events.jsonl', os.O_WRONLY | os.O_CREAT)
+    try:
+        result = CliRunner().invoke(cli, ['foo', '--format', 'json', '--events-fd', str(fd)])
+    finally:
+        os.close(fd)
+    assert result.exit_code == 0, result.output
+    events = read_events('events.jsonl')
+    assert [e['event'] for e in events] == ['run_started', 'command_started', 'command_finished', 'run_finished']
+    assert events[-1]['success'] is True
+
+
+def test_events_fd_closed(tmpworkdir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo > foo.txt\n'})
+    fd = os.open('events.jsonl', os.O_WRONLY | os.O_CREAT)
+    os.close(fd)
+    result = CliRunner().invoke(cli, ['foo', '--format', 'json', '--events-fd', str(fd)])
+    assert result.exit_code == 2
+    assert 'Invalid value for "--events-fd": {} is not an open file descriptor'.format(fd) in result.output
+    assert not tmpworkdir.join('foo.txt').exists()
+
+
+def test_events_fd_closed_text(tmpworkdir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo > foo.txt\n'})
+    fd = os.open('events.jsonl', os.O_WRONLY | os.O_CREAT)
+    os.close(fd)
+    result = CliRunner().invoke(cli, ['foo', '--events-fd', str(fd)])
+    assert result.exit_code == 0, result.output
+    assert tmpworkdir.join('foo.txt').exists()
@@ -0,0 +1,58 @@
+import os
+
+from donkey.files import expand_globs, up_to_date
+
+from .conftest import mktree
+
+
+def set_mtime(lp, mtime):
+    os.utime(lp.strpath, (mtime, mtime))
+
+
+def test_expand_globs(tmpworkdir):
+    mktree(tmpworkdir, {
+        'a.txt': 'a',
+        'b.py': 'b',
+        'sub': {
+            'c.txt': 'c',
+            'deeper': {
+                'd.txt': 'd',
+            },
+        },
+    })
+    assert expand_globs(['*.txt']) == ['a.txt']
+    assert expand_globs(['**/*.txt', 'b.py']) == ['a.txt', 'b.py', 'sub/c.txt', 'sub/deeper/d.txt']
+    assert expand_globs(['sub']) == []
+
+
+def test_up_to_date(tmpworkdir):
+    mktree(tmpworkdir, {
+        'src': {
+            'a.c': 'a',
+            'b.c': 'b',
+        },
+        'out.o': 'out',
+    })
+    set_mtime(tmpworkdir.join('src/a.c'), 1000)
+    set_mtime(tmpworkdir.join('src/b.c'), 2000)
+    set_mtime(tmpworkdir.join('out.o'), 3000)
+    assert up_to_date(['src/*.c'], ['out.o'])
+    set_mtime(tmpworkdir.join('src/b.c'), 4000)
+    assert not up_to_date(['src/*.c'], ['out.o'])
+
+
+def test_up_to_date_missing_target(tmpworkdir):
+    mktree(tmpworkdir, {
+        'a.c': 'a',
+        'out.o': 'out',
+    })
+    assert up_to_date(['a.c'], ['out.o'])
+    assert not up_to_date(['a.c'], ['out.o', 'missing.o'])
+    assert not up_to_date(['a.c'], [])
+
+
+def test_up_to_date_no_sources(tmpworkdir):
+    mktree(tmpworkdir, {
+        'out.o': 'out',
+    })
+    assert up_to_date([], ['out.o'])
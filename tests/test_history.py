@@ -0,0 +1,147 @@
+import sqlite3
+from collections import namedtuple
+from pathlib import Path
+
+from donkey.history import (History, critical_path_order, format_stats,
+                            percentile)
+from donkey.main import JobResult, execute
+from donkey.usage import Usage
+
+from .conftest import mktree
+
+Ex = namedtuple('Ex', 'name requires')
+
+
+def result(name, duration, return_code=0, usage=None):
+    return JobResult(name, [return_code], duration, usage)
+
+
+def test_percentile():
+    assert percentile([1], 95) == 1
+    assert percentile(list(range(1, 101)), 50) == 50
+    assert percentile(list(range(1, 101)), 95) == 95
+
+
+def test_record(tmpdir):
+    history = History(Path(tmpdir.strpath, '.donkey', 'history.sqlite3'), max_size=2 ** 20)
+    assert history.stats() == []
+    assert history.expected_durations(['foo']) == {}
+    for i in range(20):
+        history.record([result('foo', 1 + i / 10, usage=Usage(0.5, 0.1, 1000, 1, 2, 3, 4)), result('bar', 0.1)])
+    history.record([result('foo', 100, return_code=2)])
+    assert history.expected_durations(['foo', 'bar', 'spam']) == {'foo': 2.4, 'bar': 0.1}
+    stats = {s['name']: s for s in history.stats()}
+    assert stats['foo'] == {
+        'name': 'foo', 'runs': 21, 'failures': 1, 'p50': 1.9, 'p95': 2.8, 'last': 2.9, 'trend': stats['foo']['trend']
+    }
+    # median of last 10 runs compared to the median of the 10 before
+    assert round(stats['foo']['trend'], 3) == round(2.4 / 1.4 - 1, 3)
+    assert stats['bar']['trend'] == 0
+    lines = format_stats(stats.values())
+    assert lines[0].split() == ['command', 'runs', 'failures', 'p50', 'p95', 'last', 'trend']
+    assert lines[1].split() == ['bar', '20', '0', '0.10s', '0.10s', '0.10s', '+0%']
+    assert lines[2].split() == ['foo', '21', '1', '1.90s', '2.80s', '2.90s', '+71%']
+    history.close()
+
+    history = History(Path(tmpdir.strpath, '.donkey', 'history.sqlite3'), max_size=2 ** 20)
+    assert len(history.stats()) == 2
+    history.close()
+
+
+def test_compact(tmpdir):
+    path = Path(tmpdir.strpath, 'history.sqlite3')
+    history = History(path, max_size=50000)
+    for i in range(200):
+        history.record([result('command_{}'.format(j), i) for j in range(20)])
+        assert path.stat().st_size <= 50000
+    stats = history.stats()
+    runs = stats[0]['runs']
+    assert 10 < runs < 200
+    # the newest runs are kept
+    assert stats[0]['last'] == 199
+    history.close()
+
+
+def test_corrupt(tmpdir):
+    path = Path(tmpdir.strpath, 'history.sqlite3')
+    path.write_bytes(b'x' * 1000)
+    history = History(path, max_size=2 ** 20)
+    history.record([result('foo', 1)])
+    assert len(history.stats()) == 1
+    history.close()
+
+
+def test_critical_path_order():
+    executors = [Ex('a', []), Ex('b', []), Ex('c', ['a']), Ex('d', []), Ex('e', [])]
+    # e takes 5s, a then c take 3s, b takes 2s, d has no history so is assumed to take the median
+    durations = {'a': 1, 'b': 2, 'c': 2, 'e': 5}
+    assert [ex.name for ex in critical_path_order(executors, durations)] == ['e', 'a', 'b', 'c', 'd']
+    assert [ex.name for ex in critical_path_order(executors, {})] == ['a', 'b', 'c', 'd', 'e']
+
+
+def test_longest_first(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+fast:
+- echo fast >> order.txt
+slow:
+- echo slow >> order.txt; sleep 0.2
+"""})
+    execute('fast', 'slow', parallel=True, jobs=1)
+    assert tmpworkdir.join('order.txt').read_text('utf8') == 'fast\nslow\n'
+    execute('fast', 'slow', parallel=True, jobs=1)
+    assert tmpworkdir.join('order.txt').read_text('utf8') == 'fast\nslow\nslow\nfast\n'
+
+
+def test_stats(tmpworkdir, caplog):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+- echo foo
+"""})
+    execute('stats')
+    assert 'no history yet' in caplog.log
+    execute('foo')
+    execute('foo')
+    caplog.stream.seek(0)
+    caplog.stream.truncate()
+    execute('stats')
+    lines = caplog.log.strip('\n').split('\n')
+    assert len(lines) == 2
+    assert lines[1].split()[:3] == ['donkey.main:', 'foo', '2']
+
+
+def test_disabled(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+.config:
+  history:
+    enabled: false
+foo:
+- echo foo
+"""})
+    execute('foo')
+    assert not tmpworkdir.join('.donkey').exists()
+
+
+def test_location(tmpworkdir, donkey_cache_dir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    execute('foo')
+    # kept out of the project directory
+    assert not tmpworkdir.join('.donkey').exists()
+    assert len(donkey_cache_dir.join('history').listdir()) == 1
+
+
+def test_unusable(tmpworkdir, monkeypatch, caplog):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n', 'not_a_directory': 'x'})
+    monkeypatch.setenv('DONKEY_CACHE_DIR', tmpworkdir.join('not_a_directory').strpath)
+    execute('foo', parallel=True)
+    assert caplog.log.count('unable to open history') == 1
+    assert '"foo" finished' in caplog.log
+
+
+def test_record_error(tmpworkdir, mocker, caplog):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    mocker.patch('donkey.history.History.record', side_effect=sqlite3.OperationalError('database is locked'))
+    execute('foo')
+    assert 'unable to use history, continuing without it: database is locked' in caplog.log
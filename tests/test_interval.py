@@ -0,0 +1,96 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+from click.testing import CliRunner
+
+import donkey
+from donkey.cli import cli
+from donkey.exceptions import DonkeyError
+from donkey.interval import run_interval
+from donkey.main import execute
+
+from .conftest import mktree
+
+PYTHONPATH = os.path.dirname(os.path.dirname(donkey.__file__))
+
+
+def record_runs(duration, *, run_for, ndigits=1, **kwargs):
+    loop = asyncio.new_event_loop()
+    starts, tasks = [], []
+
+    def start_run():
+        starts.append(loop.time())
+        tasks.append(asyncio.ensure_future(asyncio.sleep(duration, loop=loop), loop=loop))
+        return tasks[-1], None
+
+    with pytest.raises(asyncio.TimeoutError):
+        loop.run_until_complete(asyncio.wait_for(run_interval(start_run, loop=loop, **kwargs), run_for, loop=loop))
+    tasks[-1].cancel()
+    loop.run_until_complete(asyncio.wait(tasks, loop=loop))
+    loop.close()
+    return [round(t - starts[0], ndigits) for t in starts]
+
+
+def test_rate():
+    assert record_runs(0.05, run_for=0.95, every=0.2, mode='rate', jitter=0, if_running='skip') == [
+        0, 0.2, 0.4, 0.6, 0.8
+    ]
+
+
+def test_delay():
+    assert record_runs(0.1, run_for=0.95, every=0.2, mode='delay', jitter=0, if_running='skip') == [0, 0.3, 0.6, 0.9]
+
+
+def test_rate_skip(caplog):
+    assert record_runs(0.3, run_for=0.95, every=0.2, mode='rate', jitter=0, if_running='skip') == [0, 0.4, 0.8]
+    assert 'still running when next run was due, skipped 1 run' in caplog.log
+
+
+def test_rate_wait():
+    assert record_runs(0.3, run_for=0.95, every=0.2, mode='rate', jitter=0, if_running='wait') == [0, 0.3, 0.6, 0.9]
+
+
+def test_jitter():
+    starts = record_runs(0, run_for=0.95, ndigits=3, every=0.2, mode='rate', jitter=0.1, if_running='skip')
+    assert len(starts) in (4, 5)
+    # jitter doesn't accumulate
+    assert all(0.2 * i - 0.1 <= start <= 0.2 * i + 0.12 for i, start in enumerate(starts))
+
+
+def test_interval_cli(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+  interval: 0.2
+  run:
+  - echo run >> runs.txt
+"""})
+    p = subprocess.Popen(
+        [sys.executable, '-c', 'from donkey.cli import cli; cli()', 'foo', '--interval', '0.3'],
+        env=dict(os.environ, PYTHONPATH=PYTHONPATH),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+    time.sleep(1.5)
+    p.send_signal(signal.SIGINT)
+    out, _ = p.communicate(timeout=5)
+    assert p.returncode == 0, out
+    runs = tmpworkdir.join('runs.txt').read_text('utf8').count('run\n')
+    assert 4 <= runs <= 6, out
+
+
+def test_interval_invalid(tmpworkdir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    for value in ('0', '-1'):
+        result = CliRunner().invoke(cli, ['foo', '--interval', value])
+        assert result.exit_code == 2
+        assert 'Invalid value for "-i" / "--interval": must be greater than 0' in result.output
+    with pytest.raises(DonkeyError) as excinfo:
+        execute('foo', interval=0)
+    assert excinfo.value.args[0] == 'interval must be greater than 0'
@@ -0,0 +1,108 @@
+import gzip
+import logging
+import time
+from pathlib import Path
+
+from donkey.logfile import LogFile, LogFileHandler
+from donkey.main import execute
+
+from .conftest import mktree
+
+
+def test_write(tmpdir):
+    path = Path(tmpdir.strpath, 'logs', 'donkey.log')
+    log_file = LogFile(path)
+    log_file.start()
+    for i in range(1000):
+        log_file.write('\x1b[32mline {}\x1b[0m\n'.format(i))
+    logging.getLogger('donkey.main').warning('a warning')
+    log_file.close()
+    lines = path.read_text().split('\n')
+    assert lines[:2] == ['line 0', 'line 1']
+    assert lines[999] == 'line 999'
+    assert lines[1000].endswith(' a warning')
+    assert not any(isinstance(h, LogFileHandler) for h in logging.getLogger('donkey.main').handlers)
+
+
+def test_split_escape_sequence(tmpdir, mocker):
+    mocker.patch('donkey.logfile.BATCH_SIZE', 1)
+    path = Path(tmpdir.strpath, 'donkey.log')
+    log_file = LogFile(path)
+    assert log_file.queue.maxsize > 0
+    # queued before the writer starts so each chunk is a batch
+    for chunk in ('a\x1b', '[3', '2mb\x1b[0', 'm\n', 'c\x1b'):
+        log_file.write(chunk)
+    log_file.start()
+    log_file.close()
+    assert path.read_text() == 'ab\nc\x1b'
+
+
+def test_write_error(tmpdir, mocker, caplog):
+    path = Path(tmpdir.strpath, 'donkey.log')
+    log_file = LogFile(path)
+    mocker.patch.object(log_file, '_write', side_effect=OSError(28, 'No space left on device'))
+    log_file.start()
+    log_file.write('first\n')
+    log_file._thread.join()
+    assert isinstance(log_file.error, OSError)
+    for _ in range(log_file.queue.maxsize + 1):
+        log_file.write('more\n')
+    log_file.close()
+    assert caplog.log.count('unable to write to log file') == 1
+    assert 'No space left on device' in caplog.log
+
+
+def test_rotate_size(tmpdir):
+    path = Path(tmpdir.strpath, 'donkey.log')
+    log_file = LogFile(path, max_size=100, backups=3)
+    log_file.start()
+    for i in range(10):
+        log_file.write('{:>49}\n'.format(i))
+        # give the writer a chance to write each line separately
+        time.sleep(0.01)
+    log_file.close()
+    assert sorted(p.name for p in path.parent.iterdir()) == [
+        'donkey.log', 'donkey.log.1.gz', 'donkey.log.2.gz', 'donkey.log.3.gz'
+    ]
+    assert path.read_text().split() == ['8', '9']
+    assert gzip.open(str(path.with_name('donkey.log.1.gz'))).read().decode().split() == ['6', '7']
+    assert gzip.open(str(path.with_name('donkey.log.3.gz'))).read().decode().split() == ['2', '3']
+
+
+def test_rotate_time(tmpdir, mocker):
+    path = Path(tmpdir.strpath, 'donkey.log')
+    log_file = LogFile(path, rotate_every=100, compress=False)
+    log_file.start()
+    log_file.write('first\n')
+    log_file.close()
+
+    mocker.patch('donkey.logfile.time.time', return_value=time.time() + 100)
+    log_file = LogFile(path, rotate_every=100, compress=False)
+    log_file.start()
+    log_file.write('second\n')
+    log_file.close()
+    assert path.read_text() == 'second\n'
+    assert path.with_name('donkey.log.1').read_text() == 'first\n'
+
+
+def test_execute_log_file(tmpworkdir, caplog):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+.config:
+  logging:
+    file: logs/donkey.log
+foo:
+- echo hello
+"""})
+    execute('foo')
+    execute('foo', log_output=True)
+    log = tmpworkdir.join('logs/donkey.log').read_text('utf8')
+    lines = log.strip('\n').split('\n')
+    assert len(lines) == 4, log
+    assert lines[0].endswith(' 1: hello')
+    assert '"foo" finished in' in lines[1]
+    assert lines[2].endswith(' hello')
+    assert '"foo" finished in' in lines[3]
+
+    execute('foo', log_file='other.log')
+    assert '"foo" finished in' in tmpworkdir.join('other.log').read_text('utf8')
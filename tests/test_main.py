@@ -1,8 +1,12 @@
+import os
+import time
+from datetime import datetime
+
 import pytest
 
 from donkey.main import DonkeyError, DonkeyFailure, execute
 
-from .conftest import mktree
+from .conftest import mktree, normalise_log
 
 
 def test_successful_command(tmpworkdir):
@@ -32,13 +36,66 @@ def test_arguments(tmpworkdir, caplog):
 foo:
 - echo"""
     })
-    execute('foo', args='hello world')
+    execute('foo', args='hello world', log_output=True)
     print(caplog.log)
     assert """\
 donkey.commands: hello world
 donkey.main: "foo" finished in 0.0Xs, return codes: 0\n""" == caplog.normalised_log
 
 
+def test_output_direct(tmpworkdir, capsys, caplog):
+    mktree(tmpworkdir, {
+        'makefile.yml': """\
+foo:
+- echo hello
+- echo error >&2
+- printf 'no newline'"""
+    })
+    execute('foo')
+    out, err = capsys.readouterr()
+    assert normalise_log(out).startswith('TI:XX:ME 1: hello\nTI:XX:ME 2: error\nTI:XX:ME 1: no newline\n"foo"')
+    assert 'donkey.commands' not in caplog
+    assert 'donkey.main: "foo" finished' in caplog
+
+
+def test_output_continuation(tmpworkdir, capsys):
+    mktree(tmpworkdir, {
+        'makefile.yml': """\
+foo:
+- printf 'a'; sleep 0.05; printf 'b\\nc\\n'"""
+    })
+    execute('foo')
+    out, err = capsys.readouterr()
+    assert normalise_log(out).startswith('TI:XX:ME 1: ab\nTI:XX:ME 1: c\n"foo"')
+
+
+def test_background_process(tmpworkdir, capsys):
+    mktree(tmpworkdir, {
+        'makefile.yml': """\
+foo:
+- echo hello; sleep 3 &
+- echo after"""
+    })
+    start = time.time()
+    execute('foo')
+    # the background process holds stdout open but the command finishes once the shell exits
+    assert time.time() - start < 1
+    out, err = capsys.readouterr()
+    assert normalise_log(out).startswith('TI:XX:ME 1: hello\nTI:XX:ME 1: after\n')
+
+
+def test_output_split_character(tmpworkdir, capsys, mocker):
+    mocker.patch('donkey.output.locale.getpreferredencoding', return_value='utf8')
+    mktree(tmpworkdir, {
+        'makefile.yml': """\
+foo:
+- printf '\\342'; sleep 0.05; printf '\\227\\217 \\n'"""
+    })
+    execute('foo')
+    out, err = capsys.readouterr()
+    assert normalise_log(out).startswith('TI:XX:ME 1: \u25cf \n"foo"')
+
+
 def test_argument_in_script_mode(tmpworkdir):
     mktree(tmpworkdir, {
         'makefile.yml': """\
@@ -156,8 +213,8 @@ def test_logging_error(tmpworkdir, mocker):
     mktree(tmpworkdir, {
         'makefile.yml': 'foo:\n- echo hello\n',
     })
-    mock_getpreferredencoding = mocker.patch('donkey.main.locale.getpreferredencoding')
-    mock_getpreferredencoding.side_effect = RuntimeError('foobar')
+    mock_feed = mocker.patch('donkey.output.ProcessOutput.feed')
+    mock_feed.side_effect = RuntimeError('foobar')
     with pytest.raises(RuntimeError) as excinfo:
         execute('foo')
     assert excinfo.value.args[0] == 'foobar'
@@ -189,3 +246,264 @@ foo:
         execute('foo', 'foo')
     assert excinfo.value.args == ('commands failed, return codes: 0, 1', 1)
     assert tmpworkdir.join('foo.txt').exists()
+
+
+requires_files = {
+    'makefile.yml': """
+build:
+- echo build >> log.txt
+lint:
+  requires:
+  - build
+  run:
+  - echo lint >> log.txt
+test:
+  requires:
+  - build
+  run:
+  - echo test >> log.txt
+testall:
+  requires:
+  - lint
+  - test
+broken:
+- exit 3
+after-broken:
+  requires:
+  - broken
+  run:
+  - echo after-broken >> log.txt
+"""}
+
+
+def test_requires(tmpworkdir):
+    mktree(tmpworkdir, requires_files)
+    execute('test')
+    assert tmpworkdir.join('log.txt').read_text('utf8') == 'build\ntest\n'
+
+
+def test_requires_shared_once(tmpworkdir):
+    mktree(tmpworkdir, requires_files)
+    execute('testall')
+    assert tmpworkdir.join('log.txt').read_text('utf8') == 'build\nlint\ntest\n'
+
+
+def test_requires_shared_once_parallel(tmpworkdir):
+    mktree(tmpworkdir, requires_files)
+    execute('testall', parallel=True)
+    assert tmpworkdir.join('log.txt').read_text('utf8').startswith('build\n')
+    assert sorted(tmpworkdir.join('log.txt').read_text('utf8').split()) == ['build', 'lint', 'test']
+
+
+def test_requires_failed(tmpworkdir):
+    mktree(tmpworkdir, requires_files)
+    with pytest.raises(DonkeyFailure) as excinfo:
+        execute('after-broken')
+    assert excinfo.value.args == ('commands failed, return codes: 3', 3)
+    assert not tmpworkdir.join('log.txt').exists()
+
+
+def test_requires_failed_parallel(tmpworkdir, caplog):
+    mktree(tmpworkdir, requires_files)
+    with pytest.raises(DonkeyFailure) as excinfo:
+        execute('after-broken', 'build', parallel=True, keep_going=True)
+    assert excinfo.value.args == ('commands failed, return codes: 0, 3', 3)
+    assert tmpworkdir.join('log.txt').read_text('utf8') == 'build\n'
+    assert 'donkey.main: "after-broken" skipped since "broken" failed' in caplog
+
+
+def test_requires_missing(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+  requires:
+  - bar
+  run:
+  - echo foo
+"""})
+    with pytest.raises(DonkeyError) as excinfo:
+        execute('foo')
+    assert excinfo.value.args[0] == 'Command "foo" requires "bar" which is not defined'
+
+
+def test_requires_circular(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+  requires:
+  - bar
+  run:
+  - "echo foovalue > foo.txt"
+bar:
+  requires:
+  - spam
+spam:
+  requires:
+  - foo
+other:
+- echo other
+"""})
+    execute('other')
+    with pytest.raises(DonkeyError) as excinfo:
+        execute('bar')
+    assert excinfo.value.args[0] == 'Circular requirement: foo > bar > spam > foo'
+    with pytest.raises(DonkeyError) as excinfo:
+        execute('check')
+    assert excinfo.value.args[0] == 'Circular requirement: foo > bar > spam > foo'
+    assert not tmpworkdir.join('foo.txt').exists()
+
+
+def test_lazy_validation(tmpworkdir, caplog):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+- echo foo
+broken:
+  run: not a list
+  """
+    })
+    execute('foo')
+    with pytest.raises(DonkeyError) as excinfo:
+        execute('broken')
+    assert excinfo.value.args[0].startswith('Invalid definition file, ')
+    assert 'run: value is not a list' in excinfo.value.args[0]
+    with pytest.raises(DonkeyError) as excinfo:
+        execute('check')
+    assert 'run: value is not a list' in excinfo.value.args[0]
+
+
+def test_check(tmpworkdir, caplog):
+    mktree(tmpworkdir, {
+        'makefile.yml': 'foo:\n- "echo foovalue > foo.txt"\n',
+    })
+    assert execute('check', 'foo') == 0
+    assert not tmpworkdir.join('foo.txt').exists()
+    assert 'makefile.yml" is valid' in caplog
+
+
+def test_invalid_top_level(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+.config:
+  jobs: lots
+foo:
+- echo foo
+"""})
+    with pytest.raises(DonkeyError) as excinfo:
+        execute('foo')
+    assert excinfo.value.args[0].startswith('Invalid definition file, ')
+
+
+def test_timeout(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+slow:
+  timeout: 0.1
+  run:
+  - sleep 0.5; echo finished > slow.txt
+"""})
+    start = datetime.now()
+    with pytest.raises(DonkeyFailure) as excinfo:
+        execute('slow')
+    diff = (datetime.now() - start).total_seconds()
+    assert diff < 1
+    assert excinfo.value.args == ('commands failed, return codes: 124', 124)
+    # the time out was sent to the process group so sleep was stopped and "echo" never ran
+    time.sleep(0.6)
+    assert not tmpworkdir.join('slow.txt').exists()
+
+
+def process_running(pid):
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            # zombies have exited but are yet to be reaped
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/stat'), reason='/proc not available')
+def test_timeout_kill_group(tmpworkdir, mocker):
+    mocker.patch('donkey.main.KILL_GRACE_PERIOD', 0.2)
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+slow:
+  timeout: 0.1
+  run:
+  - (trap '' TERM; echo $BASHPID > pid.txt; exec sleep 30) & wait
+"""})
+    with pytest.raises(DonkeyFailure) as excinfo:
+        execute('slow')
+    assert excinfo.value.args == ('commands failed, return codes: 124', 124)
+    # the shell exited on SIGTERM, sleep ignored it so was killed after the grace period
+    pid = int(tmpworkdir.join('pid.txt').read_text('utf8'))
+    for _ in range(20):
+        if not process_running(pid):
+            break
+        time.sleep(0.05)
+    else:
+        os.kill(pid, 9)
+        raise AssertionError('process still running')
+
+
+def test_timeout_config(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+.config:
+  timeout: 1m
+fast:
+- echo finished > fast.txt
+slow:
+  timeout: 0.1s
+  run:
+  - sleep 2
+"""})
+    execute('fast')
+    assert tmpworkdir.join('fast.txt').exists()
+    with pytest.raises(DonkeyFailure) as excinfo:
+        execute('slow')
+    assert excinfo.value.args == ('commands failed, return codes: 124', 124)
+
+
+def test_timeout_invalid(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+.config:
+  timeout: soon
+foo:
+- echo foo
+"""})
+    with pytest.raises(DonkeyError) as excinfo:
+        execute('foo')
+    assert '.config.timeout' in excinfo.value.args[0]
+
+
+def test_targets_up_to_date(tmpworkdir, caplog):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+build:
+  sources:
+  - src/*.txt
+  targets:
+  - out.txt
+  run:
+  - cat src/*.txt > out.txt
+  - echo built >> log.txt
+""",
+        'src': {
+            'a.txt': 'a',
+        },
+    })
+    execute('build')
+    assert tmpworkdir.join('out.txt').read_text('utf8') == 'a'
+    assert tmpworkdir.join('log.txt').read_text('utf8') == 'built\n'
+
+    execute('build')
+    assert tmpworkdir.join('log.txt').read_text('utf8') == 'built\n'
+    assert 'donkey.main: "build" up to date' in caplog
+
+    tmpworkdir.join('src/b.txt').write('b')
+    os.utime(tmpworkdir.join('src/b.txt').strpath, (2e9, 2e9))
+    execute('build')
+    assert tmpworkdir.join('out.txt').read_text('utf8') == 'ab'
+    assert tmpworkdir.join('log.txt').read_text('utf8') == 'built\nbuilt\n'
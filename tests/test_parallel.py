@@ -1,6 +1,11 @@
+import io
 from datetime import datetime
 
-from donkey.main import execute
+import pytest
+
+from donkey.exceptions import DonkeyError
+from donkey.main import Cancelled, DonkeyFailure, execute
+from donkey.output import OutputPipeline
 
 from .conftest import mktree
 
@@ -20,7 +25,7 @@ spam:
     """,
     })
     start = datetime.now()
-    execute('foo', 'bar', 'spam', parallel=True)
+    execute('foo', 'bar', 'spam', parallel=True, jobs=3, log_output=True)
     diff = (datetime.now() - start).total_seconds()
     assert 0.1 < diff < 0.18
     log = caplog.normalised_log
@@ -43,8 +48,254 @@ foo:
     """})
     caplog.set_loggers('donkey.commands', fmt='%(name)s: %(message)s %(symbol)s')
     start = datetime.now()
-    execute('foo', parallel=True)
+    execute('foo', parallel=True, jobs=5, log_output=True)
     diff = (datetime.now() - start).total_seconds()
     assert 0.1 < diff < 0.15
     assert tmpworkdir.join('foo.txt').read_text('utf8') == 'foovalue\n'
     assert caplog.normalised_log.startswith('donkey.commands: foobar')
+
+
+def test_requires_start_early(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+slow:
+- sleep 0.1
+fast:
+- sleep 0.01
+after-fast:
+  requires:
+  - fast
+  run:
+  - sleep 0.05
+all:
+  requires:
+  - slow
+  - after-fast
+    """})
+    start = datetime.now()
+    execute('all', parallel=True, jobs=2)
+    diff = (datetime.now() - start).total_seconds()
+    assert 0.1 < diff < 0.18
+
+
+def test_jobs_limit(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+  parallel: true
+  run:
+  - sleep 0.1
+  - sleep 0.1
+  - sleep 0.1
+  - sleep 0.1
+    """})
+    start = datetime.now()
+    execute('foo', jobs=2)
+    diff = (datetime.now() - start).total_seconds()
+    assert 0.2 < diff < 0.28
+
+
+def test_jobs_config(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+- sleep 0.1
+bar:
+- sleep 0.1
+.config:
+  parallel: true
+  jobs: 1
+    """})
+    start = datetime.now()
+    execute('foo', 'bar')
+    diff = (datetime.now() - start).total_seconds()
+    assert 0.2 < diff < 0.28
+
+
+FAILING_FILES = {
+    'makefile.yml': """
+fails:
+- sleep 0.05
+- exit 3
+slow:
+- sleep 2; echo done > slow.txt
+after-slow:
+  requires:
+  - slow
+  run:
+  - touch after-slow.txt
+"""
+}
+
+
+def test_fail_fast(tmpworkdir, caplog):
+    mktree(tmpworkdir, FAILING_FILES)
+    start = datetime.now()
+    with pytest.raises(DonkeyFailure) as excinfo:
+        execute('fails', 'after-slow', parallel=True, jobs=3)
+    diff = (datetime.now() - start).total_seconds()
+    assert diff < 1
+    assert excinfo.value.args == ('commands failed, return codes: 0, 3, cancelled, cancelled', 3)
+    assert not tmpworkdir.join('slow.txt').exists()
+    assert not tmpworkdir.join('after-slow.txt').exists()
+    log = caplog.normalised_log
+    assert 'donkey.main: "slow" cancelled after 0.0Xs, return codes: cancelled' in log
+    assert 'donkey.main: "after-slow" cancelled since "fails" failed' in log
+
+
+def test_fail_fast_pending(tmpworkdir, caplog):
+    mktree(tmpworkdir, FAILING_FILES)
+    with pytest.raises(DonkeyFailure) as excinfo:
+        execute('fails', 'slow', parallel=True, jobs=1)
+    assert excinfo.value.args == ('commands failed, return codes: 0, 3, cancelled', 3)
+    assert not tmpworkdir.join('slow.txt').exists()
+
+
+def test_keep_going(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+fails:
+- exit 3
+slow:
+- sleep 0.1; echo done > slow.txt
+.config:
+  keep_going: true
+"""
+    })
+    with pytest.raises(DonkeyFailure) as excinfo:
+        execute('fails', 'slow', parallel=True, jobs=2)
+    assert excinfo.value.args == ('commands failed, return codes: 0, 3', 3)
+    assert tmpworkdir.join('slow.txt').exists()
+
+
+def test_fail_fast_single_parallel(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+  parallel: true
+  run:
+  - sleep 2
+  - exit 4
+  - sleep 2
+"""
+    })
+    start = datetime.now()
+    with pytest.raises(DonkeyFailure) as excinfo:
+        execute('foo', jobs=3)
+    diff = (datetime.now() - start).total_seconds()
+    assert diff < 1
+    assert excinfo.value.args == ('commands failed, return codes: 4, cancelled, cancelled', 4)
+
+
+def test_fail_fast_kill(tmpworkdir, mocker):
+    mocker.patch('donkey.main.KILL_GRACE_PERIOD', 0.1)
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+fails:
+- sleep 0.05
+- exit 3
+ignores-term:
+- trap "" TERM; sleep 2
+"""
+    })
+    start = datetime.now()
+    with pytest.raises(DonkeyFailure) as excinfo:
+        execute('fails', 'ignores-term', parallel=True, jobs=2)
+    diff = (datetime.now() - start).total_seconds()
+    assert diff < 1
+    assert excinfo.value.args == ('commands failed, return codes: 0, 3, cancelled', 3)
+
+
+def test_cancelled_exits_0(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+.config:
+  artifacts:
+    path: store
+    max_size: 1MB
+fails:
+- sleep 0.1; exit 3
+partial:
+  sources:
+  - input.txt
+  targets:
+  - out.txt
+  run:
+  - trap 'echo partial > out.txt; exit 0' TERM; sleep 2 & wait
+""",
+        'input.txt': 'input',
+    })
+    assert Cancelled(0)
+    with pytest.raises(DonkeyFailure) as excinfo:
+        execute('fails', 'partial', parallel=True, jobs=2)
+    assert excinfo.value.args == ('commands failed, return codes: 3, cancelled', 3)
+    assert tmpworkdir.join('out.txt').read_text('utf8') == 'partial\n'
+    # the partial target wasn't stored as an artifact
+    assert not tmpworkdir.join('store/manifests').exists()
+
+
+def test_grouped_output(tmpworkdir, capsys):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+- echo foo1; sleep 0.2; echo foo2
+bar:
+- sleep 0.1; echo bar1; sleep 0.2; echo bar2
+    """})
+    execute('foo', 'bar', parallel=True, jobs=2, output='grouped')
+    out, err = capsys.readouterr()
+    lines = [line.split(': ')[-1] for line in out.split('\n') if ' 1: ' in line]
+    assert lines[:4] == ['foo1', 'foo2', 'bar1', 'bar2'], out
+
+
+def test_grouped_output_spill(tmpworkdir, capsys):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+.config:
+  output:
+    mode: grouped
+    max_buffer: 100
+foo:
+- seq 1000
+    """})
+    execute('foo')
+    out, err = capsys.readouterr()
+    lines = [line.split(': ')[-1] for line in out.split('\n')]
+    assert lines[:1000] == [str(i) for i in range(1, 1001)]
+
+
+def test_job_output_buffer():
+    stream = io.StringIO()
+    pipeline = OutputPipeline(stream, grouped=True, max_buffer=10)
+    job = pipeline.job('foo')
+    assert pipeline.jobs == [job]
+    job.write('a' * 5 + '\n')
+    assert job._file is None
+    job.write('b' * 10 + '\n')
+    assert job._file is not None
+    job.write('c\n')
+    assert stream.getvalue() == ''
+    assert job.lines == 3
+    job.finish()
+    assert stream.getvalue() == 'aaaaa\nbbbbbbbbbb\nc\n'
+    assert pipeline.jobs == []
+
+
+def test_grouped_progress(tmpworkdir, caplog):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+.config:
+  output:
+    progress: 0.1
+foo:
+- echo foo; sleep 0.35
+    """})
+    execute('foo', output='grouped')
+    assert '"foo" running for 0s, 1 line of output' in caplog.log
+
+
+def test_grouped_log_output(tmpworkdir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    with pytest.raises(DonkeyError) as exc_info:
+        execute('foo', output='grouped', log_output=True)
+    assert 'grouped output can\'t be used with "--log-output"' in str(exc_info.value)
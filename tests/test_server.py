@@ -0,0 +1,137 @@
+import os
+import socket
+import stat
+import subprocess
+import sys
+import time
+
+import pytest
+
+import donkey
+from donkey.client import run_remote
+
+from .conftest import mktree, normalise_log
+
+PYTHONPATH = os.path.dirname(os.path.dirname(donkey.__file__))
+
+
+@pytest.yield_fixture
+def server(tmpdir, monkeypatch):
+    socket_path = tmpdir.join('server.sock').strpath
+    monkeypatch.setenv('DONKEY_SOCKET', socket_path)
+    env = dict(os.environ, PYTHONPATH=PYTHONPATH)
+    p = subprocess.Popen(
+        [sys.executable, '-c', 'from donkey.cli import cli; cli()', '--server'],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.05)
+    else:
+        p.kill()
+        raise RuntimeError('server not started: {}'.format(p.communicate()[0]))
+    yield p
+    p.terminate()
+    p.wait(5)
+    assert not os.path.exists(socket_path)
+
+
+def run_client_code(code, *args):
+    return subprocess.Popen(
+        [sys.executable, '-c', code] + list(args),
+        env=dict(os.environ, PYTHONPATH=PYTHONPATH),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+
+
+def run_client(*args):
+    return run_client_code('from donkey.client import main; main()', *args)
+
+
+def test_no_server(tmpdir, monkeypatch):
+    monkeypatch.setenv('DONKEY_SOCKET', tmpdir.join('missing.sock').strpath)
+    assert run_remote(['foo']) is None
+
+
+def test_server(tmpworkdir, server):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+- echo "foo $PPID"
+fails:
+- exit 3
+"""})
+    p = run_client('foo')
+    out, _ = p.communicate(timeout=5)
+    assert p.returncode == 0
+    lines = normalise_log(out).split('\n')
+    assert lines[0].startswith('TI:XX:ME 1: foo ')
+    assert lines[1] == '"foo" finished in 0.0Xs, return codes: 0'
+    # command was run by a process forked from the server, not the client
+    assert int(lines[0].split()[-1]) != p.pid
+
+    p = run_client('fails')
+    out, _ = p.communicate(timeout=5)
+    assert p.returncode == 3
+    assert 'Error: commands failed, return codes: 3' in out
+
+
+def test_server_reload(tmpworkdir, server):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo before\n'})
+    p = run_client('foo')
+    assert 'before' in p.communicate(timeout=5)[0]
+
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo "changed"\n'})
+    p = run_client('foo')
+    assert 'changed' in p.communicate(timeout=5)[0]
+
+
+def test_server_concurrent(tmpworkdir, server):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- sleep 0.5\n'})
+    start = time.time()
+    clients = [run_client('foo') for _ in range(3)]
+    for p in clients:
+        p.communicate(timeout=5)
+        assert p.returncode == 0
+    assert time.time() - start < 1.4
+
+
+def test_server_silent_client(tmpworkdir, server):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo "foo"\n'})
+    with socket.socket(socket.AF_UNIX) as silent:
+        silent.connect(os.environ['DONKEY_SOCKET'])
+        start = time.time()
+        p = run_client('foo')
+        out, _ = p.communicate(timeout=5)
+    assert p.returncode == 0
+    assert 'foo' in out
+    # not held up waiting for the silent client's request
+    assert time.time() - start < 3
+
+
+def test_socket_permissions(server):
+    mode = os.stat(os.environ['DONKEY_SOCKET']).st_mode
+    assert stat.S_IMODE(mode) == 0o600
+
+
+def test_server_interrupt(tmpworkdir, server):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- sleep 2; touch foo.txt\n'})
+    p = run_client('foo')
+    time.sleep(0.5)
+    p.kill()
+    time.sleep(2)
+    assert not tmpworkdir.join('foo.txt').exists()
+
+
+def test_version_mismatch(tmpworkdir, server):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo "foo $PPID"\n'})
+    p = run_client_code('import donkey.client as c; c.VERSION = "0.0.0"; c.main()', 'foo')
+    out, _ = p.communicate(timeout=5)
+    assert p.returncode == 0
+    # run by the client itself since the server refused the request
+    assert 'foo {}\n'.format(p.pid) in out
@@ -0,0 +1,177 @@
+import asyncio
+import io
+import time
+from datetime import datetime
+
+import pytest
+
+from donkey.main import DonkeyFailure, execute
+from donkey.output import OutputPipeline
+from donkey.session import ShellSession
+
+from .conftest import mktree, normalise_log
+
+
+def test_session(tmpworkdir, capsys, caplog):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+  session: true
+  run:
+  - echo one
+  - echo two >&2
+  - printf three
+  - echo $$ >> pids.txt
+  - echo $$ >> pids.txt
+"""})
+    execute('foo')
+    out, err = capsys.readouterr()
+    assert normalise_log(out).startswith('TI:XX:ME 1: one\nTI:XX:ME 2: two\nTI:XX:ME 1: three\n')
+    assert '"foo" finished in 0.0Xs, return codes: 0, 0, 0, 0, 0' in caplog.normalised_log
+    # $$ is the pid of the shell, not the subshell
+    pid1, pid2 = tmpworkdir.join('pids.txt').read_text('utf8').split()
+    assert pid1 == pid2
+
+
+def test_session_stop_on_failure(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+  session: true
+  run:
+  - cd /
+  - test ! -d makefile.yml
+  - exit 3
+  - touch foo.txt
+"""})
+    with pytest.raises(DonkeyFailure) as excinfo:
+        execute('foo')
+    assert excinfo.value.args == ('commands failed, return codes: 0, 0, 3', 3)
+    assert not tmpworkdir.join('foo.txt').exists()
+
+
+def test_session_config(tmpworkdir, capsys):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+.config:
+  session: true
+foo:
+- echo $$
+- echo $$
+py:
+  interpreter: python
+  run:
+  - import os; print(os.getpid())
+  - import os; print(os.getpid())
+"""})
+    execute('foo')
+    out, err = capsys.readouterr()
+    pid1, pid2 = [line.split()[-1] for line in out.split('\n')[:2]]
+    assert pid1 == pid2
+    # session mode isn't possible with python so each line runs in its own process
+    execute('py')
+    out, err = capsys.readouterr()
+    pid1, pid2 = [line.split()[-1] for line in out.split('\n')[:2]]
+    assert pid1 != pid2
+
+
+def test_session_background_process(tmpworkdir, capsys):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+  session: true
+  run:
+  - sleep 3 &
+  - echo after
+"""})
+    start = time.time()
+    execute('foo')
+    assert time.time() - start < 1
+    out, err = capsys.readouterr()
+    assert 'after' in out
+
+
+def test_session_timeout(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+  session: true
+  timeout: 0.1
+  run:
+  - sleep 0.01
+  - sleep 2
+  - touch foo.txt
+"""})
+    start = datetime.now()
+    with pytest.raises(DonkeyFailure) as excinfo:
+        execute('foo')
+    diff = (datetime.now() - start).total_seconds()
+    assert diff < 1
+    assert excinfo.value.args == ('commands failed, return codes: 0, 124', 124)
+    assert not tmpworkdir.join('foo.txt').exists()
+
+
+def test_split_marker():
+    stream = io.StringIO()
+    loop = asyncio.new_event_loop()
+    session = ShellSession('bash', loop=loop, output=OutputPipeline(stream))
+    session._line_done = asyncio.Future(loop=loop)
+    session._current = session.output.process({'symbol': '', 'colour': None})
+    data = b'hello\n\0\0' + session.marker + b'12\n'
+    for i in range(len(data)):
+        session.data_received(1, data[i:i + 1])
+    session.data_received(2, session.marker + b'12\n')
+    assert session._line_done.result() == 12
+    assert normalise_log(stream.getvalue()) == 'TI:XX:ME 1: hello\nTI:XX:ME 1: \0\0\n'
+    loop.close()
+
+
+WORKER_FILES = {
+    'makefile.yml': """
+.config:
+  python_workers:
+    preload:
+    - fractions
+    max_tasks: 3
+pid:
+  interpreter: python
+  run:
+  - import os, sys; print(os.getpid(), 'fractions' in sys.modules)
+  - import os; print(os.getpid()); os.chdir('/'); os.environ['FOO'] = 'x'
+  - import os; print(os.getpid(), os.path.exists('makefile.yml'), 'FOO' in os.environ)
+  - import os; print(os.getpid())
+fails:
+  interpreter: python
+  run:
+  - import sys; sys.exit(3)
+error:
+  interpreter: python
+  run:
+  - raise ValueError('broken')
+"""
+}
+
+
+def test_python_workers(tmpworkdir, capsys):
+    mktree(tmpworkdir, WORKER_FILES)
+    execute('pid')
+    out, err = capsys.readouterr()
+    lines = [line.split(': ', 1)[1].split() for line in out.strip('\n').split('\n')]
+    assert lines[0][1:] == ['True']
+    assert lines[2][1:] == ['True', 'False']
+    pids = [line[0] for line in lines]
+    # the worker is replaced after max_tasks
+    assert pids[0] == pids[1] == pids[2]
+    assert pids[3] != pids[0]
+
+
+def test_python_workers_exit_code(tmpworkdir, capsys):
+    mktree(tmpworkdir, WORKER_FILES)
+    with pytest.raises(DonkeyFailure) as excinfo:
+        execute('fails')
+    assert excinfo.value.args == ('commands failed, return codes: 3', 3)
+    with pytest.raises(DonkeyFailure) as excinfo:
+        execute('error')
+    assert excinfo.value.args == ('commands failed, return codes: 1', 1)
+    out, err = capsys.readouterr()
+    assert '2: ValueError: broken\n' in out
@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+import time
+
+import donkey
+
+from .conftest import mktree
+
+# modules which are slow to import and should only be imported when needed
+HEAVY_MODULES = {'asyncio', 'distutils', 'logging.config', 'trafaret', 'trafaret_config', 'yaml'}
+# generous to avoid flaky failures on slow machines, importing trafaret, yaml and asyncio would easily exceed it
+STARTUP_THRESHOLD = float(os.getenv('DONKEY_STARTUP_THRESHOLD', '0.15'))
+
+
+def run_python(code, **kwargs):
+    # make sure donkey is importable even from another directory and if it's not installed
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(donkey.__file__)))
+    return subprocess.run([sys.executable, '-c', code], env=env, check=True, **kwargs)
+
+
+def imported_modules(code):
+    code += '\nimport sys\nprint(" ".join(sys.modules))'
+    p = run_python(code, stdout=subprocess.PIPE, universal_newlines=True)
+    return set(p.stdout.split())
+
+
+def test_version_imports():
+    modules = imported_modules("""
+from click.testing import CliRunner
+from donkey.cli import cli
+result = CliRunner().invoke(cli, ['--version'])
+assert result.output.startswith('donkey, version'), result.output
+""")
+    assert 'donkey.cli' in modules
+    assert not modules & HEAVY_MODULES
+    assert 'donkey.main' not in modules
+
+
+def test_client_imports(tmpdir):
+    modules = imported_modules("""
+import os
+os.environ['DONKEY_SOCKET'] = {!r}
+from donkey.client import run_remote
+assert run_remote(['foo']) is None
+""".format(tmpdir.join('missing.sock').strpath))
+    assert not modules & (HEAVY_MODULES | {'click', 'donkey.cli', 'pathlib'})
+
+
+def test_cached_definition_imports(tmpworkdir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    os.utime('makefile.yml', (1e9, 1e9))
+    code = """
+from donkey.definition import load_definition
+assert load_definition().get_commands(['foo'])['foo']['run'] == ['echo foo']
+"""
+    assert {'yaml', 'trafaret'} <= imported_modules(code)
+    assert not imported_modules(code) & HEAVY_MODULES
+
+
+def min_run_time(code):
+    times = []
+    for _ in range(5):
+        start = time.perf_counter()
+        run_python(code)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def test_startup_time():
+    overhead = min_run_time('import donkey.cli') - min_run_time('pass')
+    assert overhead < STARTUP_THRESHOLD
@@ -0,0 +1,76 @@
+import json
+
+from click.testing import CliRunner
+
+from donkey.cli import cli
+from donkey.main import execute
+from donkey.trace import get_tracer, span, start_trace, stop_trace
+
+from .conftest import mktree
+
+
+def load_trace(path):
+    with open(path) as f:
+        data = json.load(f)
+    events = data['traceEvents']
+    rows = {e['tid']: e['args']['name'] for e in events if e['ph'] == 'M'}
+    return rows, [e for e in events if e['ph'] == 'X']
+
+
+def test_not_tracing():
+    assert get_tracer() is None
+    with span('foo'):
+        pass
+
+
+def test_trace(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+- sleep 0.1; echo foo
+- echo foo2
+bar:
+- echo bar; sleep 0.1
+session:
+  session: true
+  run:
+  - echo a
+  - echo b
+"""})
+    start_trace('trace.json')
+    execute('foo', 'bar', 'session', parallel=True, jobs=3)
+    stop_trace()
+    assert get_tracer() is None
+
+    rows, events = load_trace('trace.json')
+    assert rows == {0: 'donkey', 1: 'job 1', 2: 'job 2', 3: 'job 3'}
+    names = {e['name'] for e in events if e['tid'] == 0}
+    assert {'find_def_file', 'load yaml', 'validate', 'validate command', 'loop setup', 'runner setup'} <= names
+
+    jobs = {e['name']: e for e in events if e['cat'] == 'job'}
+    assert set(jobs) == {'foo', 'bar', 'session'}
+    assert len({e['tid'] for e in jobs.values()}) == 3
+    assert jobs['foo']['dur'] > 100000
+
+    foo_row = jobs['foo']['tid']
+    processes = [e for e in events if e['cat'] == 'process' and e['tid'] == foo_row]
+    assert [e['name'] for e in processes] == ['sleep 0.1; echo foo', 'echo foo2']
+    assert processes[0]['args'] == {'return code': '0'}
+    startup = [e for e in events if e['cat'] == 'startup' and e['tid'] == foo_row]
+    assert len(startup) == 2
+    # output from the first process only starts after "sleep 0.1"
+    assert startup[0]['dur'] > 100000
+    assert startup[0]['ts'] == processes[0]['ts']
+
+    lines = [e['name'] for e in events if e['cat'] == 'line']
+    assert lines == ['echo a', 'echo b']
+
+
+def test_trace_cli(tmpworkdir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    result = CliRunner().invoke(cli, ['foo', '--trace', 'trace.json'])
+    assert result.exit_code == 0, result.output
+    rows, events = load_trace('trace.json')
+    assert rows == {0: 'donkey', 1: 'job 1'}
+    assert [e['name'] for e in events if e['cat'] == 'job'] == ['foo']
+    assert 'import' in {e['name'] for e in events}
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import os
+import resource
+import sys
+
+import pytest
+
+from donkey import usage as usage_module
+from donkey.definition import load_definition
+from donkey.events import EventWriter
+from donkey.main import JobResult, Runner, execute, loop_context
+from donkey.usage import CAN_WAIT4, Usage, combine, format_usage, usage_between
+
+from .conftest import mktree
+
+needs_wait4 = pytest.mark.skipif(not CAN_WAIT4, reason='os.wait4 not available')
+
+
+def test_combine():
+    assert combine([]) is None
+    assert combine([Usage(1, 2, 100, 1, 2, 3, 4), Usage(0.5, 0.5, 300, 1, 1, 1, 1)]) == (1.5, 2.5, 300, 2, 3, 4, 5)
+
+
+def test_usage_between():
+    assert usage_between(Usage(1, 2, 300, 1, 2, 3, 4), Usage(1.5, 2.5, 200, 2, 3, 4, 5)) == (0.5, 0.5, 200, 1, 1, 1, 1)
+
+
+def test_format_usage():
+    assert format_usage(Usage(0.5, 0.25, 2 ** 20, 1, 2, 3, 4), 1.5) == (
+        'cpu 0.75s (50%), user 0.50s, system 0.25s, max rss 1.0MB, '
+        'blocks read 1, written 2, context switches 3 voluntary, 4 involuntary'
+    )
+
+
+def run(*commands, **kwargs):
+    definition = load_definition()
+    def_data = definition.get_commands(commands)
+    with loop_context() as loop:
+        runner = Runner(definition, commands, def_data, loop=loop, parallel=False, args=None, jobs=1,
+                        keep_going=False, timeout=None, log_output=False, output_mode=None, log_file=None,
+                        isolate=False, **kwargs)
+        task, _ = runner.start()
+        loop.run_until_complete(task)
+        loop.run_until_complete(runner.close())
+    return runner.results
+
+
+@needs_wait4
+def test_results(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+cpu:
+- {python} -c "sum(range(3 * 10 ** 6))"
+- {python} -c "x = bytearray(50 * 2 ** 20)"
+session:
+  session: true
+  run:
+  - echo a
+  - exit 2
+""".format(python=sys.executable)})
+    results = run('cpu')
+    assert len(results) == 1
+    result = results[0]
+    assert isinstance(result, JobResult)
+    assert result.name == 'cpu'
+    assert result.return_codes == [0, 0]
+    assert result.usage.user > 0.05
+    assert 50 * 2 ** 20 < result.usage.max_rss < 200 * 2 ** 20
+
+    results = run('session')
+    assert results[0].return_codes == [0, 2]
+    assert results[0].usage.max_rss > 0
+
+
+@needs_wait4
+def test_report(tmpworkdir, caplog):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+- echo foo
+bar:
+- echo bar
+"""})
+    execute('foo', 'bar', usage=True)
+    log = caplog.log
+    assert '"foo" used cpu ' in log
+    assert '"bar" used cpu ' in log
+    assert 'total cpu ' in log
+
+    caplog.stream.truncate(0)
+    execute('foo')
+    assert 'used cpu' not in caplog.log
+
+
+@needs_wait4
+def test_watcher_reused(tmpworkdir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo foo\n'})
+    run('foo')
+    watcher = usage_module._watcher
+    assert isinstance(watcher, usage_module.RusageChildWatcher)
+    before = set(watcher.usage)
+    run('foo')
+    assert usage_module._watcher is watcher
+    # usage of the command was popped
+    assert set(watcher.usage) <= before
+
+
+@needs_wait4
+def test_usage_expired(mocker):
+    mocker.patch('donkey.usage.MAX_USAGE', 2)
+    watcher = usage_module.RusageChildWatcher()
+    for pid in (1, 2, 3):
+        mocker.patch('donkey.usage.os.wait4', return_value=(pid, 0, resource.getrusage(resource.RUSAGE_SELF)))
+        watcher._callbacks[pid] = (lambda *args: None, ())
+        watcher._do_waitpid(pid)
+    assert list(watcher.usage) == [2, 3]
+
+    watcher.remove_child_handler(2)
+    assert list(watcher.usage) == [3]
+    watcher.close()
+    assert watcher.usage == {}
+
+
+def test_no_wait4(mocker):
+    mocker.patch('donkey.usage.CAN_WAIT4', False)
+    mocker.patch('donkey.usage._watcher', None)
+    policy = asyncio.get_event_loop_policy()
+    watcher = getattr(policy, '_watcher', None)
+    usage_module.install_watcher()
+    assert getattr(policy, '_watcher', None) is watcher
+    assert usage_module.pop_usage(123) is None
+
+
+def test_no_wait4_total(tmpworkdir, mocker, caplog):
+    mocker.patch('donkey.main.CAN_WAIT4', False)
+    mocker.patch('donkey.usage.CAN_WAIT4', False)
+    mocker.patch('donkey.usage._watcher', None)
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+- {python} -c "sum(range(3 * 10 ** 6))"
+""".format(python=sys.executable)})
+    fd = os.open('events.jsonl', os.O_WRONLY | os.O_CREAT)
+    try:
+        execute('foo', usage=True, events=EventWriter(fd))
+    finally:
+        os.close(fd)
+    log = caplog.log
+    assert 'resource usage of each command isn\'t available with python' in log
+    assert '"foo" used cpu ' not in log
+    assert 'total cpu ' in log
+    with open('events.jsonl') as f:
+        events = [json.loads(line) for line in f]
+    assert events[-2]['usage'] is None
+    assert events[-1]['event'] == 'run_finished'
+    assert events[-1]['usage']['user'] > 0.05
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import donkey
+from donkey.watch import Watcher, split_pattern
+
+from .conftest import mktree
+
+PYTHONPATH = os.path.dirname(os.path.dirname(donkey.__file__))
+
+
+def test_split_pattern(tmpworkdir):
+    mktree(tmpworkdir, {'src': {'foo.py': '', 'sub': {'bar.py': ''}}})
+    cwd = os.getcwd()
+    assert split_pattern('src') == (cwd + '/src', True, cwd + '/src/*')
+    assert split_pattern('src/foo.py') == (cwd + '/src', False, cwd + '/src/foo.py')
+    assert split_pattern('src/*.py') == (cwd + '/src', False, cwd + '/src/*.py')
+    assert split_pattern('src/**/*.py') == (cwd + '/src', True, cwd + '/src/**/*.py')
+
+
+def test_split_pattern_missing(tmpworkdir):
+    mktree(tmpworkdir, {'src': {'foo.py': ''}})
+    cwd = os.getcwd()
+    assert split_pattern('missing/*.py') == (cwd, True, cwd + '/missing/*.py')
+    assert split_pattern('src/missing/sub/foo.py') == (cwd + '/src', True, cwd + '/src/missing/sub/foo.py')
+    # a file in place of a directory
+    assert split_pattern('src/foo.py/*.py') == (cwd + '/src', True, cwd + '/src/foo.py/*.py')
+
+
+def test_coalesce(tmpworkdir):
+    mktree(tmpworkdir, {'src': {'foo.py': ''}})
+    loop = asyncio.new_event_loop()
+    watcher = Watcher(['src'], loop=loop, ignore=['node_modules', '*.pyc'], ignore_paths=['src/out.txt'],
+                      debounce=0.05)
+
+    def change():
+        for i in range(5000):
+            watcher.path_changed(os.path.abspath('src/file_{}.py'.format(i)))
+        watcher.path_changed(os.path.abspath('src/node_modules/foo.js'))
+        watcher.path_changed(os.path.abspath('src/foo.pyc'))
+        watcher.path_changed(os.path.abspath('src/out.txt'))
+        watcher.path_changed(os.path.abspath('other.py'))
+
+    threading.Thread(target=change).start()
+    changes = loop.run_until_complete(asyncio.wait_for(watcher.wait(), 2, loop=loop))
+    assert len(changes) == 5000
+    assert all('file_' in path for path in changes)
+    loop.close()
+
+
+def run_watch(tmpworkdir, *args):
+    return subprocess.Popen(
+        [sys.executable, '-c', 'from donkey.cli import cli; cli()'] + list(args),
+        env=dict(os.environ, PYTHONPATH=PYTHONPATH),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+
+
+def stop(p):
+    p.send_signal(signal.SIGINT)
+    out, _ = p.communicate(timeout=5)
+    assert p.returncode == 0, out
+    return out
+
+
+def test_watch(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+foo:
+  watch:
+  - src/*.txt
+  run:
+  - echo run >> runs.txt
+""",
+        'src': {'a.txt': ''},
+    })
+    p = run_watch(tmpworkdir, 'foo')
+    time.sleep(1)
+    assert tmpworkdir.join('runs.txt').read_text('utf8') == 'run\n'
+    for i in range(200):
+        tmpworkdir.join('src/file_{}.txt'.format(i)).write('x')
+    tmpworkdir.join('src/other.py').write('x')
+    time.sleep(1)
+    out = stop(p)
+    assert tmpworkdir.join('runs.txt').read_text('utf8') == 'run\nrun\n', out
+    assert '200 files changed, running again' in out
+
+
+def test_watch_cancel(tmpworkdir):
+    mktree(tmpworkdir, {
+        'makefile.yml': """
+.config:
+  watcher:
+    on_change: cancel
+    debounce: 0.05
+foo:
+- echo start >> runs.txt; sleep 1; echo end >> runs.txt
+""",
+        'src': {'a.txt': ''},
+    })
+    p = run_watch(tmpworkdir, 'foo', '--watch', 'src')
+    time.sleep(0.5)
+    tmpworkdir.join('src/a.txt').write('x')
+    time.sleep(1.8)
+    out = stop(p)
+    assert tmpworkdir.join('runs.txt').read_text('utf8') == 'start\nstart\nend\n', out
+    assert '"foo" cancelled after' in out
+
+
+def test_watch_missing_dir(tmpworkdir):
+    mktree(tmpworkdir, {'makefile.yml': 'foo:\n- echo run >> runs.txt\n'})
+    p = run_watch(tmpworkdir, 'foo', '--watch', 'missing/*.py')
+    time.sleep(1)
+    tmpworkdir.join('missing/foo.py').write('x', ensure=True)
+    time.sleep(1)
+    out = stop(p)
+    assert tmpworkdir.join('runs.txt').read_text('utf8') == 'run\nrun\n', out